@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from metadata_cache import TTLCache
+
+# Cache settings
+ANALYSIS_FRESH_SECONDS = int(os.getenv("ANALYSIS_CACHE_FRESH_SECONDS", "300"))
+ANALYSIS_STALE_SECONDS = int(os.getenv("ANALYSIS_CACHE_STALE_SECONDS", "3600"))
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1000"))
+# How long a token is trusted without asking Spotify; keep it well below the
+# one-hour access token lifetime, so expired or revoked tokens stop working
+ANALYSIS_TOKEN_SECONDS = int(os.getenv("ANALYSIS_CACHE_TOKEN_SECONDS", "300"))
+
+
+def compute_etag(analysis: Dict[str, Any]) -> str:
+    """Strong ETag for an analysis body"""
+    body = json.dumps(analysis, sort_keys=True, default=str, separators=(",", ":"))
+    return f'"{hashlib.sha256(body.encode()).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header value matches the current ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+def _token_key(access_token: str) -> str:
+    # Never keep raw access tokens in memory longer than the request needs them
+    return hashlib.sha256(access_token.encode()).hexdigest()
+
+
+class CachedAnalysis:
+    """A computed analysis with its ETag and creation time"""
+
+    def __init__(self, analysis: Dict[str, Any], created_at: float):
+        self.analysis = analysis
+        self.etag = compute_etag(analysis)
+        self.created_at = created_at
+
+
+class AnalysisResponseCache:
+    """Per-user cache of computed /user/analysis responses
+
+    Entries younger than fresh_seconds are served as-is. Entries older than
+    that but younger than fresh_seconds + stale_seconds are served
+    immediately while the caller recomputes in the background
+    (stale-while-revalidate). Access tokens are mapped to their user for
+    only token_seconds, after which the token is checked with Spotify again.
+    """
+
+    def __init__(self, fresh_seconds: float = ANALYSIS_FRESH_SECONDS,
+                 stale_seconds: float = ANALYSIS_STALE_SECONDS,
+                 max_size: int = ANALYSIS_CACHE_SIZE,
+                 clock: Callable[[], float] = time.monotonic,
+                 token_seconds: float = ANALYSIS_TOKEN_SECONDS):
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = stale_seconds
+        self._clock = clock
+        self._entries = TTLCache(fresh_seconds + stale_seconds, max_size, clock)
+        # Access token -> user profile, so cache hits need no Spotify call at all
+        self._users = TTLCache(token_seconds, max_size, clock)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, days_back: int) -> Optional[CachedAnalysis]:
+        return self._entries.get((user_id, days_back))
+
+    def put(self, user_id: str, days_back: int, analysis: Dict[str, Any]) -> CachedAnalysis:
+        entry = CachedAnalysis(analysis, self._clock())
+        self._entries.set((user_id, days_back), entry)
+        return entry
+
+    def is_fresh(self, entry: CachedAnalysis) -> bool:
+        return self._clock() - entry.created_at < self.fresh_seconds
+
+    def max_age(self, entry: CachedAnalysis) -> int:
+        """Seconds the entry stays fresh, for Cache-Control"""
+        return max(int(self.fresh_seconds - (self._clock() - entry.created_at)), 0)
+
+    def invalidate(self, user_id: str, days_back: int):
+        self._entries.delete((user_id, days_back))
+
+    def clear(self):
+        self._entries.clear()
+        self._users.clear()
+
+    def remember_user(self, access_token: str, user_profile: Dict[str, Any]):
+        self._users.set(_token_key(access_token), user_profile)
+
+    def lookup_user(self, access_token: str) -> Optional[Dict[str, Any]]:
+        return self._users.get(_token_key(access_token))
+
+    def start_refresh(self, user_id: str, days_back: int) -> bool:
+        """Claim the background refresh for a key; False if one is running"""
+        with self._lock:
+            if (user_id, days_back) in self._refreshing:
+                return False
+            self._refreshing.add((user_id, days_back))
+            return True
+
+    def finish_refresh(self, user_id: str, days_back: int):
+        with self._lock:
+            self._refreshing.discard((user_id, days_back))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            refreshing = len(self._refreshing)
+        return {**self._entries.stats(), "refreshing": refreshing}
+
+
+_analysis_cache: Optional[AnalysisResponseCache] = None
+_analysis_cache_lock = threading.Lock()
+
+
+def get_analysis_cache() -> AnalysisResponseCache:
+    """Get the process-wide analysis response cache"""
+    global _analysis_cache
+    if _analysis_cache is None:
+        with _analysis_cache_lock:
+            if _analysis_cache is None:
+                _analysis_cache = AnalysisResponseCache()
+    return _analysis_cache
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from data_processor import SpotifyDataProcessor, ListeningAggregate
+from metadata_cache import MetadataCache, get_metadata_cache
+from spotify_client import MAX_RECENT_TRACKS
+from timeutils import TimeBuckets
+
+# Maximum number of Spotify calls in flight for a single analysis
+FETCH_CONCURRENCY = int(os.getenv("SPOTIFY_FETCH_CONCURRENCY", "7"))
+
+# Count recently-played pages as they arrive instead of collecting the plays
+# (used when the play log is disabled)
+STREAM_RECENT_TRACKS = os.getenv("STREAM_RECENT_TRACKS", "false").lower() in ("1", "true", "yes")
+
+TIME_RANGES = ("short_term", "medium_term", "long_term")
+
+
+def _input_name(kind: str, time_range: str) -> str:
+    """Name of a top-items input, e.g. top_artists_short"""
+    return f"{kind}_{time_range.split('_')[0]}"
+
+
+def _analysis_calls(client, days_back: int,
+                    recent_tracks: Optional[Callable] = None) -> Dict[str, Tuple[Callable, tuple]]:
+    """Map each input of the analysis to the client call that produces it"""
+    calls = {"user_profile": (client.get_user_profile, ())}
+    for time_range in TIME_RANGES:
+        calls[_input_name("top_artists", time_range)] = (client.get_top_artists, (time_range, 50))
+    for time_range in TIME_RANGES:
+        calls[_input_name("top_tracks", time_range)] = (client.get_top_tracks, (time_range, 50))
+    calls["recent_tracks"] = (recent_tracks or client.get_all_recent_tracks, (days_back,))
+    return calls
+
+
+async def stream_listening_aggregate(client, days_back: int = 30, buckets: Optional[TimeBuckets] = None,
+                                     max_items: int = MAX_RECENT_TRACKS) -> ListeningAggregate:
+    """Fold recently-played pages into a ListeningAggregate as they arrive
+
+    Each page is counted and dropped before the next one is requested, so
+    memory grows with the unique tracks and artists rather than with the
+    number of plays and their nested track objects.
+    """
+    aggregate = ListeningAggregate()
+    async for page in client.iter_recent_track_pages(days_back, max_items=max_items):
+        aggregate.add_plays(page, buckets)
+    return aggregate
+
+
+async def _call(func: Callable, *args) -> Any:
+    """Await coroutine functions directly, run blocking ones in a worker thread"""
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args)
+    return await asyncio.to_thread(func, *args)
+
+
+async def fetch_analysis_inputs(client, days_back: int = 30,
+                                max_concurrency: int = FETCH_CONCURRENCY,
+                                user_profile: Optional[Dict[str, Any]] = None,
+                                recent_tracks: Optional[Callable] = None) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """Fetch every Spotify resource the analysis needs concurrently
+
+    Returns the fetched data keyed by input name and the wall-clock duration
+    of each call in milliseconds, plus the duration of the whole stage as "total".
+    A user_profile the caller already has is used as-is instead of refetched,
+    and recent_tracks(days_back) replaces client.get_all_recent_tracks when given.
+    It may return the plays or a ListeningAggregate of them.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    timings: Dict[str, float] = {}
+
+    async def run(name: str, func: Callable, args: tuple) -> Tuple[str, Any]:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                return name, await _call(func, *args)
+            finally:
+                timings[name] = (time.perf_counter() - start) * 1000
+
+    calls = _analysis_calls(client, days_back, recent_tracks)
+    if user_profile is not None:
+        del calls["user_profile"]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run(name, func, args) for name, (func, args) in calls.items()))
+    timings["total"] = (time.perf_counter() - start) * 1000
+    inputs = dict(results)
+    if user_profile is not None:
+        inputs["user_profile"] = user_profile
+    return inputs, timings
+
+
+def remember_metadata(inputs: Dict[str, Any], cache: Optional[MetadataCache] = None):
+    """Share the full artist and track objects from an analysis with other users
+
+    Top items come back as complete Spotify objects, so later artist lookups
+    for any user can be answered from the metadata cache. Each type is
+    written as one batch, so the SQL tier sees one upsert per type. This
+    blocks on the database, so async callers run it in a thread.
+    """
+    cache = cache or get_metadata_cache()
+    artists = []
+    tracks = []
+    for time_range in TIME_RANGES:
+        artists.extend(inputs.get(_input_name("top_artists", time_range), []))
+        tracks.extend(inputs.get(_input_name("top_tracks", time_range), []))
+    recent_tracks = inputs.get("recent_tracks", [])
+    # A play log summary (ListeningAggregate) carries counts, not track objects
+    if isinstance(recent_tracks, list):
+        tracks.extend(play.get("track") for play in recent_tracks)
+    cache.put_many("artist", artists)
+    cache.put_many("track", tracks)
+
+
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """Format per-call timings as a Server-Timing header value"""
+    return ", ".join(f"{name};dur={duration:.1f}" for name, duration in timings.items())
+
+
+def build_analysis(processor: SpotifyDataProcessor, inputs: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn the fetched Spotify data into the analysis response"""
+    user_profile = inputs["user_profile"]
+    top_artists = {time_range: inputs[_input_name("top_artists", time_range)] for time_range in TIME_RANGES}
+    top_tracks = {time_range: inputs[_input_name("top_tracks", time_range)] for time_range in TIME_RANGES}
+    metrics = processor.analyze_all(inputs["recent_tracks"], top_artists, top_tracks)
+
+    analysis = {
+        "user_profile": {
+            "id": user_profile["id"],
+            "name": user_profile["display_name"],
+            "followers": user_profile.get("followers", {}).get("total", 0)
+        },
+        "listening_history": metrics["listening_history"],
+        "top_artists": {time_range: artists[:10] for time_range, artists in top_artists.items()},
+        "top_tracks": {time_range: tracks[:10] for time_range, tracks in top_tracks.items()},
+        "track_characteristics": metrics["track_characteristics"],
+        "genre_diversity": metrics["genre_diversity"],
+        "obscurity_score": metrics["obscurity_score"]
+    }
+
+    # Calculate overall uniqueness
+    analysis["uniqueness_score"] = processor.calculate_uniqueness_score(analysis)
+
+    # Generate insights
+    analysis["insights"] = processor.generate_insights(analysis)
+
+    return analysis
+
+
+def split_genre_counts(analysis: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """Remove the full genre counts from an analysis and return them
+
+    They are only stored (as user_genres rows), so they are taken out
+    before the analysis is returned or cached, keeping the response to the
+    top 10 genre_distribution.
+    """
+    return analysis.get("genre_diversity", {}).pop("genre_counts", None)
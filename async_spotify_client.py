@@ -0,0 +1,260 @@
+import asyncio
+import os
+import httpx
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from http_session import HTTP_POOL_SIZE, HTTP_TIMEOUT, HTTP_RETRIES, HTTP_RETRY_BACKOFF, HTTP_RETRY_STATUSES
+from rate_limiter import RequestScheduler, get_scheduler, parse_retry_after, INTERACTIVE
+from metadata_cache import MetadataCache, get_metadata_cache
+from spotify_client import (
+    RecentTracksPager, MAX_RECENT_TRACKS, DETAILS_CONCURRENCY, chunk_unique_ids, align_to_input
+)
+
+HTTP_KEEPALIVE = int(os.getenv("SPOTIFY_HTTP_KEEPALIVE", "20"))
+
+_http_pool: Optional[httpx.AsyncClient] = None
+_pool_transport: Optional["PoolTransport"] = None
+
+# Artist-detail chunk requests in flight, shared by every client on the event loop
+_details_slots: Optional[asyncio.Semaphore] = None
+_details_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class PoolTransport(httpx.AsyncBaseTransport):
+    """Transport of the shared pool: connection counters and the 5xx retry policy
+
+    New connections are counted through httpcore's trace hook, so, as in
+    http_session.get_connection_stats, every request that did not open one
+    reused a kept-alive connection. As with the requests Session, only GETs
+    are retried, only on HTTP_RETRY_STATUSES, at most retries times with
+    exponential backoff; failed connects are retried by the wrapped
+    transport. 429s are left to the caller so rate limiting stays in one place.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, retries: int = HTTP_RETRIES,
+                 backoff: float = HTTP_RETRY_BACKOFF, sleep: Callable = asyncio.sleep):
+        self.transport = transport
+        self.retries = retries
+        self.backoff = backoff
+        self._sleep = sleep
+        self.hosts: Dict[str, Dict[str, int]] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self.hosts.setdefault(request.url.host, {"requests": 0, "new_connections": 0, "retries": 0})
+        trace = request.extensions.get("trace")
+
+        async def count_connections(event_name: str, info: Dict):
+            if event_name == "connection.connect_tcp.complete":
+                stats["new_connections"] += 1
+            if trace is not None:
+                await trace(event_name, info)
+
+        request.extensions["trace"] = count_connections
+        attempt = 0
+        while True:
+            stats["requests"] += 1
+            response = await self.transport.handle_async_request(request)
+            if request.method != "GET" or response.status_code not in HTTP_RETRY_STATUSES or attempt >= self.retries:
+                return response
+            await response.aclose()
+            stats["retries"] += 1
+            await self._sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    def stats(self) -> Dict:
+        hosts = {host: {**stats, "reused_connections": max(stats["requests"] - stats["new_connections"], 0)}
+                 for host, stats in self.hosts.items()}
+        return {
+            **{name: sum(stats[name] for stats in hosts.values())
+               for name in ("requests", "new_connections", "reused_connections", "retries")},
+            "hosts": hosts
+        }
+
+
+def _create_http_pool() -> httpx.AsyncClient:
+    global _pool_transport
+    limits = httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_KEEPALIVE)
+    _pool_transport = PoolTransport(httpx.AsyncHTTPTransport(limits=limits, retries=HTTP_RETRIES))
+    return httpx.AsyncClient(transport=_pool_transport, timeout=HTTP_TIMEOUT)
+
+
+def get_http_pool() -> httpx.AsyncClient:
+    """Get the shared pool, creating it lazily outside the app lifecycle"""
+    global _http_pool
+    if _http_pool is None or _http_pool.is_closed:
+        _http_pool = _create_http_pool()
+    return _http_pool
+
+
+def get_http_pool_stats() -> Dict:
+    """Request, connection and retry counters of the shared pool, in get_connection_stats' shape"""
+    if _pool_transport is None:
+        return {"requests": 0, "new_connections": 0, "reused_connections": 0, "retries": 0, "hosts": {}}
+    return _pool_transport.stats()
+
+
+def get_details_slots() -> asyncio.Semaphore:
+    """Get the shared details semaphore, creating it for the running event loop"""
+    global _details_slots, _details_loop
+    loop = asyncio.get_running_loop()
+    if _details_slots is None or _details_loop is not loop:
+        _details_slots = asyncio.Semaphore(DETAILS_CONCURRENCY)
+        _details_loop = loop
+    return _details_slots
+
+
+async def open_http_pool() -> httpx.AsyncClient:
+    """Create the process-wide keep-alive pool (called at app startup)"""
+    return get_http_pool()
+
+
+async def close_http_pool():
+    """Close the process-wide pool (called at app shutdown)"""
+    global _http_pool
+    if _http_pool is not None:
+        await _http_pool.aclose()
+        _http_pool = None
+
+
+class AsyncSpotifyClient:
+    """Non-blocking Spotify API client with the same surface as SpotifyClient"""
+
+    def __init__(self, access_token: str, http_client: Optional[httpx.AsyncClient] = None,
+                 priority: str = INTERACTIVE, scheduler: Optional[RequestScheduler] = None,
+                 metadata_cache: Optional[MetadataCache] = None):
+        self.access_token = access_token
+        self.base_url = "https://api.spotify.com/v1"
+        self.headers = {"Authorization": f"Bearer {access_token}"}
+        self.http = http_client or get_http_pool()
+        self.priority = priority
+        self.scheduler = scheduler or get_scheduler()
+        self.metadata_cache = metadata_cache or get_metadata_cache()
+
+    async def _make_request(self, endpoint: str, params: Dict = None) -> Dict:
+        """Make a request to Spotify API with error handling
+
+        Waiting for the scheduler and for 429 backoff yields to the event loop.
+        """
+        url = f"{self.base_url}/{endpoint}"
+        attempt = 0
+
+        while True:
+            await self.scheduler.acquire_async(self.priority)
+            response = await self.http.get(url, headers=self.headers, params=params)
+            if response.status_code == 429 and self.scheduler.should_retry(attempt, parse_retry_after(response.headers)):
+                attempt += 1
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    async def get_user_profile(self) -> Dict:
+        """Get current user's profile"""
+        return await self._make_request("me")
+
+    async def get_top_artists(self, time_range: str = "medium_term", limit: int = 50) -> List[Dict]:
+        """Get user's top artists
+
+        Args:
+            time_range: 'short_term' (4 weeks), 'medium_term' (6 months), 'long_term' (all time)
+            limit: Number of artists to return (max 50)
+        """
+        params = {"time_range": time_range, "limit": limit}
+        data = await self._make_request("me/top/artists", params)
+        return data.get("items", [])
+
+    async def get_top_tracks(self, time_range: str = "medium_term", limit: int = 50) -> List[Dict]:
+        """Get user's top tracks"""
+        params = {"time_range": time_range, "limit": limit}
+        data = await self._make_request("me/top/tracks", params)
+        return data.get("items", [])
+
+    async def get_recently_played(self, limit: int = 50, after: Optional[int] = None) -> List[Dict]:
+        """Get recently played tracks
+
+        Args:
+            limit: Number of items to return (max 50)
+            after: Unix timestamp to get tracks after this time
+        """
+        params = {"limit": limit}
+        if after:
+            params["after"] = after
+
+        data = await self._make_request("me/player/recently-played", params)
+        return data.get("items", [])
+
+    async def iter_recent_track_pages(self, days_back: int = 30, after: Optional[int] = None,
+                                      max_items: int = MAX_RECENT_TRACKS,
+                                      deadline: Optional[float] = None) -> AsyncIterator[List[Dict]]:
+        """Yield pages of recently played tracks as they arrive
+
+        Args:
+            days_back: How far back to start when no cursor is given
+            after: Unix timestamp in ms to start after (overrides days_back)
+            max_items: Stop after this many plays
+            deadline: Wall-clock budget in seconds for the whole walk
+        """
+        pager = RecentTracksPager(days_back, after, max_items, deadline)
+
+        while pager.should_fetch():
+            data = await self._make_request("me/player/recently-played", pager.params())
+            page = pager.consume(data)
+            if page:
+                yield page
+
+    async def get_all_recent_tracks(self, days_back: int = 30, max_items: int = MAX_RECENT_TRACKS,
+                                    deadline: Optional[float] = None) -> List[Dict]:
+        """Get all recent tracks for the specified number of days"""
+        all_tracks = []
+        async for page in self.iter_recent_track_pages(days_back, max_items=max_items, deadline=deadline):
+            all_tracks.extend(page)
+        return all_tracks
+
+    async def get_audio_features(self, track_ids: List[str]) -> List[Dict]:
+        """Get audio features for multiple tracks - DEPRECATED BY SPOTIFY"""
+        print("Warning: Audio features endpoint has been deprecated by Spotify")
+        return []
+
+    async def get_single_audio_features(self, track_id: str) -> Dict:
+        """Get audio features for a single track - DEPRECATED BY SPOTIFY"""
+        print("Warning: Audio features endpoint has been deprecated by Spotify")
+        return {}
+
+    async def get_artist_details(self, artist_ids: List[str]) -> List[Optional[Dict]]:
+        """Get details for multiple artists
+
+        Artists in the shared metadata cache are not requested again; the
+        cache is read and written in a worker thread, since with
+        METADATA_CACHE_SQL it queries the database. The remaining chunks are fetched concurrently, at most DETAILS_CONCURRENCY
+        at a time across all clients. The result lines up with
+        artist_ids, with None for IDs Spotify does not know.
+        """
+        if not artist_ids:
+            return []
+
+        cached = await asyncio.to_thread(self.metadata_cache.get_many, "artist", artist_ids)
+        semaphore = get_details_slots()
+
+        async def fetch(chunk: List[str]) -> List[Dict]:
+            async with semaphore:
+                data = await self._make_request("artists", {"ids": ",".join(chunk)})
+            return data.get("artists", [])
+
+        chunks = chunk_unique_ids([i for i in artist_ids if i not in cached])
+        results = await asyncio.gather(*(fetch(chunk) for chunk in chunks))
+        fetched = [artist for chunk in results for artist in chunk]
+        await asyncio.to_thread(self.metadata_cache.put_many, "artist", fetched)
+        return align_to_input(artist_ids, list(cached.values()) + fetched)
+
+    async def search_artist(self, query: str, limit: int = 20) -> List[Dict]:
+        """Search for artists"""
+        params = {"q": query, "type": "artist", "limit": limit}
+        data = await self._make_request("search", params)
+        return data.get("artists", {}).get("items", [])
+
+    async def get_user_playlists(self, limit: int = 50) -> List[Dict]:
+        """Get user's playlists"""
+        params = {"limit": limit}
+        data = await self._make_request("me/playlists", params)
+        return data.get("items", [])
@@ -0,0 +1,100 @@
+"""Time and peak memory of SpotifyDataProcessor.analyze_all vs the separate methods
+
+Usage:
+    python benchmarks/bench_analyze_all.py
+    python benchmarks/bench_analyze_all.py --items 50 --plays 5000 --repeat 200
+
+The separate path is what build_analysis did before analyze_all: concatenate
+the three time ranges of top artists and top tracks, then call
+process_listening_history, analyze_track_characteristics,
+calculate_genre_diversity and calculate_obscurity_score.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import SpotifyDataProcessor
+
+TIME_RANGES = ("short_term", "medium_term", "long_term")
+
+
+def make_inputs(items: int, plays: int, seed: int = 1):
+    rng = random.Random(seed)
+    top_artists = {
+        time_range: [{"id": f"artist_{time_range}_{i}", "popularity": rng.randrange(101),
+                      "genres": [f"genre_{rng.randrange(60)}" for _ in range(rng.randrange(4))]}
+                     for i in range(items)]
+        for time_range in TIME_RANGES
+    }
+    top_tracks = {
+        time_range: [{"id": f"track_{time_range}_{i}", "popularity": rng.randrange(101),
+                      "duration_ms": rng.randrange(60000, 400000), "explicit": rng.random() < 0.3,
+                      "album": {"release_date": f"{rng.randrange(1960, 2025)}-01-01"}}
+                     for i in range(items)]
+        for time_range in TIME_RANGES
+    }
+    recent_tracks = [
+        {"played_at": f"2024-01-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:00.000Z",
+         "track": {"id": f"track_{rng.randrange(500)}",
+                   "artists": [{"id": f"artist_{rng.randrange(80)}", "name": f"Artist {rng.randrange(80)}"}]}}
+        for i in range(plays)
+    ]
+    return recent_tracks, top_artists, top_tracks
+
+
+def separate(processor, recent_tracks, top_artists, top_tracks):
+    all_artists = top_artists["short_term"] + top_artists["medium_term"] + top_artists["long_term"]
+    all_tracks = top_tracks["short_term"] + top_tracks["medium_term"] + top_tracks["long_term"]
+    return {
+        "listening_history": processor.process_listening_history(recent_tracks),
+        "track_characteristics": processor.analyze_track_characteristics(all_tracks),
+        "genre_diversity": processor.calculate_genre_diversity(all_artists),
+        "obscurity_score": processor.calculate_obscurity_score(all_artists, all_tracks)
+    }
+
+
+def fused(processor, recent_tracks, top_artists, top_tracks):
+    return processor.analyze_all(recent_tracks, top_artists, top_tracks)
+
+
+def measure(func, args, repeat: int):
+    """Mean microseconds per call and peak traced bytes of one call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    elapsed = (time.perf_counter() - start) / repeat * 1e6
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=50, help="Top artists/tracks per time range")
+    parser.add_argument("--plays", type=int, default=50, help="Recently played items")
+    parser.add_argument("--repeat", type=int, default=500, help="Timed calls per path")
+    args = parser.parse_args()
+
+    processor = SpotifyDataProcessor()
+    inputs = (processor, *make_inputs(args.items, args.plays))
+    assert separate(*inputs) == fused(*inputs)
+
+    print(f"{args.items} items per time range, {args.plays} plays")
+    results = {}
+    for label, func in (("separate", separate), ("fused", fused)):
+        results[label] = measure(func, inputs, args.repeat)
+        elapsed, peak = results[label]
+        print(f"  {label:8s} {elapsed:>9.1f} us/call  peak {peak / 1024:>7.1f} KiB")
+    print(f"  speedup {results['separate'][0] / results['fused'][0]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Listening-history and track metrics, default vs columnar (NumPy) processor
+
+Usage:
+    python benchmarks/bench_columnar_processor.py
+    python benchmarks/bench_columnar_processor.py --sizes 10000 100000 --repeat 5
+
+Times process_listening_history plus analyze_track_characteristics over the
+same synthetic plays for each size and checks both engines agree.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_processor import SpotifyDataProcessor
+from columnar_processor import ColumnarDataProcessor
+
+
+def make_plays(count: int, tracks: int = 5000, artists: int = 800, seed: int = 1) -> list:
+    """Plays over 90 days drawn from a shared catalogue of track objects"""
+    rng = random.Random(seed)
+    catalogue = [
+        {"id": f"track_{i}", "name": f"Track {i}",
+         "artists": [{"id": f"artist_{i % artists}", "name": f"Artist {i % artists}"}],
+         "popularity": rng.randrange(101), "duration_ms": rng.randrange(60000, 400000),
+         "explicit": rng.random() < 0.3, "album": {"release_date": f"{rng.randrange(1960, 2025)}-06-01"}}
+        for i in range(tracks)
+    ]
+    start = datetime(2024, 1, 1)
+    plays = []
+    for _ in range(count):
+        played_at = start + timedelta(milliseconds=rng.randrange(90 * 86400 * 1000))
+        plays.append({
+            "played_at": played_at.strftime("%Y-%m-%dT%H:%M:%S.") + f"{played_at.microsecond // 1000:03d}Z",
+            "track": catalogue[int(rng.paretovariate(1.2)) % tracks]
+        })
+    return plays
+
+
+def run(processor, plays: list, repeat: int):
+    """Best-of-repeat seconds and the last results"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = (processor.process_listening_history(plays), processor.analyze_track_characteristics(plays))
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Plays per run")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per engine and size (best is reported)")
+    args = parser.parse_args()
+
+    engines = {"python": SpotifyDataProcessor(), "columnar": ColumnarDataProcessor()}
+    for size in args.sizes:
+        plays = make_plays(size)
+        timings = {}
+        results = {}
+        for label, processor in engines.items():
+            timings[label], results[label] = run(processor, plays, args.repeat)
+        history, characteristics = results["python"]
+        agree = (results["columnar"][0] == history
+                 and all(abs(results["columnar"][1][key] - value) <= 1e-9 * max(1, abs(value))
+                         for key, value in characteristics.items()))
+        print(f"{size:>9} plays  python {timings['python'] * 1000:>9.1f} ms  "
+              f"columnar {timings['columnar'] * 1000:>9.1f} ms  "
+              f"speedup {timings['python'] / timings['columnar']:.1f}x  {'match' if agree else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
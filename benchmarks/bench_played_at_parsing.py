@@ -0,0 +1,80 @@
+"""Per-play cost of played_at handling: reparsing strings vs parse-once epoch ms
+
+Usage:
+    python benchmarks/bench_played_at_parsing.py
+    python benchmarks/bench_played_at_parsing.py --plays 100000 --timezone America/New_York
+
+The string path is what ingest and processing did before timeutils: the
+pager parsed played_at for the cursor, and the hour and weekday stats each
+parsed it again. The integer path parses once with parse_played_at_ms and
+buckets the cached value with TimeBuckets.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timeutils import TimeBuckets, parse_played_at_ms
+
+
+def make_played_at(count: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    values = []
+    for _ in range(count):
+        played_at = start + timedelta(milliseconds=rng.randrange(365 * 86400 * 1000))
+        values.append(played_at.strftime("%Y-%m-%dT%H:%M:%S.") + f"{played_at.microsecond // 1000:03d}Z")
+    return values
+
+
+def reparse(values: list, zone):
+    """Cursor, hour and weekday each from their own fromisoformat"""
+    newest = max(int(datetime.fromisoformat(v.replace("Z", "+00:00")).timestamp() * 1000) for v in values)
+    hours = [datetime.fromisoformat(v.replace("Z", "+00:00")).astimezone(zone).hour for v in values]
+    days = [datetime.fromisoformat(v.replace("Z", "+00:00")).astimezone(zone).strftime("%A") for v in values]
+    return newest, hours, days
+
+
+def parse_once(values: list, buckets: TimeBuckets):
+    """One parse per play, then integer cursor and bucketing"""
+    ms = [parse_played_at_ms(v) for v in values]
+    newest = max(ms)
+    hours = [buckets.hour(m) for m in ms]
+    days = [buckets.weekday_name(m) for m in ms]
+    return newest, hours, days
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--plays", type=int, default=50000, help="Timestamps per run")
+    parser.add_argument("--timezone", default="Europe/Berlin", help="IANA timezone to bucket in")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per path (best is reported)")
+    args = parser.parse_args()
+
+    values = make_played_at(args.plays)
+    zone = TimeBuckets(args.timezone).zone or timezone.utc
+    assert reparse(values, zone) == parse_once(values, TimeBuckets(args.timezone))
+
+    print(f"{args.plays} plays bucketed in {args.timezone}")
+    timings = {}
+    paths = (("reparse", reparse, lambda: zone),
+             # A fresh offset cache per run, as each processor builds its own
+             ("parse once", parse_once, lambda: TimeBuckets(args.timezone)))
+    for label, func, setup in paths:
+        best = float("inf")
+        for _ in range(args.repeat):
+            arg = setup()
+            start = time.perf_counter()
+            func(values, arg)
+            best = min(best, time.perf_counter() - start)
+        timings[label] = best
+        print(f"  {label:10s} {best / args.plays * 1e9:>8.0f} ns/play")
+    print(f"  speedup {timings['reparse'] / timings['parse once']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
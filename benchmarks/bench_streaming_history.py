@@ -0,0 +1,112 @@
+"""Peak memory of listening-history analysis, collected plays vs streamed pages
+
+Usage:
+    python benchmarks/bench_streaming_history.py
+    python benchmarks/bench_streaming_history.py --sizes 10000 100000 1000000   # the collected path needs several GiB at 1M
+
+The collected path is the default without the play log: get_all_recent_tracks
+gathers every play with its nested track, album and artist objects, then
+process_listening_history runs over the list. The streamed path is
+STREAM_RECENT_TRACKS: stream_listening_aggregate counts each page and drops
+it. Each path runs in a fresh subprocess so peak RSS (ru_maxrss) is its own.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis_pipeline import stream_listening_aggregate
+from async_spotify_client import AsyncSpotifyClient
+from data_processor import SpotifyDataProcessor
+
+
+class SyntheticClient(AsyncSpotifyClient):
+    """Serves pages of full Spotify-shaped plays, building each page on request"""
+
+    def __init__(self, plays: int, tracks: int = 20000, artists: int = 3000, seed: int = 1):
+        self.plays = plays
+        self.tracks = tracks
+        self.artists = artists
+        self.rng = random.Random(seed)
+
+    def make_play(self, i: int) -> dict:
+        t = int(self.rng.paretovariate(1.1)) % self.tracks
+        a = t % self.artists
+        artist = {"id": f"artist_{a:06d}", "name": f"Artist {a}", "type": "artist", "uri": f"spotify:artist:{a:022d}",
+                  "href": f"https://api.spotify.com/v1/artists/{a:022d}",
+                  "external_urls": {"spotify": f"https://open.spotify.com/artist/{a:022d}"}}
+        ms = 1704067200000 + i * 7000
+        return {
+            "played_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ms // 1000)) + f".{ms % 1000:03d}Z",
+            "context": {"type": "playlist", "uri": f"spotify:playlist:{t % 97:022d}"},
+            "track": {
+                "id": f"track_{t:06d}", "name": f"Track {t}", "popularity": t % 101, "duration_ms": 180000 + t,
+                "explicit": t % 3 == 0, "track_number": t % 12 + 1, "disc_number": 1, "is_local": False,
+                "uri": f"spotify:track:{t:022d}", "href": f"https://api.spotify.com/v1/tracks/{t:022d}",
+                "external_ids": {"isrc": f"US{t:010d}"}, "artists": [artist],
+                "album": {"id": f"album_{t // 10:06d}", "name": f"Album {t // 10}", "album_type": "album",
+                          "release_date": f"{1960 + t % 65}-01-01", "total_tracks": 12, "artists": [artist],
+                          "images": [{"url": f"https://i.scdn.co/image/{t:040d}{size}", "height": size,
+                                      "width": size} for size in (640, 300, 64)]}
+            }
+        }
+
+    async def iter_recent_track_pages(self, days_back=30, after=None, max_items=None, deadline=None):
+        for start in range(0, self.plays, 50):
+            yield [self.make_play(i) for i in range(start, min(start + 50, self.plays))]
+
+
+async def collected(client, processor):
+    plays = await client.get_all_recent_tracks(30, max_items=client.plays)
+    return processor.process_listening_history(plays)
+
+
+async def streamed(client, processor):
+    aggregate = await stream_listening_aggregate(client, 30, buckets=processor.buckets, max_items=client.plays)
+    return processor.process_listening_history(aggregate)
+
+
+def run_child(mode: str, plays: int):
+    """Run one path in this process and print its result summary as JSON"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    result = asyncio.run({"collected": collected, "streamed": streamed}[mode](SyntheticClient(plays),
+                                                                             SpotifyDataProcessor()))
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"seconds": elapsed, "peak_kib": peak, "baseline_kib": baseline,
+                      "result": json.dumps(result, sort_keys=True)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 250000], help="Plays per run")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PLAYS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args.child[0], int(args.child[1]))
+        return
+
+    for size in args.sizes:
+        runs = {}
+        for mode in ("collected", "streamed"):
+            output = subprocess.run([sys.executable, __file__, "--child", mode, str(size)],
+                                    check=True, capture_output=True, text=True).stdout
+            runs[mode] = json.loads(output.splitlines()[-1])
+        match = runs["collected"]["result"] == runs["streamed"]["result"]
+        line = f"{size:>8} plays"
+        for mode, run in runs.items():
+            line += (f"  {mode} peak RSS {run['peak_kib'] / 1024:>7.1f} MiB"
+                     f" (+{(run['peak_kib'] - run['baseline_kib']) / 1024:>6.1f}) {run['seconds']:>6.2f}s")
+        print(f"{line}  {'match' if match else 'MISMATCH'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Distinct tracks over a long window: daily counters vs daily HyperLogLog sketches
+
+Usage:
+    python benchmarks/bench_unique_counts.py
+    python benchmarks/bench_unique_counts.py --days 365 --plays-per-day 200 --catalogue 50000
+
+Both inputs are what the play log stores per day: the JSON track counts in
+user_play_daily.counters, or the HyperLogLog.to_bytes() in
+user_play_sketches. Times turning a window of them into a distinct count
+and reports the estimate's error.
+"""
+import json
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cardinality import HyperLogLog, np
+
+
+def best_of(func, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=365, help="Days in the window")
+    parser.add_argument("--plays-per-day", type=int, default=150, help="Plays per day")
+    parser.add_argument("--catalogue", type=int, default=30000, help="Distinct tracks to draw from")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per path (best is reported)")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    daily_counts = []
+    for _ in range(args.days):
+        counts = {}
+        for _ in range(args.plays_per_day):
+            track_id = f"track_{rng.randrange(args.catalogue):022d}"
+            counts[track_id] = counts.get(track_id, 0) + 1
+        daily_counts.append(counts)
+    daily_counters = [json.dumps({"tracks": counts}) for counts in daily_counts]
+    daily_sketches = [HyperLogLog().update(counts).to_bytes() for counts in daily_counts]
+
+    exact_time, exact = best_of(lambda: len(set().union(*(json.loads(data)["tracks"] for data in daily_counters))),
+                                args.repeat)
+    sketch_time, estimate = best_of(
+        lambda: HyperLogLog.union([HyperLogLog.from_bytes(data) for data in daily_sketches]).estimate(), args.repeat)
+
+    print(f"{args.days} days, {exact} distinct tracks (union via {'numpy' if np is not None else 'pure Python'})")
+    print(f"  counters   {exact_time * 1e6:>9.0f} us   {sum(map(len, daily_counters)) / 1024:>8.1f} KiB")
+    print(f"  sketches   {sketch_time * 1e6:>9.0f} us   {sum(map(len, daily_sketches)) / 1024:>8.1f} KiB, "
+          f"estimate {estimate} ({(estimate - exact) / exact * 100:+.2f}%)")
+
+
+if __name__ == "__main__":
+    main()
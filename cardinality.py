@@ -0,0 +1,106 @@
+"""HyperLogLog sketches for counting unique tracks and artists over long windows
+
+A sketch with precision p keeps 2**p one-byte registers (4 KiB at the
+default p=12) whatever the number of items added. Sketches of the same
+precision merge by taking the larger of each register, and the merge
+counts the union of their items, so a day's sketch can be stored once and
+combined into any window.
+
+The estimate has a relative standard error of 1.04 / sqrt(2**p): 1.6% at
+p=12, so about 95% of estimates fall within 3.3% of the true count. Small
+counts use linear counting and are close to exact.
+"""
+import hashlib
+import math
+from collections import Counter
+from typing import Iterable, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HLL_PRECISION = 12
+
+# 2 ** -rank for every possible register value
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+
+def _alpha(m: int) -> float:
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+class HyperLogLog:
+    """Mergeable estimate of the number of distinct strings added"""
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: bytes = None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError(f"Expected {self.m} registers, got {len(self.registers)}")
+
+    def add(self, item: str):
+        # 64-bit BLAKE2b, so sketches line up across processes
+        value = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        index = value >> bits
+        rank = bits - (value & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, items: Iterable[str]) -> "HyperLogLog":
+        for item in items:
+            self.add(item)
+        return self
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        """Union other into this sketch and return it"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    @classmethod
+    def union(cls, sketches: List["HyperLogLog"], precision: int = HLL_PRECISION) -> "HyperLogLog":
+        """One sketch of every item in sketches, merged in a single pass"""
+        if any(sketch.precision != precision for sketch in sketches):
+            raise ValueError("Cannot merge sketches of different precision")
+        if not sketches:
+            return cls(precision)
+        if len(sketches) == 1:
+            return cls(precision, sketches[0].registers)
+        if np is not None:
+            stacked = np.frombuffer(b"".join(sketch.registers for sketch in sketches), dtype=np.uint8)
+            return cls(precision, stacked.reshape(len(sketches), -1).max(axis=0).tobytes())
+        return cls(precision, bytes(map(max, *(sketch.registers for sketch in sketches))))
+
+    def estimate(self) -> int:
+        """Estimated number of distinct items added"""
+        histogram = Counter(self.registers)
+        harmonic = sum(count * _INVERSE_POWERS[rank] for rank, count in histogram.items())
+        estimate = _alpha(self.m) * self.m * self.m / harmonic
+        zeros = histogram.get(0, 0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Linear counting is more accurate while many registers are empty
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+    def __len__(self) -> int:
+        return self.estimate()
+
+    def to_bytes(self) -> bytes:
+        """Precision byte followed by the registers, for storage"""
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        return cls(data[0], data[1:])
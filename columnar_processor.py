@@ -0,0 +1,249 @@
+"""Columnar, NumPy-backed variant of SpotifyDataProcessor
+
+Selected with DATA_PROCESSOR_ENGINE=columnar. Plays and tracks are flattened
+once into parallel arrays (played_at as epoch ms, track and artist IDs as
+interned integer codes, popularity, duration, explicit flag, release year)
+and every metric is a vectorized reduction or bincount over those arrays
+instead of a Python loop per metric. Hours and weekdays are bucketed in the
+processor's timezone.
+
+Results are identical to SpotifyDataProcessor's: counts, orderings and
+integer means are computed exactly, float means are exactly rounded sums
+(math.fsum) and standard deviations go through statistics.stdev like the
+Python engine's, so no result depends on NumPy's summation order. NumPy is
+only needed when this engine is selected.
+"""
+from itertools import chain
+import math
+import statistics
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from data_processor import SpotifyDataProcessor, ListeningAggregate
+from topk import TOP_K_MODE
+from timeutils import PLAYED_AT_MS, MS_PER_QUARTER, MS_PER_HOUR, MS_PER_DAY, WEEKDAY_NAMES, TimeBuckets, parse_played_at_ms
+
+
+def _epoch_ms(played_at: List[str]) -> "np.ndarray":
+    """ISO-8601 UTC timestamps (without the trailing Z) as int64 epoch milliseconds"""
+    try:
+        return np.array(played_at, dtype="datetime64[ms]").astype(np.int64)
+    except ValueError:
+        # Explicit offsets; parse one by one
+        return np.array([parse_played_at_ms(value) for value in played_at], dtype=np.int64)
+
+
+def _local_ms(played_at_ms: "np.ndarray", buckets: TimeBuckets) -> "np.ndarray":
+    """Shift epoch ms into local wall-clock ms, one offset lookup per distinct UTC quarter hour"""
+    if buckets.zone is None:
+        return played_at_ms
+    quarters, inverse = np.unique(played_at_ms // MS_PER_QUARTER, return_inverse=True)
+    by_quarter = [buckets.quarter_offset_ms(int(quarter)) for quarter in quarters]
+    offsets = np.array([0 if offset is None else offset for offset in by_quarter], dtype=np.int64)[inverse]
+    if None in by_quarter:
+        # The offset changes inside these quarter hours; look their plays up one by one
+        changing = np.array([offset is None for offset in by_quarter])[inverse]
+        offsets[changing] = [buckets.offset_ms(int(ms)) for ms in played_at_ms[changing]]
+    return played_at_ms + offsets
+
+
+def _int_mean(values: "np.ndarray"):
+    """statistics.mean of integers: exact, and an int when the mean is whole"""
+    total, n = int(values.sum()), len(values)
+    return total // n if total % n == 0 else total / n
+
+
+def _int_stdev(values: "np.ndarray") -> float:
+    """statistics.stdev of integers, computed the same way as the Python engine"""
+    return statistics.stdev(values.tolist())
+
+
+def _first_seen_counts(codes: "np.ndarray", labels: Sequence) -> Dict:
+    """{label: count} ordered by first appearance, like a dict filled in a loop"""
+    counts = np.bincount(codes)
+    present, first = np.unique(codes, return_index=True)
+    return {labels[code]: int(counts[code]) for code in present[np.argsort(first, kind="stable")]}
+
+
+def _most_common(codes: "np.ndarray", labels: Sequence, n: int) -> List:
+    """Counter.most_common(n) for codes interned in first-appearance order"""
+    counts = np.bincount(codes)
+    # Stable sort keeps ties in first-appearance order, as Counter does
+    top = np.argsort(-counts, kind="stable")[:n]
+    return [(labels[code], int(counts[code])) for code in top if counts[code] > 0]
+
+
+class PlayColumns:
+    """Recently-played items flattened into arrays, IDs interned as integer codes
+
+    Codes are assigned in order of first appearance, so the ID for a code is
+    track_ids[code] (likewise artist_ids and artist_names).
+    """
+
+    def __init__(self, plays: List[Dict]):
+        track_codes: Dict = {}
+        artist_codes: Dict = {}
+        name_codes: Dict = {}
+        tracks, artists, names, played_at = [], [], [], []
+        # Plays normalized at ingest already carry epoch ms
+        normalized = all(PLAYED_AT_MS in play for play in plays)
+        for play in plays:
+            track = play["track"]
+            artist = track["artists"][0]
+            tracks.append(track_codes.setdefault(track["id"], len(track_codes)))
+            artists.append(artist_codes.setdefault(artist["id"], len(artist_codes)))
+            names.append(name_codes.setdefault(artist["name"], len(name_codes)))
+            played_at.append(play[PLAYED_AT_MS] if normalized else play["played_at"].rstrip("Z"))
+
+        self.track_ids = list(track_codes)
+        self.artist_ids = list(artist_codes)
+        self.artist_names = list(name_codes)
+        self.track = np.array(tracks, dtype=np.int64)
+        self.artist = np.array(artists, dtype=np.int64)
+        self.artist_name = np.array(names, dtype=np.int64)
+        self.played_at_ms = np.array(played_at, dtype=np.int64) if normalized else _epoch_ms(played_at)
+
+    def __len__(self) -> int:
+        return len(self.track)
+
+
+class TrackColumns:
+    """Track attributes as arrays; missing values are left out of each column"""
+
+    def __init__(self, tracks: List[Dict]):
+        popularity, duration, years = [], [], []
+        explicit = 0
+        count = 0
+        for item in tracks:
+            track = item.get("track", item)
+            if not track:
+                continue
+            count += 1
+            if track.get("popularity") is not None:
+                popularity.append(track["popularity"])
+            if track.get("duration_ms"):
+                duration.append(track["duration_ms"])
+            if track.get("explicit", False):
+                explicit += 1
+            release_date = track.get("album", {}).get("release_date", "")
+            if release_date and len(release_date) >= 4:
+                try:
+                    years.append(int(release_date[:4]))
+                except ValueError:
+                    pass
+
+        self.count = count
+        self.explicit_count = explicit
+        self.popularity = np.array(popularity, dtype=np.int64)
+        self.duration_ms = np.array(duration, dtype=np.float64)
+        self.release_year = np.array(years, dtype=np.int64)
+
+
+class ColumnarDataProcessor(SpotifyDataProcessor):
+    """SpotifyDataProcessor whose play and track metrics run on NumPy arrays"""
+
+    def __init__(self, timezone: Optional[str] = None):
+        if np is None:
+            raise ImportError("The columnar data processor requires numpy")
+        super().__init__(timezone)
+
+    def process_listening_history(self, recent_tracks: Union[List[Dict], ListeningAggregate],
+                                  top_k_mode: Optional[str] = None) -> Dict:
+        """Process recent listening history into useful stats"""
+        if isinstance(recent_tracks, ListeningAggregate) or (top_k_mode or TOP_K_MODE) != "exact":
+            return super().process_listening_history(recent_tracks, top_k_mode)
+        # The columns are built in more than one pass over the plays
+        recent_tracks = recent_tracks if isinstance(recent_tracks, list) else list(recent_tracks)
+        if not recent_tracks:
+            return {}
+
+        columns = PlayColumns(recent_tracks)
+        total_tracks = len(columns)
+        unique_tracks = len(columns.track_ids)
+        local_ms = _local_ms(columns.played_at_ms, self.buckets)
+        hours = (local_ms // MS_PER_HOUR) % 24
+        # 1970-01-01 was a Thursday (weekday 3)
+        weekdays = (local_ms // MS_PER_DAY + 3) % 7
+
+        return {
+            "total_tracks_played": total_tracks,
+            "unique_tracks": unique_tracks,
+            "unique_artists": len(columns.artist_ids),
+            "repetition_rate": (total_tracks - unique_tracks) / total_tracks,
+            "listening_by_hour": _first_seen_counts(hours, range(24)),
+            "listening_by_day": _first_seen_counts(weekdays, WEEKDAY_NAMES),
+            "most_played_tracks": _most_common(columns.track, columns.track_ids, 10),
+            "top_artists": _most_common(columns.artist_name, columns.artist_names, 10)
+        }
+
+    def analyze_all(self, recent_tracks: Union[Iterable[Dict], ListeningAggregate],
+                    top_artists: Dict[str, List[Dict]], top_tracks: Dict[str, List[Dict]]) -> Dict:
+        """Listening history, track characteristics, genre diversity and obscurity together
+        
+        The time ranges are concatenated once and handed to the vectorized
+        methods; the base class's fused pass would bypass them.
+        """
+        artists = list(chain.from_iterable(top_artists.values()))
+        tracks = list(chain.from_iterable(top_tracks.values()))
+        return {
+            "listening_history": self.process_listening_history(recent_tracks),
+            "track_characteristics": self.analyze_track_characteristics(tracks),
+            "genre_diversity": self.calculate_genre_diversity(artists),
+            "obscurity_score": self.calculate_obscurity_score(artists, tracks)
+        }
+
+    def analyze_track_characteristics(self, tracks: List[Dict]) -> Dict:
+        """Analyze track characteristics using available data (no audio features)"""
+        if not tracks:
+            return {}
+        columns = TrackColumns(tracks)
+        if not columns.count:
+            return {}
+
+        popularity = columns.popularity
+        duration_ms = columns.duration_ms[columns.duration_ms > 0]
+        analysis = {
+            "track_count": columns.count,
+            "avg_popularity": _int_mean(popularity) if len(popularity) else 0,
+            "popularity_std": _int_stdev(popularity) if len(popularity) > 1 else 0,
+            "avg_duration_minutes": math.fsum(duration_ms / (1000 * 60)) / len(duration_ms) if len(duration_ms) else 0,
+            "explicit_percentage": (columns.explicit_count / columns.count) * 100,
+        }
+
+        years = columns.release_year
+        if len(years):
+            oldest, newest = int(years.min()), int(years.max())
+            analysis.update({
+                "avg_release_year": _int_mean(years),
+                "oldest_track_year": oldest,
+                "newest_track_year": newest,
+                "year_range": newest - oldest
+            })
+
+        return analysis
+
+    def calculate_obscurity_score(self, artists: List[Dict], tracks: List[Dict]) -> Dict:
+        """Calculate how obscure the user's music taste is"""
+        if not artists and not tracks:
+            return {"obscurity_score": 0}
+
+        artist_popularities = np.array([artist["popularity"] for artist in artists
+                                        if artist.get("popularity") is not None], dtype=np.int64)
+        track_popularities = TrackColumns(tracks).popularity
+
+        avg_artist_popularity = _int_mean(artist_popularities) if len(artist_popularities) else 0
+        avg_track_popularity = _int_mean(track_popularities) if len(track_popularities) else 0
+        avg_artist_obscurity = (100 - avg_artist_popularity) / 100 if len(artist_popularities) else 0
+        avg_track_obscurity = (100 - avg_track_popularity) / 100 if len(track_popularities) else 0
+
+        return {
+            "obscurity_score": (avg_artist_obscurity + avg_track_obscurity) / 2,
+            "avg_artist_popularity": avg_artist_popularity,
+            "avg_track_popularity": avg_track_popularity,
+            "artist_popularity_std": _int_stdev(artist_popularities) if len(artist_popularities) > 1 else 0,
+            "track_popularity_std": _int_stdev(track_popularities) if len(track_popularities) > 1 else 0
+        }
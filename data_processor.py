@@ -1,46 +1,133 @@
-from typing import List, Dict, Tuple
+from typing import Iterable, List, Dict, Optional, Tuple, Union
 from collections import Counter, defaultdict
-from datetime import datetime, timedelta
+from itertools import chain
 import statistics
 import math
+import os
 
-class SpotifyDataProcessor:
-    """Process and analyze Spotify data"""
+from timeutils import TimeBuckets, WEEKDAY_NAMES, played_at_ms
+from topk import top_items
+
+# "python" (default) or "columnar", the NumPy engine in columnar_processor.py
+PROCESSOR_ENGINE = os.getenv("DATA_PROCESSOR_ENGINE", "python").lower()
+
+class ListeningAggregate:
+    """Mergeable play counters that listening history is computed from
+    
+    Holds hour and weekday histograms (in the timezone of the TimeBuckets
+    used to add plays, UTC by default) and per-track and per-artist play
+    counts. Aggregates for disjoint sets of plays merge by addition, so a
+    window can be answered from stored partial sums such as one per day.
+    """
     
     def __init__(self):
-        pass
+        self.total = 0
+        self.hours = Counter()
+        self.days = Counter()
+        self.tracks = Counter()
+        self.artists = Counter()
+        self.artist_names = Counter()
+    
+    def add(self, hour: int, weekday: int, track_id: str, artist_id: str, artist_name: str):
+        """Count one play at a local hour (0-23) and weekday (Monday is 0)"""
+        self.total += 1
+        self.hours[hour] += 1
+        self.days[WEEKDAY_NAMES[weekday]] += 1
+        self.tracks[track_id] += 1
+        self.artists[artist_id] += 1
+        self.artist_names[artist_name] += 1
+    
+    def add_plays(self, plays: Iterable[Dict], buckets: Optional[TimeBuckets] = None) -> "ListeningAggregate":
+        """Count recently-played items, bucketing hours and weekdays with buckets
+        
+        Plays are consumed one at a time, so a generator or a stream of pages
+        is counted without holding the plays themselves.
+        """
+        buckets = buckets or TimeBuckets()
+        for play in plays:
+            track = play["track"]
+            artist = track["artists"][0]
+            hour, weekday = buckets.hour_and_weekday(played_at_ms(play))
+            self.add(hour, weekday, track["id"], artist["id"], artist["name"])
+        return self
+    
+    @classmethod
+    def from_plays(cls, plays: Iterable[Dict], buckets: Optional[TimeBuckets] = None) -> "ListeningAggregate":
+        """Aggregate recently-played items, bucketing hours and weekdays with buckets"""
+        return cls().add_plays(plays, buckets)
     
-    def process_listening_history(self, recent_tracks: List[Dict]) -> Dict:
-        """Process recent listening history into useful stats"""
-        if not recent_tracks:
+    def merge(self, other: "ListeningAggregate") -> "ListeningAggregate":
+        """Add other's counts into this aggregate and return it"""
+        self.total += other.total
+        self.hours.update(other.hours)
+        self.days.update(other.days)
+        self.tracks.update(other.tracks)
+        self.artists.update(other.artists)
+        self.artist_names.update(other.artist_names)
+        return self
+    
+    def to_dict(self) -> Dict:
+        """JSON-safe form for storage"""
+        return {
+            "total": self.total,
+            "hours": {str(hour): count for hour, count in self.hours.items()},
+            "days": dict(self.days),
+            "tracks": dict(self.tracks),
+            "artists": dict(self.artists),
+            "artist_names": dict(self.artist_names)
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ListeningAggregate":
+        aggregate = cls()
+        aggregate.total = data.get("total", 0)
+        aggregate.hours = Counter({int(hour): count for hour, count in data.get("hours", {}).items()})
+        for name in ("days", "tracks", "artists", "artist_names"):
+            setattr(aggregate, name, Counter(data.get(name, {})))
+        return aggregate
+
+class SpotifyDataProcessor:
+    """Process and analyze Spotify data
+    
+    Listening hours and weekdays are bucketed in timezone (an IANA name,
+    UTC by default).
+    """
+    
+    def __init__(self, timezone: Optional[str] = None):
+        self.buckets = TimeBuckets(timezone)
+    
+    def process_listening_history(self, recent_tracks: Union[Iterable[Dict], "ListeningAggregate"],
+                                  top_k_mode: Optional[str] = None) -> Dict:
+        """Process recent listening history into useful stats
+        
+        Accepts the plays themselves (any iterable, consumed once, so plays
+        can be streamed) or a ListeningAggregate of them, in which case the
+        work is proportional to the number of buckets, not plays. Memory is
+        bounded by the unique tracks and artists either way, and the top 10
+        lists come from a heap rather than a full sort. top_k_mode picks
+        "exact" or "approximate" top lists (see topk.py), TOP_K_MODE by default.
+        """
+        if isinstance(recent_tracks, ListeningAggregate):
+            aggregate = recent_tracks
+        else:
+            aggregate = ListeningAggregate.from_plays(recent_tracks, self.buckets)
+        if not aggregate.total:
             return {}
         
         # Extract basic info
-        total_tracks = len(recent_tracks)
-        unique_tracks = len(set(track["track"]["id"] for track in recent_tracks))
-        unique_artists = len(set(track["track"]["artists"][0]["id"] for track in recent_tracks))
-        
-        # Calculate listening patterns
-        listening_by_hour = self._analyze_listening_by_hour(recent_tracks)
-        listening_by_day = self._analyze_listening_by_day(recent_tracks)
-        
-        # Track repetition analysis
-        track_plays = Counter(track["track"]["id"] for track in recent_tracks)
-        most_played_tracks = track_plays.most_common(10)
-        
-        # Artist analysis
-        artist_plays = Counter(track["track"]["artists"][0]["name"] for track in recent_tracks)
-        top_artists = artist_plays.most_common(10)
+        total_tracks = aggregate.total
+        unique_tracks = len(aggregate.tracks)
+        unique_artists = len(aggregate.artists)
         
         return {
             "total_tracks_played": total_tracks,
             "unique_tracks": unique_tracks,
             "unique_artists": unique_artists,
             "repetition_rate": (total_tracks - unique_tracks) / total_tracks if total_tracks > 0 else 0,
-            "listening_by_hour": listening_by_hour,
-            "listening_by_day": listening_by_day,
-            "most_played_tracks": most_played_tracks,
-            "top_artists": top_artists
+            "listening_by_hour": dict(aggregate.hours),
+            "listening_by_day": dict(aggregate.days),
+            "most_played_tracks": top_items(aggregate.tracks, 10, top_k_mode),
+            "top_artists": top_items(aggregate.artist_names, 10, top_k_mode)
         }
     
     def _analyze_listening_by_hour(self, tracks: List[Dict]) -> Dict[int, int]:
@@ -48,9 +135,7 @@ class SpotifyDataProcessor:
         hour_counts = defaultdict(int)
         
         for track in tracks:
-            played_at = datetime.fromisoformat(track["played_at"].replace('Z', '+00:00'))
-            hour = played_at.hour
-            hour_counts[hour] += 1
+            hour_counts[self.buckets.hour(played_at_ms(track))] += 1
         
         return dict(hour_counts)
     
@@ -59,55 +144,86 @@ class SpotifyDataProcessor:
         day_counts = defaultdict(int)
         
         for track in tracks:
-            played_at = datetime.fromisoformat(track["played_at"].replace('Z', '+00:00'))
-            day = played_at.strftime("%A")
-            day_counts[day] += 1
+            day_counts[self.buckets.weekday_name(played_at_ms(track))] += 1
         
         return dict(day_counts)
     
-    def analyze_track_characteristics(self, tracks: List[Dict]) -> Dict:
-        """Analyze track characteristics using available data (no audio features)"""
-        if not tracks:
-            return {}
-        
-        # Extract track data
-        track_data = []
-        for track in tracks:
-            track_info = track.get("track", track)
-            if track_info:
-                track_data.append(track_info)
-        
-        if not track_data:
-            return {}
-        
-        # Analyze popularity distribution
-        popularities = [t.get("popularity", 0) for t in track_data if t.get("popularity") is not None]
-        
-        # Analyze track duration
-        durations = [t.get("duration_ms", 0) for t in track_data if t.get("duration_ms")]
-        duration_minutes = [d / (1000 * 60) for d in durations if d > 0]
+    def analyze_all(self, recent_tracks: Union[Iterable[Dict], ListeningAggregate],
+                    top_artists: Dict[str, List[Dict]], top_tracks: Dict[str, List[Dict]]) -> Dict:
+        """Listening history, track characteristics, genre diversity and obscurity together
+        
+        top_artists and top_tracks map each time range to its items. Every
+        input is walked once, without concatenating the time ranges, and the
+        collected values are shared by the metrics that need them. Returns the
+        same results as calling the individual methods on the combined lists.
+        """
+        artist_popularities = []
+        genre_counts = Counter()
+        artist_count = 0
+        for artist in chain.from_iterable(top_artists.values()):
+            artist_count += 1
+            if artist.get("popularity") is not None:
+                artist_popularities.append(artist["popularity"])
+            genre_counts.update(artist.get("genres", []))
         
-        # Analyze explicitness
-        explicit_count = sum(1 for t in track_data if t.get("explicit", False))
+        tracks = self._scan_tracks(chain.from_iterable(top_tracks.values()))
         
-        # Release year analysis
-        release_years = []
-        for track in track_data:
-            album = track.get("album", {})
-            release_date = album.get("release_date", "")
+        return {
+            "listening_history": self.process_listening_history(recent_tracks),
+            "track_characteristics": self._track_characteristics(tracks),
+            "genre_diversity": self._genre_diversity(genre_counts) if artist_count else
+            {"diversity_score": 0, "genre_distribution": {}},
+            "obscurity_score": self._obscurity_score(artist_popularities, tracks["popularities"])
+            if artist_count or tracks["items"] else {"obscurity_score": 0}
+        }
+    
+    @staticmethod
+    def _scan_tracks(tracks: Iterable[Dict]) -> Dict:
+        """Collect everything the track metrics need in one walk over tracks or plays"""
+        scan = {"items": 0, "count": 0, "popularities": [], "duration_minutes": [],
+                "explicit_count": 0, "release_years": []}
+        for item in tracks:
+            scan["items"] += 1
+            track = item.get("track", item)
+            if not track:
+                continue
+            scan["count"] += 1
+            if track.get("popularity") is not None:
+                scan["popularities"].append(track.get("popularity", 0))
+            duration = track.get("duration_ms", 0)
+            if duration and duration > 0:
+                scan["duration_minutes"].append(duration / (1000 * 60))
+            if track.get("explicit", False):
+                scan["explicit_count"] += 1
+            release_date = track.get("album", {}).get("release_date", "")
             if release_date and len(release_date) >= 4:
                 try:
-                    year = int(release_date[:4])
-                    release_years.append(year)
+                    scan["release_years"].append(int(release_date[:4]))
                 except ValueError:
                     pass
+        return scan
+    
+    def analyze_track_characteristics(self, tracks: List[Dict]) -> Dict:
+        """Analyze track characteristics using available data (no audio features)"""
+        if not tracks:
+            return {}
+        return self._track_characteristics(self._scan_tracks(tracks))
+    
+    def _track_characteristics(self, scan: Dict) -> Dict:
+        if not scan["count"]:
+            return {}
+        
+        popularities = scan["popularities"]
+        duration_minutes = scan["duration_minutes"]
+        release_years = scan["release_years"]
         
         analysis = {
-            "track_count": len(track_data),
+            "track_count": scan["count"],
             "avg_popularity": statistics.mean(popularities) if popularities else 0,
             "popularity_std": statistics.stdev(popularities) if len(popularities) > 1 else 0,
-            "avg_duration_minutes": statistics.mean(duration_minutes) if duration_minutes else 0,
-            "explicit_percentage": (explicit_count / len(track_data)) * 100 if track_data else 0,
+            # fsum is exactly rounded, so every engine gets the same float
+            "avg_duration_minutes": math.fsum(duration_minutes) / len(duration_minutes) if duration_minutes else 0,
+            "explicit_percentage": (scan["explicit_count"] / scan["count"]) * 100,
         }
         
         if release_years:
@@ -126,16 +242,17 @@ class SpotifyDataProcessor:
             return {"diversity_score": 0, "genre_distribution": {}}
         
         # Collect all genres
-        all_genres = []
+        genre_counts = Counter()
         for artist in artists:
-            all_genres.extend(artist.get("genres", []))
+            genre_counts.update(artist.get("genres", []))
         
-        if not all_genres:
+        return self._genre_diversity(genre_counts)
+    
+    def _genre_diversity(self, genre_counts: Counter) -> Dict:
+        total_genres = sum(genre_counts.values())
+        if not total_genres:
             return {"diversity_score": 0, "genre_distribution": {}}
         
-        # Count genres
-        genre_counts = Counter(all_genres)
-        total_genres = len(all_genres)
         unique_genres = len(genre_counts)
         
         # Calculate diversity using Shannon entropy
@@ -152,7 +269,9 @@ class SpotifyDataProcessor:
             "diversity_score": normalized_diversity,
             "unique_genres": unique_genres,
             "total_genre_mentions": total_genres,
-            "genre_distribution": dict(genre_counts.most_common(10))
+            "genre_distribution": dict(genre_counts.most_common(10)),
+            # Every genre, most mentioned first; stored as user_genres rows
+            "genre_counts": dict(genre_counts.most_common())
         }
     
     def calculate_obscurity_score(self, artists: List[Dict], tracks: List[Dict]) -> Dict:
@@ -167,12 +286,11 @@ class SpotifyDataProcessor:
                 artist_popularities.append(artist["popularity"])
         
         # Track popularity
-        track_popularities = []
-        for track in tracks:
-            track_data = track.get("track", track)
-            if track_data.get("popularity") is not None:
-                track_popularities.append(track_data["popularity"])
+        track_popularities = self._scan_tracks(tracks)["popularities"]
         
+        return self._obscurity_score(artist_popularities, track_popularities)
+    
+    def _obscurity_score(self, artist_popularities: List, track_popularities: List) -> Dict:
         # Calculate obscurity (inverse of popularity)
         avg_artist_obscurity = 0
         avg_track_obscurity = 0
@@ -196,6 +314,7 @@ class SpotifyDataProcessor:
             "track_popularity_std": statistics.stdev(track_popularities) if len(track_popularities) > 1 else 0
         }
     
+    
     def calculate_uniqueness_score(self, user_data: Dict) -> Dict:
         """Calculate overall uniqueness score combining multiple factors"""
         
@@ -302,4 +421,14 @@ class SpotifyDataProcessor:
             if explicit_pct > 50:
                 insights.append("You listen to a lot of explicit content")
         
-        return insights
\ No newline at end of file
+        return insights
+
+def create_processor(timezone: Optional[str] = None) -> SpotifyDataProcessor:
+    """The data processor selected by DATA_PROCESSOR_ENGINE, bucketing in timezone"""
+    if PROCESSOR_ENGINE == "columnar":
+        try:
+            from columnar_processor import ColumnarDataProcessor
+            return ColumnarDataProcessor(timezone)
+        except ImportError as e:
+            print(f"Columnar data processor unavailable, using the default one: {e}")
+    return SpotifyDataProcessor(timezone)
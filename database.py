@@ -1,9 +1,12 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 import os
 from models import Base
 from dotenv import load_dotenv
+from typing import Any, Dict, List, Optional
 
 load_dotenv()  # Load environment variables from .env file
 
@@ -25,9 +28,100 @@ engine = create_engine(
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Columns added after their table was first created. create_all only creates
+# missing tables, so these are added to existing databases on startup.
+ADDED_COLUMNS = {
+    "user_analyses": {"days_back": "INTEGER"},
+    "users": {"timezone": "VARCHAR"},
+    "user_genres": {"rank_position": "INTEGER"},
+    "user_trends": {"period": "VARCHAR", "period_start": "DATE", "sample_count": "INTEGER", "metric_sum": "FLOAT",
+                    "days_back": "INTEGER"}
+}
+
+# Trigram (pg_trgm, enabled in init.sql) indexes for substring matches on
+# PostgreSQL, as {index name: (table, column)}
+TRIGRAM_INDEXES = {
+    "ix_user_genres_genre_name_trgm": ("user_genres", "genre_name")
+}
+
+def add_missing_columns(bind=None):
+    """Add any ADDED_COLUMNS that an existing table does not have yet"""
+    bind = bind or engine
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table, columns in ADDED_COLUMNS.items():
+            if not inspector.has_table(table):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for name, ddl in columns.items():
+                if name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+# Dialects with INSERT ... ON CONFLICT DO UPDATE
+UPSERT_INSERTS = {
+    "postgresql": postgresql_insert,
+    "sqlite": sqlite_insert
+}
+
+def upsert_statement(model, values: Optional[Dict[str, Any]], conflict_columns: List[str],
+                     update_columns: List[str], bind=None, increment_columns: List[str] = ()):
+    """Single-statement INSERT ... ON CONFLICT DO UPDATE for the bound dialect
+    
+    update_columns are overwritten with the new row's values, and
+    increment_columns have the new row's values added to them, atomically.
+    With values=None the statement has no values of its own; execute it
+    with a list of row dicts to upsert them all in one executemany.
+    Returns None when the dialect has no native upsert, so callers can fall
+    back to a SELECT followed by INSERT or UPDATE.
+    """
+    bind = bind or engine
+    insert = UPSERT_INSERTS.get(getattr(bind.dialect, "name", None))
+    if insert is None:
+        return None
+    stmt = insert(model)
+    if values is not None:
+        stmt = stmt.values(**values)
+    set_ = {column: stmt.excluded[column] for column in update_columns}
+    set_.update({column: getattr(model, column) + stmt.excluded[column] for column in increment_columns})
+    return stmt.on_conflict_do_update(index_elements=conflict_columns, set_=set_)
+
+def insert_ignore_statement(model, bind=None):
+    """INSERT ... ON CONFLICT DO NOTHING for the bound dialect, or None if unsupported
+    
+    Execute it with a list of row dicts to skip rows whose key already exists.
+    """
+    bind = bind or engine
+    insert = UPSERT_INSERTS.get(getattr(bind.dialect, "name", None))
+    if insert is None:
+        return None
+    return insert(model).on_conflict_do_nothing()
+
+def add_missing_indexes(bind=None):
+    """Create model indexes missing from tables that already existed
+    
+    create_all only creates the indexes of tables it creates itself. On
+    PostgreSQL the TRIGRAM_INDEXES are created too, unless pg_trgm is
+    unavailable.
+    """
+    bind = bind or engine
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+    if bind.dialect.name != "postgresql":
+        return
+    for name, (table, column) in TRIGRAM_INDEXES.items():
+        try:
+            with bind.begin() as conn:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} "
+                                  f"USING gin ({column} gin_trgm_ops)"))
+        except Exception as e:
+            print(f"Skipping trigram index {name}: {e}")
+
 def create_tables():
     """Create all tables"""
     Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    add_missing_indexes()
 
 def get_db():
     """Get database session"""
@@ -1,10 +1,15 @@
-from sqlalchemy.orm import Session
-from models import User, UserToken, UserAnalysis, UserTopArtist, UserTopTrack
+from sqlalchemy import and_, func, insert, select
+from sqlalchemy.orm import Session, joinedload, selectinload
+from models import User, UserToken, UserAnalysis, UserTopArtist, UserTopTrack, UserGenre
 from datetime import datetime, timedelta
+from contextlib import contextmanager
 from cryptography.fernet import Fernet
 import os
 import base64
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+from analysis_pipeline import TIME_RANGES
+from database import upsert_statement
+from trends import TrendRollup
 
 # Token encryption (you should store this in environment variables)
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY", Fernet.generate_key())
@@ -12,9 +17,62 @@ if isinstance(ENCRYPTION_KEY, str):
     ENCRYPTION_KEY = ENCRYPTION_KEY.encode()
 fernet = Fernet(ENCRYPTION_KEY)
 
+# Write top artists/tracks/genres with executemany INSERTs instead of one ORM object per row
+BULK_INSERTS = os.getenv("DB_BULK_INSERTS", "true").lower() in ("1", "true", "yes")
+
+# Fold each stored analysis into its weekly and monthly UserTrend rows
+ROLL_UP_TRENDS = os.getenv("TREND_ROLLUPS", "true").lower() in ("1", "true", "yes")
+
+# Columns of an analysis-history entry; ix_user_analyses_user_date serves the lookup
+ANALYSIS_HISTORY_COLUMNS = (
+    UserAnalysis.id,
+    UserAnalysis.analysis_date,
+    UserAnalysis.uniqueness_score,
+    UserAnalysis.uniqueness_rating,
+    UserAnalysis.genre_diversity_score,
+    UserAnalysis.obscurity_score,
+    UserAnalysis.total_tracks_played,
+    UserAnalysis.unique_artists,
+    UserAnalysis.unique_genres
+)
+
 class DatabaseService:
     def __init__(self, db: Session):
         self.db = db
+        self._in_unit_of_work = False
+    
+    @contextmanager
+    def unit_of_work(self):
+        """Stage several writes and commit them together
+        
+        Inside the block the service's methods flush instead of committing,
+        so generated IDs come back from INSERT ... RETURNING. Objects keep
+        their flushed state after the commit instead of being reloaded.
+        Nested blocks join the outer one.
+        """
+        if self._in_unit_of_work:
+            yield self
+            return
+        
+        self._in_unit_of_work = True
+        expire_on_commit = getattr(self.db, "expire_on_commit", True)
+        try:
+            yield self
+            self.db.expire_on_commit = False
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        finally:
+            self.db.expire_on_commit = expire_on_commit
+            self._in_unit_of_work = False
+    
+    def _commit(self):
+        """Commit, or only flush when inside a unit of work"""
+        if self._in_unit_of_work:
+            self.db.flush()
+        else:
+            self.db.commit()
     
     def encrypt_token(self, token: str) -> str:
         """Encrypt a token for storage"""
@@ -25,48 +83,88 @@ class DatabaseService:
         return fernet.decrypt(encrypted_token.encode()).decode()
     
     def get_or_create_user(self, spotify_user_data: Dict[str, Any]) -> User:
-        """Get existing user or create new one"""
+        """Get existing user or create new one
+        
+        On PostgreSQL and SQLite this is a single INSERT ... ON CONFLICT DO
+        UPDATE ... RETURNING, so concurrent first logins cannot race. Other
+        dialects fall back to SELECT then INSERT or UPDATE.
+        """
         user_id = spotify_user_data["id"]
+        now = datetime.utcnow()
+        values = {
+            "spotify_user_id": user_id,
+            "display_name": spotify_user_data.get("display_name", ""),
+            "email": spotify_user_data.get("email", ""),
+            "profile_image_url": spotify_user_data.get("images", [{}])[0].get("url", "") if spotify_user_data.get("images") else "",
+            "spotify_country": spotify_user_data.get("country", ""),
+            "follower_count": spotify_user_data.get("followers", {}).get("total", 0),
+            "premium_status": spotify_user_data.get("product") == "premium",
+            "created_at": now,
+            "last_login_at": now
+        }
+        
+        stmt = upsert_statement(User, values, ["spotify_user_id"], ["last_login_at"], self.db.get_bind())
+        if stmt is not None:
+            with self.unit_of_work():
+                return self.db.scalars(stmt.returning(User),
+                                       execution_options={"populate_existing": True}).one()
+        
         user = self.db.query(User).filter(User.spotify_user_id == user_id).first()
         
         if not user:
-            user = User(
-                spotify_user_id=user_id,
-                display_name=spotify_user_data.get("display_name", ""),
-                email=spotify_user_data.get("email", ""),
-                profile_image_url=spotify_user_data.get("images", [{}])[0].get("url", "") if spotify_user_data.get("images") else "",
-                spotify_country=spotify_user_data.get("country", ""),
-                follower_count=spotify_user_data.get("followers", {}).get("total", 0),
-                premium_status=spotify_user_data.get("product") == "premium",
-                created_at=datetime.utcnow(),
-                last_login_at=datetime.utcnow()
-            )
+            user = User(**values)
             self.db.add(user)
-            self.db.commit()
-            self.db.refresh(user)
+            # Inside a unit of work the INSERT is flushed with the analysis
+            if not self._in_unit_of_work:
+                self.db.commit()
+                self.db.refresh(user)
         else:
             # Update last login
-            user.last_login_at = datetime.utcnow()
-            self.db.commit()
+            user.last_login_at = now
+            if not self._in_unit_of_work:
+                self.db.commit()
         
         return user
     
     def store_user_tokens(self, user_id: str, access_token: str, refresh_token: str, expires_in: int):
-        """Store or update user tokens"""
+        """Store or update user tokens
+        
+        A single upsert where the dialect supports it, otherwise the existing
+        row is deleted and a new one inserted.
+        """
+        now = datetime.utcnow()
+        values = {
+            "user_id": user_id,
+            "access_token": self.encrypt_token(access_token),
+            "refresh_token": self.encrypt_token(refresh_token) if refresh_token else None,
+            "expires_at": now + timedelta(seconds=expires_in),
+            "created_at": now,
+            "updated_at": now
+        }
+        
+        stmt = upsert_statement(UserToken, values, ["user_id"],
+                                ["access_token", "refresh_token", "expires_at", "updated_at"],
+                                self.db.get_bind())
+        if stmt is not None:
+            self.db.execute(stmt)
+            self._commit()
+            return
+        
         # Remove existing tokens
         self.db.query(UserToken).filter(UserToken.user_id == user_id).delete()
         
         # Create new token record
-        expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
-        token_record = UserToken(
-            user_id=user_id,
-            access_token=self.encrypt_token(access_token),
-            refresh_token=self.encrypt_token(refresh_token) if refresh_token else None,
-            expires_at=expires_at
-        )
-        
-        self.db.add(token_record)
-        self.db.commit()
+        self.db.add(UserToken(**values))
+        self._commit()
+    
+    def get_user_timezone(self, user_id: str) -> Optional[str]:
+        """The user's configured timezone, or None for UTC"""
+        return self.db.query(User.timezone).filter(User.spotify_user_id == user_id).scalar()
+    
+    def set_user_timezone(self, user_id: str, timezone: Optional[str]):
+        """Configure the timezone used for the user's listening hours and weekdays"""
+        self.db.query(User).filter(User.spotify_user_id == user_id).update({"timezone": timezone})
+        self._commit()
     
     def get_user_tokens(self, user_id: str) -> Optional[UserToken]:
         """Get user tokens"""
@@ -79,8 +177,14 @@ class DatabaseService:
             return False
         return datetime.utcnow() < token.expires_at
     
-    def store_analysis(self, user_id: str, analysis_data: Dict[str, Any]) -> UserAnalysis:
-        """Store user analysis results"""
+    def store_analysis(self, user_id: str, analysis_data: Dict[str, Any],
+                       days_back: Optional[int] = None,
+                       genre_counts: Optional[Dict[str, int]] = None) -> UserAnalysis:
+        """Store user analysis results
+        
+        genre_counts, every genre's mentions most mentioned first, is stored
+        as user_genres rows; without it only the top 10 distribution is.
+        """
         uniqueness = analysis_data.get("uniqueness_score", {})
         listening_history = analysis_data.get("listening_history", {})
         genre_diversity = analysis_data.get("genre_diversity", {})
@@ -90,11 +194,12 @@ class DatabaseService:
         analysis = UserAnalysis(
             user_id=user_id,
             analysis_date=datetime.utcnow(),
+            days_back=days_back,
             
             # Scores
             uniqueness_score=uniqueness.get("uniqueness_score", 0.0),
             uniqueness_rating=uniqueness.get("rating", ""),
-            genre_diversity_score=genre_diversity.get("shannon_entropy", 0.0),
+            genre_diversity_score=genre_diversity.get("diversity_score", genre_diversity.get("shannon_entropy", 0.0)),
             obscurity_score=obscurity_score.get("obscurity_score", 0.0),
             
             # Listening stats
@@ -119,69 +224,258 @@ class DatabaseService:
             uniqueness_components=uniqueness.get("components", {})
         )
         
-        self.db.add(analysis)
-        self.db.commit()
-        self.db.refresh(analysis)
-        
-        # Store top artists and tracks
-        self._store_top_items(analysis.id, user_id, analysis_data)
+        # The analysis, its top items, its genres and its trend buckets are
+        # committed together; the flush fetches the new analysis id with RETURNING
+        with self.unit_of_work():
+            self.db.add(analysis)
+            self.db.flush()
+            self._store_top_items(analysis.id, user_id, analysis_data, commit=False, genre_counts=genre_counts)
+            if ROLL_UP_TRENDS:
+                TrendRollup(self.db).add_analysis(analysis)
         
         return analysis
     
-    def _store_top_items(self, analysis_id: int, user_id: str, analysis_data: Dict[str, Any]):
-        """Store top artists and tracks for this analysis"""
-        top_artists = analysis_data.get("top_artists", {})
-        top_tracks = analysis_data.get("top_tracks", {})
-        
-        # Store top artists
-        for time_range, artists in top_artists.items():
-            for rank, artist in enumerate(artists, 1):
-                artist_record = UserTopArtist(
-                    user_id=user_id,
-                    analysis_id=analysis_id,
-                    spotify_artist_id=artist["id"],
-                    artist_name=artist["name"],
-                    rank_position=rank,
-                    time_range=time_range,
-                    popularity=artist.get("popularity", 0),
-                    follower_count=artist.get("followers", {}).get("total", 0),
-                    genres=artist.get("genres", []),
-                    image_url=artist.get("images", [{}])[0].get("url", "") if artist.get("images") else ""
-                )
-                self.db.add(artist_record)
-        
-        # Store top tracks
-        for time_range, tracks in top_tracks.items():
-            for rank, track in enumerate(tracks, 1):
-                track_record = UserTopTrack(
-                    user_id=user_id,
-                    analysis_id=analysis_id,
-                    spotify_track_id=track["id"],
-                    track_name=track["name"],
-                    artist_name=track["artists"][0]["name"] if track.get("artists") else "",
-                    album_name=track.get("album", {}).get("name", ""),
-                    rank_position=rank,
-                    time_range=time_range,
-                    popularity=track.get("popularity", 0),
-                    duration_ms=track.get("duration_ms", 0),
-                    explicit=track.get("explicit", False),
-                    release_date=track.get("album", {}).get("release_date", ""),
-                    image_url=track.get("album", {}).get("images", [{}])[0].get("url", "") if track.get("album", {}).get("images") else ""
-                )
-                self.db.add(track_record)
-        
-        self.db.commit()
-    
-    def get_user_latest_analysis(self, user_id: str) -> Optional[UserAnalysis]:
-        """Get user's most recent analysis"""
-        return (self.db.query(UserAnalysis)
+    def store_user_analysis(self, spotify_user_data: Dict[str, Any], analysis_data: Dict[str, Any],
+                            days_back: Optional[int] = None,
+                            genre_counts: Optional[Dict[str, int]] = None) -> UserAnalysis:
+        """Upsert the user and store an analysis with its items in one commit"""
+        with self.unit_of_work():
+            user = self.get_or_create_user(spotify_user_data)
+            return self.store_analysis(user.spotify_user_id, analysis_data, days_back, genre_counts)
+    
+    def _store_top_items(self, analysis_id: int, user_id: str, analysis_data: Dict[str, Any],
+                         bulk: bool = BULK_INSERTS, commit: bool = True,
+                         genre_counts: Optional[Dict[str, int]] = None):
+        """Store top artists, top tracks and genres for this analysis
+        
+        In bulk mode each table is written with a single executemany INSERT,
+        which SQLAlchemy sends as batched multi-row VALUES statements. The ORM
+        mode adds one object per row.
+        """
+        rows = {
+            UserTopArtist: self._top_artist_rows(analysis_id, user_id, analysis_data.get("top_artists", {})),
+            UserTopTrack: self._top_track_rows(analysis_id, user_id, analysis_data.get("top_tracks", {})),
+            UserGenre: self._genre_rows(analysis_id, user_id, analysis_data.get("genre_diversity", {}), genre_counts)
+        }
+        
+        for model, model_rows in rows.items():
+            if not model_rows:
+                continue
+            if bulk:
+                self.db.execute(insert(model), model_rows)
+            else:
+                for row in model_rows:
+                    self.db.add(model(**row))
+        
+        if commit:
+            self.db.commit()
+    
+    @staticmethod
+    def _top_artist_rows(analysis_id: int, user_id: str, top_artists: Dict[str, List[Dict]]) -> List[Dict]:
+        return [
+            {
+                "user_id": user_id,
+                "analysis_id": analysis_id,
+                "spotify_artist_id": artist["id"],
+                "artist_name": artist["name"],
+                "rank_position": rank,
+                "time_range": time_range,
+                "popularity": artist.get("popularity", 0),
+                "follower_count": artist.get("followers", {}).get("total", 0),
+                "genres": artist.get("genres", []),
+                "image_url": artist.get("images", [{}])[0].get("url", "") if artist.get("images") else ""
+            }
+            for time_range, artists in top_artists.items()
+            for rank, artist in enumerate(artists, 1)
+        ]
+    
+    @staticmethod
+    def _top_track_rows(analysis_id: int, user_id: str, top_tracks: Dict[str, List[Dict]]) -> List[Dict]:
+        return [
+            {
+                "user_id": user_id,
+                "analysis_id": analysis_id,
+                "spotify_track_id": track["id"],
+                "track_name": track["name"],
+                "artist_name": track["artists"][0]["name"] if track.get("artists") else "",
+                "album_name": track.get("album", {}).get("name", ""),
+                "rank_position": rank,
+                "time_range": time_range,
+                "popularity": track.get("popularity", 0),
+                "duration_ms": track.get("duration_ms", 0),
+                "explicit": track.get("explicit", False),
+                "release_date": track.get("album", {}).get("release_date", ""),
+                "image_url": track.get("album", {}).get("images", [{}])[0].get("url", "") if track.get("album", {}).get("images") else ""
+            }
+            for time_range, tracks in top_tracks.items()
+            for rank, track in enumerate(tracks, 1)
+        ]
+    
+    @staticmethod
+    def _genre_rows(analysis_id: int, user_id: str, genre_diversity: Dict[str, Any],
+                    genre_counts: Optional[Dict[str, int]] = None) -> List[Dict]:
+        # Every genre when they are given, else the top 10 distribution
+        counts = genre_counts or genre_diversity.get("genre_distribution", {})
+        total = genre_diversity.get("total_genre_mentions") or sum(counts.values())
+        return [
+            {
+                "user_id": user_id,
+                "analysis_id": analysis_id,
+                "genre_name": genre,
+                "occurrence_count": count,
+                "percentage": count / total * 100 if total else 0.0,
+                "rank_position": rank
+            }
+            for rank, (genre, count) in enumerate(counts.items(), 1)
+        ]
+    
+    def get_users_by_top_genre(self, genre: str, limit: int = 20, contains: bool = False) -> List[Dict[str, Any]]:
+        """Users whose latest analysis has genre as its top genre, largest share first
+        
+        Exact names use the (genre_name, rank_position) index; contains=True
+        matches a case-insensitive substring, which the trigram index serves
+        on PostgreSQL.
+        """
+        latest = (select(func.max(UserAnalysis.id))
+                  .where(UserAnalysis.user_id == UserGenre.user_id)
+                  .scalar_subquery())
+        match = (UserGenre.genre_name.icontains(genre, autoescape=True) if contains
+                 else UserGenre.genre_name == genre)
+        rows = (self.db.query(UserGenre.user_id, User.display_name, UserGenre.genre_name, UserGenre.percentage)
+                .join(User, User.spotify_user_id == UserGenre.user_id)
+                .filter(match, UserGenre.rank_position == 1, UserGenre.analysis_id == latest)
+                .order_by(UserGenre.percentage.desc())
+                .limit(limit)
+                .all())
+        return [{"user_id": user_id, "display_name": name, "genre": genre_name, "percentage": percentage}
+                for user_id, name, genre_name, percentage in rows]
+    
+    def get_genre_share_history(self, user_id: str, genre: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """The genre's share of the user's genre mentions in each of their latest analyses, oldest first
+        
+        Analyses where the genre was not mentioned have a share of 0.
+        """
+        rows = (self.db.query(UserAnalysis.analysis_date, UserGenre.percentage, UserGenre.occurrence_count,
+                              UserGenre.rank_position)
+                .outerjoin(UserGenre, and_(UserGenre.analysis_id == UserAnalysis.id, UserGenre.genre_name == genre))
                 .filter(UserAnalysis.user_id == user_id)
+                .order_by(UserAnalysis.analysis_date.desc())
+                .limit(limit)
+                .all())
+        return [{"analysis_date": analysis_date.isoformat(), "percentage": percentage or 0.0,
+                 "occurrence_count": count or 0, "rank_position": rank}
+                for analysis_date, percentage, count, rank in reversed(rows)]
+    
+    def get_user_latest_analysis(self, user_id: str, days_back: Optional[int] = None,
+                                 max_age_seconds: Optional[float] = None,
+                                 with_items: bool = False) -> Optional[UserAnalysis]:
+        """Get user's most recent analysis
+        
+        Args:
+            days_back: Only consider analyses computed over this window
+            max_age_seconds: Only consider analyses at most this old
+            with_items: Eager-load the user and top artists/tracks, so the
+                row can be turned into a response without further queries
+        """
+        conditions = [UserAnalysis.user_id == user_id]
+        if days_back is not None:
+            conditions.append(UserAnalysis.days_back == days_back)
+        if max_age_seconds is not None:
+            conditions.append(UserAnalysis.analysis_date >= datetime.utcnow() - timedelta(seconds=max_age_seconds))
+        
+        query = self.db.query(UserAnalysis)
+        if with_items:
+            query = query.options(joinedload(UserAnalysis.user),
+                                  selectinload(UserAnalysis.top_artists),
+                                  selectinload(UserAnalysis.top_tracks))
+        return (query.filter(*conditions)
                 .order_by(UserAnalysis.analysis_date.desc())
                 .first())
     
+    def get_stored_analysis_response(self, user_id: str, days_back: Optional[int] = None,
+                                     max_age_seconds: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Rebuild the /user/analysis response from the latest stored analysis"""
+        analysis = self.get_user_latest_analysis(user_id, days_back, max_age_seconds, with_items=True)
+        return self.analysis_to_response(analysis) if analysis else None
+    
+    def analysis_to_response(self, analysis: UserAnalysis) -> Dict[str, Any]:
+        """Turn a stored analysis and its top items back into the API response shape
+        
+        Only what store_analysis persists is returned; derived statistics that
+        are not stored (e.g. most played tracks, popularity spread) are omitted.
+        """
+        user = analysis.user
+        top_artists: Dict[str, List[Dict]] = {time_range: [] for time_range in TIME_RANGES}
+        for artist in sorted(analysis.top_artists, key=lambda a: a.rank_position):
+            top_artists.setdefault(artist.time_range, []).append({
+                "id": artist.spotify_artist_id,
+                "name": artist.artist_name,
+                "popularity": artist.popularity,
+                "followers": {"total": artist.follower_count},
+                "genres": artist.genres or [],
+                "images": [{"url": artist.image_url}] if artist.image_url else []
+            })
+        top_tracks: Dict[str, List[Dict]] = {time_range: [] for time_range in TIME_RANGES}
+        for track in sorted(analysis.top_tracks, key=lambda t: t.rank_position):
+            top_tracks.setdefault(track.time_range, []).append({
+                "id": track.spotify_track_id,
+                "name": track.track_name,
+                "artists": [{"name": track.artist_name}],
+                "album": {
+                    "name": track.album_name,
+                    "release_date": track.release_date,
+                    "images": [{"url": track.image_url}] if track.image_url else []
+                },
+                "popularity": track.popularity,
+                "duration_ms": track.duration_ms,
+                "explicit": track.explicit
+            })
+        
+        return {
+            "user_profile": {
+                "id": analysis.user_id,
+                "name": user.display_name if user else "",
+                "followers": user.follower_count if user else 0
+            },
+            "listening_history": {
+                "total_tracks_played": analysis.total_tracks_played,
+                "unique_tracks": analysis.unique_tracks,
+                "unique_artists": analysis.unique_artists,
+                "repetition_rate": analysis.repetition_rate,
+                "listening_by_hour": analysis.listening_by_hour or {},
+                "listening_by_day": analysis.listening_by_day or {}
+            },
+            "top_artists": top_artists,
+            "top_tracks": top_tracks,
+            "track_characteristics": {
+                "avg_popularity": analysis.avg_popularity,
+                "avg_duration_minutes": analysis.avg_duration_minutes,
+                "explicit_percentage": analysis.explicit_percentage,
+                "avg_release_year": analysis.avg_release_year,
+                "year_range": analysis.year_range
+            },
+            "genre_diversity": {
+                "diversity_score": analysis.genre_diversity_score,
+                "unique_genres": analysis.unique_genres,
+                "genre_distribution": analysis.genre_distribution or {}
+            },
+            "obscurity_score": {"obscurity_score": analysis.obscurity_score},
+            "uniqueness_score": {
+                "uniqueness_score": analysis.uniqueness_score,
+                "components": analysis.uniqueness_components or {},
+                "rating": analysis.uniqueness_rating
+            },
+            "insights": analysis.insights or [],
+            "analysis_date": analysis.analysis_date.isoformat()
+        }
+    
     def get_user_analysis_history(self, user_id: str, limit: int = 10) -> list:
-        """Get user's analysis history"""
-        return (self.db.query(UserAnalysis)
+        """Get user's analysis history, newest first
+        
+        Only the ANALYSIS_HISTORY_COLUMNS are selected, as rows with those
+        attributes, so the JSON columns are never read or deserialized.
+        """
+        return (self.db.query(*ANALYSIS_HISTORY_COLUMNS)
                 .filter(UserAnalysis.user_id == user_id)
                 .order_by(UserAnalysis.analysis_date.desc())
                 .limit(limit)
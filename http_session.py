@@ -0,0 +1,85 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, Optional
+
+# Connection pool settings shared by every outbound Spotify call
+HTTP_POOL_SIZE = int(os.getenv("SPOTIFY_HTTP_POOL_SIZE", "100"))
+HTTP_TIMEOUT = float(os.getenv("SPOTIFY_HTTP_TIMEOUT", "10"))
+HTTP_RETRIES = int(os.getenv("SPOTIFY_HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = 0.3
+HTTP_RETRY_STATUSES = (500, 502, 503, 504)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def create_session(pool_size: int = HTTP_POOL_SIZE, retries: int = HTTP_RETRIES) -> requests.Session:
+    """Create a keep-alive session with a bounded pool and retry policy
+
+    Only idempotent GETs are retried, and only on transient 5xx errors.
+    429s are left to the caller so rate limiting stays in one place.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=HTTP_RETRY_STATUSES,
+        allowed_methods=frozenset({"GET"}),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Get the process-wide pooled session"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def close_session():
+    """Close the process-wide session and drop its pooled connections"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def get_connection_stats(session: Optional[requests.Session] = None) -> Dict:
+    """Count requests and new connections per host for a pooled session
+
+    Every request that did not open a new connection reused a kept-alive one,
+    so a healthy pool shows reused_connections growing much faster than
+    new_connections.
+    """
+    session = session or get_session()
+    hosts = {}
+
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats = hosts.setdefault(pool.host, {"requests": 0, "new_connections": 0})
+            stats["requests"] += pool.num_requests
+            stats["new_connections"] += pool.num_connections
+
+    for stats in hosts.values():
+        stats["reused_connections"] = max(stats["requests"] - stats["new_connections"], 0)
+
+    return {
+        "requests": sum(s["requests"] for s in hosts.values()),
+        "new_connections": sum(s["new_connections"] for s in hosts.values()),
+        "reused_connections": sum(s["reused_connections"] for s in hosts.values()),
+        "hosts": hosts
+    }
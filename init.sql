@@ -9,7 +9,8 @@ CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 CREATE EXTENSION IF NOT EXISTS "pg_trgm";
 
 -- Create indexes for common queries (will be created by SQLAlchemy but good to have)
--- These will be created after tables are set up
+-- These will be created after tables are set up; create_tables() also adds
+-- the pg_trgm GIN index on user_genres.genre_name for substring genre search
 
 -- Grant permissions
 GRANT ALL PRIVILEGES ON DATABASE statify TO statify_user;
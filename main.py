@@ -1,18 +1,33 @@
-from fastapi import FastAPI, HTTPException, Request, Depends
+from fastapi import FastAPI, HTTPException, Request, Depends, Response
 from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
-import requests
 import os
+import asyncio
+from functools import partial
+from typing import Optional
 from urllib.parse import urlencode
 import base64
 from dotenv import load_dotenv
 
 # Import our new classes
-from spotify_client import SpotifyClient
-from data_processor import SpotifyDataProcessor
+from async_spotify_client import AsyncSpotifyClient, open_http_pool, close_http_pool, get_http_pool_stats
+from http_session import get_session, close_session, get_connection_stats, HTTP_TIMEOUT
+from rate_limiter import get_scheduler, BACKGROUND
+from data_processor import create_processor
+from analysis_pipeline import (fetch_analysis_inputs, build_analysis, split_genre_counts, format_server_timing,
+                               remember_metadata, stream_listening_aggregate, STREAM_RECENT_TRACKS)
+from metadata_cache import get_metadata_cache
+from analysis_cache import get_analysis_cache, etag_matches
+from single_flight import get_analysis_flight, analysis_run_key
+from spotify_auth import refresh_access_token, TokenRefreshError
+from refresh_worker import RefreshWorker, REFRESH_WORKER_ENABLED
+from play_log import PlayLog, PLAY_LOG_ENABLED, TOP_PLAYED_KINDS, listening_summary
+from timeutils import resolve_timezone
+from topk import TOP_K_MODES
+from trends import TrendRollup, TREND_METRICS, TREND_PERIODS
 
 # Database imports
-from database import get_db, create_tables
+from database import get_db, create_tables, SessionLocal
 from models import User, UserToken, UserAnalysis
 from sqlalchemy.orm import Session
 from db_service import DatabaseService
@@ -21,14 +36,28 @@ load_dotenv()
 
 app = FastAPI(title="Spotify Stats API")
 
+# Precomputes analyses for active users when ANALYSIS_REFRESH_WORKER is set
+refresh_worker = RefreshWorker()
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
     create_tables()
+    await open_http_pool()
+    if REFRESH_WORKER_ENABLED:
+        refresh_worker.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await refresh_worker.stop()
+    await close_http_pool()
+    close_session()
 
 # Configuration
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:8000")
+# Stored analyses younger than this are served instead of recomputing from Spotify
+ANALYSIS_MAX_AGE_SECONDS = int(os.getenv("ANALYSIS_MAX_AGE_SECONDS", str(6 * 3600)))
 
 # Add CORS middleware for frontend
 app.add_middleware(
@@ -49,6 +78,25 @@ SPOTIFY_SCOPE = "user-read-private user-read-email user-top-read user-read-recen
 async def root():
     return {"message": "Spotify Stats API is running"}
 
+@app.get("/metrics/http")
+async def http_metrics():
+    """Connection reuse and rate limiter counters for outbound Spotify calls
+    
+    The top-level counters cover the requests Session (OAuth, token checks
+    and SpotifyClient); async_pool covers the httpx pool behind
+    AsyncSpotifyClient, which makes the analysis calls.
+    """
+    return {**get_connection_stats(), "async_pool": get_http_pool_stats(), "rate_limiter": get_scheduler().stats()}
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    """Counters for the metadata cache, analysis cache and analysis deduplication"""
+    return {
+        **get_metadata_cache().stats(),
+        "analysis_responses": get_analysis_cache().stats(),
+        "analysis_single_flight": get_analysis_flight().stats()
+    }
+
 @app.get("/login")
 async def login():
     """Redirect user to Spotify authorization"""
@@ -86,7 +134,9 @@ async def callback(code: str = None, error: str = None, db: Session = Depends(ge
         "redirect_uri": SPOTIFY_REDIRECT_URI
     }
     
-    response = requests.post("https://accounts.spotify.com/api/token", headers=headers, data=data)
+    # requests is blocking, so the exchange runs off the event loop
+    response = await asyncio.to_thread(get_session().post, "https://accounts.spotify.com/api/token",
+                                       headers=headers, data=data, timeout=HTTP_TIMEOUT)
     
     if response.status_code != 200:
         return RedirectResponse(url=f"{FRONTEND_URL}?error=token_failed")
@@ -98,13 +148,14 @@ async def callback(code: str = None, error: str = None, db: Session = Depends(ge
     
     try:
         # Get user profile from Spotify
-        client = SpotifyClient(access_token)
-        user_profile = client.get_user_profile()
+        client = AsyncSpotifyClient(access_token)
+        user_profile = await client.get_user_profile()
         
         # Store user and tokens in database
         db_service = DatabaseService(db)
-        user = db_service.get_or_create_user(user_profile)
-        db_service.store_user_tokens(user.spotify_user_id, access_token, refresh_token, expires_in)
+        with db_service.unit_of_work():
+            user = db_service.get_or_create_user(user_profile)
+            db_service.store_user_tokens(user.spotify_user_id, access_token, refresh_token, expires_in)
         
     except Exception as e:
         print(f"Database operation failed: {e}")
@@ -120,7 +171,8 @@ async def validate_token(access_token: str):
     try:
         # Try to get user profile to validate token
         headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get("https://api.spotify.com/v1/me", headers=headers)
+        response = await asyncio.to_thread(get_session().get, "https://api.spotify.com/v1/me",
+                                           headers=headers, timeout=HTTP_TIMEOUT)
         
         if response.status_code == 200:
             return {"valid": True, "user": response.json()}
@@ -134,121 +186,308 @@ async def validate_token(access_token: str):
 async def refresh_token(refresh_token: str):
     """Refresh the access token using refresh token"""
     try:
-        auth_header = base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
-        
-        headers = {
-            "Authorization": f"Basic {auth_header}",
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-        
-        data = {
-            "grant_type": "refresh_token",
-            "refresh_token": refresh_token
-        }
-        
-        response = requests.post("https://accounts.spotify.com/api/token", headers=headers, data=data)
-        
-        if response.status_code == 200:
-            token_data = response.json()
-            return {
-                "access_token": token_data["access_token"],
-                "expires_in": token_data.get("expires_in", 3600),
-                "refresh_token": token_data.get("refresh_token", refresh_token)  # Sometimes not returned
-            }
-        else:
-            raise HTTPException(status_code=400, detail="Failed to refresh token")
+        return await asyncio.to_thread(refresh_access_token, refresh_token)
+    except TokenRefreshError:
+        raise HTTPException(status_code=400, detail="Failed to refresh token")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Token refresh failed: {str(e)}")
 
+# Background analysis refreshes, referenced until they finish
+_revalidations = set()
+
+def _user_timezone(db_service: DatabaseService, user_id: str) -> Optional[str]:
+    """The user's configured timezone for hour/weekday stats, or None for UTC"""
+    try:
+        timezone = db_service.get_user_timezone(user_id)
+        resolve_timezone(timezone)
+    except Exception as e:
+        print(f"Failed to load timezone for {user_id}, using UTC: {e}")
+        return None
+    return timezone if isinstance(timezone, str) else None
+
+async def _run_analysis(client: AsyncSpotifyClient, db: Session, user_profile: dict,
+                        days_back: int, response: Response = None) -> dict:
+    """Fetch, process and store a fresh analysis for one user"""
+    db_service = DatabaseService(db)
+    timezone = _user_timezone(db_service, user_profile["id"])
+    processor = create_processor(timezone)
+    
+    # Listening history comes from the play log, which only fetches new plays
+    # and keeps daily counters, so no individual plays are read back
+    recent_tracks = None
+    if PLAY_LOG_ENABLED:
+        recent_tracks = partial(listening_summary, client, user_profile["id"], timezone=timezone,
+                                user_profile=user_profile)
+    elif STREAM_RECENT_TRACKS:
+        recent_tracks = partial(stream_listening_aggregate, client, buckets=processor.buckets)
+    
+    # Gather all data concurrently
+    print("Fetching user data...")
+    inputs, timings = await fetch_analysis_inputs(client, days_back, user_profile=user_profile,
+                                                  recent_tracks=recent_tracks)
+    sequential_ms = sum(duration for name, duration in timings.items() if name != "total")
+    print(f"Fetched Spotify data in {timings['total']:.0f}ms (sum of calls: {sequential_ms:.0f}ms)")
+    if response is not None:
+        response.headers["Server-Timing"] = format_server_timing(timings)
+    await asyncio.to_thread(remember_metadata, inputs)
+    
+    # Audio features are skipped since Spotify deprecated the endpoint
+    
+    # Process all the data
+    print("Processing data...")
+    analysis = build_analysis(processor, inputs)
+    genre_counts = split_genre_counts(analysis)
+    
+    # Store analysis in database
+    try:
+        db_service.store_user_analysis(inputs["user_profile"], analysis, days_back, genre_counts)
+    except Exception as e:
+        print(f"Failed to store analysis in database: {e}")
+        # Continue without database storage
+    
+    return analysis
+
+async def _load_or_run_analysis(client: AsyncSpotifyClient, db: Session, user_profile: dict, days_back: int,
+                                max_age: int, response: Response = None):
+    """Return the latest stored analysis younger than max_age, or compute a new one
+    
+    Concurrent calls for the same user and parameters share one lookup, and
+    every fresh computation for the user and days_back (including the refresh
+    worker's) is shared under analysis_run_key. Returns the analysis and
+    where it came from ("STORED" or "MISS").
+    """
+    async def load_or_run():
+        # Checked under the single-flight lock, so a result stored by another
+        # worker while this one waited is reused
+        if max_age > 0:
+            try:
+                stored = DatabaseService(db).get_stored_analysis_response(user_profile["id"], days_back, max_age)
+            except Exception as e:
+                print(f"Failed to load stored analysis: {e}")
+                stored = None
+            if stored is not None:
+                return stored, "STORED"
+        analysis = await get_analysis_flight().do(analysis_run_key(user_profile["id"], days_back),
+                                                  partial(_run_analysis, client, db, user_profile, days_back, response))
+        return analysis, "MISS"
+    
+    key = ("analysis", user_profile["id"], days_back, max_age)
+    return await get_analysis_flight().do(key, load_or_run)
+
+async def _revalidate_analysis(access_token: str, user_profile: dict, days_back: int):
+    """Refresh a stale cached analysis off the request path
+    
+    Always recomputes: a stored analysis has the reduced analysis_to_response
+    shape, and caching it as fresh would switch the body and ETag served for
+    the entry.
+    """
+    cache = get_analysis_cache()
+    db = SessionLocal()
+    try:
+        client = AsyncSpotifyClient(access_token, priority=BACKGROUND)
+        analysis, _ = await _load_or_run_analysis(client, db, user_profile, days_back, 0)
+        cache.put(user_profile["id"], days_back, analysis)
+    except Exception as e:
+        print(f"Background analysis refresh failed: {e}")
+    finally:
+        db.close()
+        cache.finish_refresh(user_profile["id"], days_back)
+
+def _cached_analysis_response(request: Request, response: Response, entry, cache_status: str):
+    """Serve a cached analysis, or 304 when the client already has this version"""
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"private, max-age={get_analysis_cache().max_age(entry)}",
+        "X-Cache": cache_status
+    }
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return entry.analysis
+
 # New comprehensive analysis endpoint
 @app.get("/user/analysis")
-async def get_user_analysis(access_token: str, days_back: int = 30, db: Session = Depends(get_db)):
-    """Get comprehensive user music analysis"""
+async def get_user_analysis(access_token: str, request: Request, response: Response, days_back: int = 30,
+                            refresh: bool = False, max_age: Optional[int] = None, db: Session = Depends(get_db)):
+    """Get comprehensive user music analysis
+    
+    Results are cached per user and days_back. A fresh entry is returned
+    without calling Spotify; a stale one is returned immediately while it is
+    refreshed in the background. On a cache miss the latest stored analysis
+    is used when it is younger than max_age seconds (default
+    ANALYSIS_MAX_AGE_SECONDS). Pass refresh=true to force a recompute.
+    """
     try:
-        client = SpotifyClient(access_token)
-        processor = SpotifyDataProcessor()
-        db_service = DatabaseService(db)
+        cache = get_analysis_cache()
+        client = AsyncSpotifyClient(access_token)
         
-        # Gather all data
-        print("Fetching user data...")
-        user_profile = client.get_user_profile()
+        user_profile = cache.lookup_user(access_token)
+        if user_profile is None:
+            user_profile = await client.get_user_profile()
+            cache.remember_user(access_token, user_profile)
+        user_id = user_profile["id"]
         
-        print("Fetching top artists...")
-        top_artists_short = client.get_top_artists("short_term", 50)
-        top_artists_medium = client.get_top_artists("medium_term", 50)
-        top_artists_long = client.get_top_artists("long_term", 50)
+        entry = None if refresh else cache.get(user_id, days_back)
+        if entry is not None:
+            if cache.is_fresh(entry):
+                return _cached_analysis_response(request, response, entry, "HIT")
+            if cache.start_refresh(user_id, days_back):
+                task = asyncio.create_task(_revalidate_analysis(access_token, user_profile, days_back))
+                _revalidations.add(task)
+                task.add_done_callback(_revalidations.discard)
+            return _cached_analysis_response(request, response, entry, "STALE")
         
-        print("Fetching top tracks...")
-        top_tracks_short = client.get_top_tracks("short_term", 50)
-        top_tracks_medium = client.get_top_tracks("medium_term", 50)
-        top_tracks_long = client.get_top_tracks("long_term", 50)
+        if refresh:
+            max_age = 0
+        elif max_age is None:
+            max_age = ANALYSIS_MAX_AGE_SECONDS
+        analysis, source = await _load_or_run_analysis(client, db, user_profile, days_back, max_age, response)
+        entry = cache.put(user_id, days_back, analysis)
+        return _cached_analysis_response(request, response, entry, source)
         
-        print("Fetching recent listening history...")
-        recent_tracks = client.get_all_recent_tracks(days_back)
-        
-        # Get audio features for top tracks (limit to prevent issues)
-        print("Note: Audio features endpoint deprecated by Spotify")
-        # Skip audio features since they're no longer available
+    except Exception as e:
+        print(f"Full error: {e}")
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+@app.get("/user/top-played")
+async def get_top_played(access_token: str, kind: str = "artists", days_back: int = 30, limit: int = 10,
+                         mode: Optional[str] = None, db: Session = Depends(get_db)):
+    """Most played artists or tracks over the stored play log
+    
+    Merged from the play log's daily counters, so the window can be much
+    longer than Spotify's recently-played list. mode is "exact" or
+    "approximate" (TOP_K_MODE by default). Covers plays stored up to the
+    user's last analysis.
+    """
+    if not PLAY_LOG_ENABLED:
+        raise HTTPException(status_code=404, detail="Play log is disabled")
+    if kind not in TOP_PLAYED_KINDS or (mode is not None and mode not in TOP_K_MODES):
+        raise HTTPException(status_code=400, detail="kind must be artists or tracks, mode exact or approximate")
+    
+    try:
+        user_profile = get_analysis_cache().lookup_user(access_token)
+        if user_profile is None:
+            user_profile = await AsyncSpotifyClient(access_token).get_user_profile()
         
-        # Process all the data
-        print("Processing data...")
-        analysis = {
-            "user_profile": {
-                "id": user_profile["id"],
-                "name": user_profile["display_name"],
-                "followers": user_profile.get("followers", {}).get("total", 0)
-            },
-            "listening_history": processor.process_listening_history(recent_tracks),
-            "top_artists": {
-                "short_term": top_artists_short[:10],
-                "medium_term": top_artists_medium[:10],
-                "long_term": top_artists_long[:10]
-            },
-            "top_tracks": {
-                "short_term": top_tracks_short[:10],
-                "medium_term": top_tracks_medium[:10],
-                "long_term": top_tracks_long[:10]
-            },
-            "track_characteristics": processor.analyze_track_characteristics(
-                top_tracks_short + top_tracks_medium + top_tracks_long
-            ),
-            "genre_diversity": processor.calculate_genre_diversity(
-                top_artists_short + top_artists_medium + top_artists_long
-            ),
-            "obscurity_score": processor.calculate_obscurity_score(
-                top_artists_short + top_artists_medium + top_artists_long,
-                top_tracks_short + top_tracks_medium + top_tracks_long
-            )
-        }
+        top = await asyncio.to_thread(PlayLog(db).top_played, user_profile["id"], days_back, kind, limit, mode)
+        return {kind: [{"name" if kind == "artists" else "id": item, "plays": count} for item, count in top]}
+    except Exception as e:
+        print(f"Failed to get top played {kind}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get top played: {str(e)}")
+
+@app.get("/user/unique-counts")
+async def get_unique_counts(access_token: str, days_back: int = 365, db: Session = Depends(get_db)):
+    """Estimated distinct tracks and artists played over the stored play log
+    
+    Unions the play log's daily HyperLogLog sketches, so long windows cost
+    one small row per day (about 1.6% standard error, see cardinality.py).
+    Covers plays stored up to the user's last analysis.
+    """
+    if not PLAY_LOG_ENABLED:
+        raise HTTPException(status_code=404, detail="Play log is disabled")
+    
+    try:
+        user_profile = get_analysis_cache().lookup_user(access_token)
+        if user_profile is None:
+            user_profile = await AsyncSpotifyClient(access_token).get_user_profile()
         
-        # Calculate overall uniqueness
-        analysis["uniqueness_score"] = processor.calculate_uniqueness_score(analysis)
+        counts = await asyncio.to_thread(PlayLog(db).unique_counts, user_profile["id"], days_back)
+        return {"days_back": days_back, "unique_tracks": counts["tracks"], "unique_artists": counts["artists"]}
+    except Exception as e:
+        print(f"Failed to get unique counts: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get unique counts: {str(e)}")
+
+@app.get("/genres/top-users")
+async def get_genre_top_users(access_token: str, genre: str, contains: bool = False, limit: int = 20,
+                              db: Session = Depends(get_db)):
+    """Users whose latest analysis has genre as its top genre
+    
+    Pass contains=true to match any genre containing the text (e.g. "rock"
+    for "indie rock"), case-insensitively.
+    """
+    try:
+        # Only signed-in users may query, so the token is checked first
+        if get_analysis_cache().lookup_user(access_token) is None:
+            await AsyncSpotifyClient(access_token).get_user_profile()
         
-        # Generate insights
-        analysis["insights"] = processor.generate_insights(analysis)
+        users = DatabaseService(db).get_users_by_top_genre(genre, limit, contains)
+        return {"genre": genre, "users": users}
+    except Exception as e:
+        print(f"Failed to get top users for genre {genre}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get genre users: {str(e)}")
+
+@app.get("/user/genre-history")
+async def get_genre_history(access_token: str, genre: str, limit: int = 20, db: Session = Depends(get_db)):
+    """A genre's share of the user's genre mentions across their stored analyses, oldest first"""
+    try:
+        user_profile = get_analysis_cache().lookup_user(access_token)
+        if user_profile is None:
+            user_profile = await AsyncSpotifyClient(access_token).get_user_profile()
         
-        # Store analysis in database
-        try:
-            user = db_service.get_or_create_user(user_profile)
-            db_service.store_analysis(user.spotify_user_id, analysis)
-        except Exception as e:
-            print(f"Failed to store analysis in database: {e}")
-            # Continue without database storage
+        history = DatabaseService(db).get_genre_share_history(user_profile["id"], genre, limit)
+        return {"genre": genre, "history": history}
+    except Exception as e:
+        print(f"Failed to get genre history: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get genre history: {str(e)}")
+
+@app.get("/user/trends")
+async def get_user_trends(access_token: str, period: str = "week", limit: int = 12, metric: Optional[str] = None,
+                          days_back: int = 30, db: Session = Depends(get_db)):
+    """Weekly or monthly trends of the user's analysis metrics, oldest first
+    
+    Read from the UserTrend rollups that are maintained as analyses are
+    stored, so the cost does not grow with the number of analyses. Only
+    analyses over the days_back window are included.
+    """
+    if period not in TREND_PERIODS or (metric is not None and metric not in TREND_METRICS):
+        raise HTTPException(status_code=400, detail=f"period must be one of {', '.join(TREND_PERIODS)}, "
+                                                    f"metric one of {', '.join(TREND_METRICS)}")
+    
+    try:
+        user_profile = get_analysis_cache().lookup_user(access_token)
+        if user_profile is None:
+            user_profile = await AsyncSpotifyClient(access_token).get_user_profile()
         
-        return analysis
+        trends = TrendRollup(db).get_trends(user_profile["id"], period, limit, metric, days_back=days_back)
+        return {"period": period, "days_back": days_back, "trends": trends}
+    except Exception as e:
+        print(f"Failed to get trends: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to get trends: {str(e)}")
+
+@app.put("/user/timezone")
+async def set_user_timezone(access_token: str, timezone: str, db: Session = Depends(get_db)):
+    """Set the IANA timezone (e.g. Europe/Berlin) used for listening hours and weekdays
+    
+    Applies to analyses computed from now on, including the plays already in
+    the play log, whose counters are kept in UTC and shifted when read; pass
+    refresh=true to /user/analysis to recompute straight away.
+    """
+    try:
+        resolve_timezone(timezone)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        user_profile = get_analysis_cache().lookup_user(access_token)
+        if user_profile is None:
+            user_profile = await AsyncSpotifyClient(access_token).get_user_profile()
         
+        db_service = DatabaseService(db)
+        db_service.get_or_create_user(user_profile)
+        db_service.set_user_timezone(user_profile["id"], timezone)
+        return {"user_id": user_profile["id"], "timezone": timezone}
     except Exception as e:
-        print(f"Full error: {e}")
-        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+        print(f"Failed to set timezone: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to set timezone: {str(e)}")
 
 @app.get("/user/test-audio-features")
 async def test_audio_features(access_token: str):
     """Test audio features with a single track"""
     try:
-        client = SpotifyClient(access_token)
+        client = AsyncSpotifyClient(access_token)
         
         # Get just one top track
-        top_tracks = client.get_top_tracks("short_term", 1)
+        top_tracks = await client.get_top_tracks("short_term", 1)
         
         if not top_tracks:
             return {"error": "No top tracks found"}
@@ -257,7 +496,7 @@ async def test_audio_features(access_token: str):
         print(f"Testing with track ID: {track_id}")
         
         # Test audio features for single track
-        audio_features = client.get_audio_features([track_id])
+        audio_features = await client.get_audio_features([track_id])
         
         return {
             "track": {
@@ -275,22 +514,22 @@ async def test_audio_features(access_token: str):
 @app.get("/user/top-artists")
 async def get_top_artists(access_token: str, limit: int = 20, time_range: str = "medium_term"):
     """Get user's top artists"""
-    client = SpotifyClient(access_token)
-    artists = client.get_top_artists(time_range, limit)
+    client = AsyncSpotifyClient(access_token)
+    artists = await client.get_top_artists(time_range, limit)
     return {"artists": artists}
 
 @app.get("/user/top-tracks")
 async def get_top_tracks(access_token: str, limit: int = 20, time_range: str = "medium_term"):
     """Get user's top tracks"""
-    client = SpotifyClient(access_token)
-    tracks = client.get_top_tracks(time_range, limit)
+    client = AsyncSpotifyClient(access_token)
+    tracks = await client.get_top_tracks(time_range, limit)
     return {"tracks": tracks}
 
 @app.get("/user/recent-tracks")
 async def get_recent_tracks(access_token: str, limit: int = 50):
     """Get user's recently played tracks"""
-    client = SpotifyClient(access_token)
-    tracks = client.get_recently_played(limit)
+    client = AsyncSpotifyClient(access_token)
+    tracks = await client.get_recently_played(limit)
     return {"tracks": tracks}
 
 @app.get("/user/analysis-history")
@@ -298,8 +537,8 @@ async def get_analysis_history(access_token: str, limit: int = 10, db: Session =
     """Get user's analysis history from database"""
     try:
         # Validate token and get user
-        client = SpotifyClient(access_token)
-        user_profile = client.get_user_profile()
+        client = AsyncSpotifyClient(access_token)
+        user_profile = await client.get_user_profile()
         
         db_service = DatabaseService(db)
         analyses = db_service.get_user_analysis_history(user_profile["id"], limit)
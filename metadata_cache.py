@@ -0,0 +1,189 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+from models import SpotifyMetadata
+
+# Cache settings
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", str(24 * 3600)))
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "50000"))
+METADATA_CACHE_SQL = os.getenv("METADATA_CACHE_SQL", "false").lower() in ("1", "true", "yes")
+
+
+class TTLCache:
+    """Thread-safe in-process cache with per-entry TTL and LRU eviction"""
+
+    def __init__(self, ttl: float, max_size: int, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return a fresh cached value, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value, evicting the least recently used entries when full"""
+        with self._lock:
+            self._entries[key] = (value, self._clock() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+class MetadataCache:
+    """Spotify artist/track objects keyed by ID, shared across users
+
+    Lookups go to the in-process tier first and then, when a session factory
+    is configured, to the spotify_metadata_cache table. SQL hits are promoted
+    into memory.
+    """
+
+    def __init__(self, ttl: float = METADATA_CACHE_TTL, max_size: int = METADATA_CACHE_SIZE,
+                 session_factory: Optional[Callable] = None):
+        self.ttl = ttl
+        self.memory = TTLCache(ttl, max_size)
+        self.session_factory = session_factory
+        self.sql_hits = 0
+        self.sql_misses = 0
+
+    def get_many(self, entity_type: str, ids: Iterable[str]) -> Dict[str, Dict]:
+        """Return the cached objects for the given IDs"""
+        found = {}
+        missing = []
+        for spotify_id in dict.fromkeys(ids):
+            value = self.memory.get((entity_type, spotify_id))
+            if value is None:
+                missing.append(spotify_id)
+            else:
+                found[spotify_id] = value
+
+        if missing and self.session_factory:
+            rows = self._load_from_sql(entity_type, missing)
+            self.sql_hits += len(rows)
+            self.sql_misses += len(missing) - len(rows)
+            for spotify_id, payload in rows.items():
+                self.memory.set((entity_type, spotify_id), payload)
+                found[spotify_id] = payload
+
+        return found
+
+    def put_many(self, entity_type: str, items: Iterable[Optional[Dict]]):
+        """Cache full Spotify objects (anything without an id is ignored)"""
+        items = {item["id"]: item for item in items if item and item.get("id")}
+        if not items:
+            return
+        for spotify_id, item in items.items():
+            self.memory.set((entity_type, spotify_id), item)
+        if self.session_factory:
+            self._store_in_sql(entity_type, items)
+
+    def _load_from_sql(self, entity_type: str, ids: List[str]) -> Dict[str, Dict]:
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        db = self.session_factory()
+        try:
+            rows = (db.query(SpotifyMetadata.spotify_id, SpotifyMetadata.payload)
+                    .filter(SpotifyMetadata.entity_type == entity_type,
+                            SpotifyMetadata.spotify_id.in_(ids),
+                            SpotifyMetadata.fetched_at >= cutoff)
+                    .all())
+            return {spotify_id: payload for spotify_id, payload in rows}
+        except Exception as e:
+            print(f"Metadata cache read failed: {e}")
+            return {}
+        finally:
+            db.close()
+
+    def _store_in_sql(self, entity_type: str, items: Dict[str, Dict]):
+        """Upsert a batch of objects with one executemany (one merge per row without native upserts)"""
+        from database import upsert_statement
+
+        now = datetime.utcnow()
+        rows = [{"entity_type": entity_type, "spotify_id": spotify_id, "payload": item, "fetched_at": now}
+                for spotify_id, item in items.items()]
+        db = self.session_factory()
+        try:
+            stmt = upsert_statement(SpotifyMetadata, None, ["entity_type", "spotify_id"],
+                                    ["payload", "fetched_at"], db.get_bind())
+            if stmt is not None:
+                db.execute(stmt, rows)
+            else:
+                for row in rows:
+                    db.merge(SpotifyMetadata(**row))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Metadata cache write failed: {e}")
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self.memory.stats(),
+            "sql": {
+                "enabled": self.session_factory is not None,
+                "hits": self.sql_hits,
+                "misses": self.sql_misses
+            }
+        }
+
+
+_metadata_cache: Optional[MetadataCache] = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    """Get the process-wide metadata cache"""
+    global _metadata_cache
+    if _metadata_cache is None:
+        with _metadata_cache_lock:
+            if _metadata_cache is None:
+                session_factory = None
+                if METADATA_CACHE_SQL:
+                    from database import SessionLocal
+                    session_factory = SessionLocal
+                _metadata_cache = MetadataCache(session_factory=session_factory)
+    return _metadata_cache
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, String, Integer, DateTime, Text, JSON, Float, Boolean, ForeignKey
+from sqlalchemy import (Column, String, Integer, BigInteger, Date, DateTime, Text, JSON, Float, Boolean, ForeignKey,
+                        LargeBinary, Index)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -17,6 +18,7 @@ class User(Base):
     premium_status = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     last_login_at = Column(DateTime, default=datetime.utcnow)
+    timezone = Column(String)  # IANA name for hour/weekday stats; UTC when unset
     
     # Relationships
     analyses = relationship("UserAnalysis", back_populates="user", cascade="all, delete-orphan")
@@ -41,6 +43,7 @@ class UserAnalysis(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("users.spotify_user_id"), index=True)
     analysis_date = Column(DateTime, default=datetime.utcnow)
+    days_back = Column(Integer)  # listening history window the analysis covers
     
     # Scores
     uniqueness_score = Column(Float)
@@ -75,13 +78,18 @@ class UserAnalysis(Base):
     user = relationship("User", back_populates="analyses")
     top_artists = relationship("UserTopArtist", back_populates="analysis", cascade="all, delete-orphan")
     top_tracks = relationship("UserTopTrack", back_populates="analysis", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Latest analysis and history of a user, newest first
+        Index("ix_user_analyses_user_date", user_id, analysis_date.desc()),
+    )
 
 class UserTopArtist(Base):
     __tablename__ = "user_top_artists"
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("users.spotify_user_id"), index=True)
-    analysis_id = Column(Integer, ForeignKey("user_analyses.id"), index=True)
+    analysis_id = Column(Integer, ForeignKey("user_analyses.id"))  # leads ix_user_top_artists_analysis_range_rank
     
     spotify_artist_id = Column(String, index=True)
     artist_name = Column(String)
@@ -96,13 +104,18 @@ class UserTopArtist(Base):
     
     # Relationships
     analysis = relationship("UserAnalysis", back_populates="top_artists")
+    
+    __table_args__ = (
+        # An analysis's items per time range, in rank order
+        Index("ix_user_top_artists_analysis_range_rank", "analysis_id", "time_range", "rank_position"),
+    )
 
 class UserTopTrack(Base):
     __tablename__ = "user_top_tracks"
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("users.spotify_user_id"), index=True)
-    analysis_id = Column(Integer, ForeignKey("user_analyses.id"), index=True)
+    analysis_id = Column(Integer, ForeignKey("user_analyses.id"))  # leads ix_user_top_tracks_analysis_range_rank
     
     spotify_track_id = Column(String, index=True)
     track_name = Column(String)
@@ -120,6 +133,11 @@ class UserTopTrack(Base):
     
     # Relationships
     analysis = relationship("UserAnalysis", back_populates="top_tracks")
+    
+    __table_args__ = (
+        # An analysis's items per time range, in rank order
+        Index("ix_user_top_tracks_analysis_range_rank", "analysis_id", "time_range", "rank_position"),
+    )
 
 class UserGenre(Base):
     __tablename__ = "user_genres"
@@ -131,8 +149,15 @@ class UserGenre(Base):
     genre_name = Column(String, index=True)
     occurrence_count = Column(Integer)
     percentage = Column(Float)
+    rank_position = Column(Integer)  # 1 is the analysis's top genre
     
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Users whose top genre is X; one user's share of X over time
+        Index("ix_user_genres_genre_rank", "genre_name", "rank_position"),
+        Index("ix_user_genres_user_genre", "user_id", "genre_name"),
+    )
 
 # Analysis aggregation for trends
 class UserTrend(Base):
@@ -150,6 +175,68 @@ class UserTrend(Base):
     year = Column(Integer)
     month = Column(Integer)
     week = Column(Integer)
+    period = Column(String)  # week, month
+    days_back = Column(Integer)  # window of the analyses in the bucket
+    period_start = Column(Date)  # Monday of the ISO week, or first of the month
+    
+    # Running totals of the analyses in the bucket (metric_value is their mean)
+    sample_count = Column(Integer)
+    metric_sum = Column(Float)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index("ix_user_trends_bucket", "user_id", "days_back", "period", "metric_name", "period_start", unique=True),
+    )
+
+# Raw listening history, appended incrementally from recently-played
+class UserPlay(Base):
+    __tablename__ = "user_plays"
+    
+    user_id = Column(String, ForeignKey("users.spotify_user_id"), primary_key=True)
+    played_at = Column(DateTime, primary_key=True)  # UTC
+    track_id = Column(String, index=True)
+    artist_id = Column(String)
+    track = Column(JSON)  # Track object as returned by Spotify
     
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
\ No newline at end of file
+
+# Per-user high-water mark of the play log
+class UserPlaySync(Base):
+    __tablename__ = "user_play_sync"
+    
+    user_id = Column(String, ForeignKey("users.spotify_user_id"), primary_key=True)
+    last_played_at_ms = Column(BigInteger)  # Unix ms of the newest stored play
+    last_synced_at = Column(DateTime, default=datetime.utcnow)
+
+# Daily partial sums of the play log (a ListeningAggregate per user and UTC day)
+class UserPlayDaily(Base):
+    __tablename__ = "user_play_daily"
+    
+    user_id = Column(String, ForeignKey("users.spotify_user_id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    play_count = Column(Integer, default=0)
+    counters = Column(JSON)  # ListeningAggregate.to_dict()
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Daily HyperLogLog sketches of the play log's distinct tracks and artists
+class UserPlaySketch(Base):
+    __tablename__ = "user_play_sketches"
+    
+    user_id = Column(String, ForeignKey("users.spotify_user_id"), primary_key=True)
+    day = Column(Date, primary_key=True)  # UTC day
+    kind = Column(String, primary_key=True)  # tracks, artists
+    sketch = Column(LargeBinary)  # HyperLogLog.to_bytes()
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Shared Spotify metadata (artists, tracks) cached across users
+class SpotifyMetadata(Base):
+    __tablename__ = "spotify_metadata_cache"
+    
+    entity_type = Column(String, primary_key=True)  # artist, track
+    spotify_id = Column(String, primary_key=True)
+    payload = Column(JSON)
+    fetched_at = Column(DateTime, default=datetime.utcnow, index=True)
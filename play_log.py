@@ -0,0 +1,322 @@
+"""Persistent per-user play log, filled incrementally from recently-played
+
+Spotify only returns a user's last 50 plays, so listening history used to be
+capped at whatever the current window held and was refetched in full on
+every analysis. The log keeps every play it has seen, keyed by user and
+played_at, and each sync asks Spotify only for plays after the newest one
+already stored (the user's high-water mark). Rows that already exist are
+skipped by the database, so replaying a page is harmless.
+
+New plays are also folded into per-day ListeningAggregate counters as they
+are appended, so listening history for a window is built from one row per
+day instead of from every play. The counters are kept in UTC along with
+play counts per UTC quarter hour, which are shifted into the reader's
+timezone, so a timezone change applies to plays already logged. Distinct tracks and artists per day are
+kept as HyperLogLog sketches as well, which union into estimates for
+windows of any length.
+"""
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, time, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, insert_ignore_statement, upsert_statement
+from data_processor import ListeningAggregate
+from db_service import DatabaseService
+from cardinality import HyperLogLog
+from models import UserPlay, UserPlaySync, UserPlayDaily, UserPlaySketch
+from timeutils import (PLAYED_AT_MS, MS_PER_QUARTER, MS_PER_DAY, WEEKDAY_NAMES, TimeBuckets, parse_played_at_ms,
+                       played_at_ms)
+from topk import create_top_k
+
+PLAY_LOG_ENABLED = os.getenv("PLAY_LOG_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# top_played kinds and the daily counter each one ranks
+TOP_PLAYED_KINDS = {"artists": "artist_names", "tracks": "tracks"}
+
+# Kinds of daily distinct-count sketches
+UNIQUE_COUNT_KINDS = ("tracks", "artists")
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def from_ms(ms: int) -> datetime:
+    """Unix milliseconds as the naive UTC datetime stored in played_at"""
+    return _EPOCH + timedelta(milliseconds=ms)
+
+
+def to_ms(played_at: datetime) -> int:
+    """Naive UTC datetime as Unix milliseconds, the unit of Spotify's cursors"""
+    return (played_at - _EPOCH) // timedelta(milliseconds=1)
+
+
+def parse_played_at(value: str) -> datetime:
+    """Spotify's ISO-8601 played_at as a naive UTC datetime"""
+    return from_ms(parse_played_at_ms(value))
+
+
+def format_played_at(played_at: datetime) -> str:
+    """Inverse of parse_played_at, in the format Spotify returns"""
+    return played_at.strftime("%Y-%m-%dT%H:%M:%S.") + f"{played_at.microsecond // 1000:03d}Z"
+
+
+class PlayLog:
+    """Read and append one database session's view of the play log
+
+    Daily counters are stored in UTC; days themselves are UTC days. Hours
+    and weekdays are bucketed in timezone (an IANA name, UTC by default)
+    when the counters are read, from each day's quarter-hour counts.
+    """
+
+    def __init__(self, db: Session, timezone: Optional[str] = None):
+        self.db = db
+        self.buckets = TimeBuckets(timezone)
+        self._utc = TimeBuckets()
+
+    def high_water_mark(self, user_id: str) -> Optional[int]:
+        """Unix ms of the newest stored play, or None before the first sync"""
+        sync = self.db.get(UserPlaySync, user_id)
+        return sync.last_played_at_ms if sync else None
+
+    @staticmethod
+    def _play_rows(user_id: str, plays: Iterable[Dict]) -> List[Dict]:
+        rows = {}
+        for play in plays:
+            track = play.get("track") or {}
+            if not play.get("played_at") or not track.get("id"):
+                continue
+            played_at = from_ms(played_at_ms(play))
+            artists = track.get("artists") or [{}]
+            rows[played_at] = {
+                "user_id": user_id,
+                "played_at": played_at,
+                "track_id": track["id"],
+                "artist_id": artists[0].get("id"),
+                "track": track,
+                "created_at": datetime.utcnow()
+            }
+        return list(rows.values())
+
+    def append(self, user_id: str, plays: Iterable[Dict]) -> int:
+        """Store plays, update the daily counters and advance the high-water mark
+
+        Plays at or before the high-water mark are dropped up front, and any
+        that are already stored anyway are skipped by the insert and not
+        counted again. Returns the number of plays considered new.
+        """
+        high_water_mark = self.high_water_mark(user_id)
+        rows = [row for row in self._play_rows(user_id, plays)
+                if high_water_mark is None or to_ms(row["played_at"]) > high_water_mark]
+        if not rows:
+            return 0
+
+        stmt = insert_ignore_statement(UserPlay, self.db.get_bind())
+        if stmt is not None:
+            inserted = set(self.db.scalars(stmt.returning(UserPlay.played_at), rows))
+        else:
+            existing = {played_at for played_at, in self.db.query(UserPlay.played_at).filter(
+                UserPlay.user_id == user_id,
+                UserPlay.played_at.in_([row["played_at"] for row in rows])
+            )}
+            inserted = {row["played_at"] for row in rows if row["played_at"] not in existing}
+            self.db.add_all(UserPlay(**row) for row in rows if row["played_at"] in inserted)
+        self._add_to_daily(user_id, [row for row in rows if row["played_at"] in inserted])
+
+        newest = max(to_ms(row["played_at"]) for row in rows)
+        values = {"user_id": user_id, "last_played_at_ms": newest, "last_synced_at": datetime.utcnow()}
+        upsert = upsert_statement(UserPlaySync, values, ["user_id"], ["last_played_at_ms", "last_synced_at"],
+                                  self.db.get_bind())
+        if upsert is not None:
+            self.db.execute(upsert)
+        else:
+            self.db.merge(UserPlaySync(**values))
+        self.db.commit()
+        return len(rows)
+
+    def _add_to_daily(self, user_id: str, rows: List[Dict]):
+        by_day: Dict = {}
+        quarters: Dict = {}
+        for row in rows:
+            artist = (row["track"].get("artists") or [{}])[0]
+            ms = to_ms(row["played_at"])
+            hour, weekday = self._utc.hour_and_weekday(ms)
+            day = row["played_at"].date()
+            by_day.setdefault(day, ListeningAggregate()).add(
+                hour, weekday, row["track_id"], row["artist_id"], artist.get("name"))
+            quarters.setdefault(day, Counter())[str(ms % MS_PER_DAY // MS_PER_QUARTER)] += 1
+        if not by_day:
+            return
+
+        def merge_counters(key: Dict, counters: Optional[Dict]) -> Dict:
+            counters = counters or {}
+            merged = ListeningAggregate.from_dict(counters).merge(by_day[key["day"]])
+            day_quarters = Counter(counters.get("quarters", {})) + quarters[key["day"]]
+            return {"play_count": merged.total, "counters": {**merged.to_dict(), "quarters": dict(day_quarters)}}
+
+        self._merge_into_rows(UserPlayDaily, [{"user_id": user_id, "day": day} for day in sorted(by_day)],
+                              {"play_count": 0, "counters": {}}, "counters", merge_counters)
+        self._add_to_sketches(user_id, by_day)
+
+    def _merge_into_rows(self, model, keys: List[Dict], empty: Dict, column: str,
+                         merge: Callable[[Dict, Any], Dict]):
+        """Merge new values into the rows with the given primary keys, creating them if missing
+
+        merge(key, stored column value) returns the row's new values. With a
+        native insert-ignore, missing rows are first inserted empty and then
+        every row is read with FOR UPDATE in key order, so concurrent appends
+        for one user wait for each other instead of overwriting each other's
+        counts or colliding on the primary key. Other dialects fall back to a
+        read-modify-write through the ORM.
+        """
+        stmt = insert_ignore_statement(model, self.db.get_bind())
+        if stmt is None:
+            for key in keys:
+                row = self.db.get(model, tuple(key.values()))
+                if row is None:
+                    row = model(**key, **empty)
+                    self.db.add(row)
+                for name, value in merge(key, getattr(row, column)).items():
+                    setattr(row, name, value)
+            return
+
+        self.db.execute(stmt, [{**key, **empty} for key in keys])
+        key_columns = [getattr(model, name) for name in keys[0]]
+        locked = self.db.execute(
+            select(*key_columns, getattr(model, column))
+            .where(*(key_column.in_({key[key_column.key] for key in keys}) for key_column in key_columns))
+            .order_by(*key_columns)
+            .with_for_update())
+        stored = {tuple(row[:-1]): row[-1] for row in locked}
+        self.db.execute(update(model), [{**key, **merge(key, stored[tuple(key.values())])} for key in keys])
+
+    def _localize(self, day, counters: Dict) -> ListeningAggregate:
+        """A day's counters with hours and weekdays bucketed in the log's timezone
+
+        Rows written before quarter-hour counts were kept are used as stored.
+        """
+        aggregate = ListeningAggregate.from_dict(counters)
+        quarters = counters.get("quarters")
+        if self.buckets.zone is None or quarters is None:
+            return aggregate
+        aggregate.hours = Counter()
+        aggregate.days = Counter()
+        day_ms = to_ms(datetime.combine(day, time()))
+        for quarter, count in quarters.items():
+            hour, weekday = self.buckets.hour_and_weekday(day_ms + int(quarter) * MS_PER_QUARTER)
+            aggregate.hours[hour] += count
+            aggregate.days[WEEKDAY_NAMES[weekday]] += count
+        return aggregate
+
+    def _add_to_sketches(self, user_id: str, by_day: Dict):
+        """Add each day's distinct tracks and artists to its HyperLogLog sketches"""
+        ids = {(day, kind): [item for item in counts if item is not None]
+               for day, aggregate in by_day.items()
+               for kind, counts in (("tracks", aggregate.tracks), ("artists", aggregate.artists))}
+
+        def merge_sketch(key: Dict, sketch: Optional[bytes]) -> Dict:
+            stored = HyperLogLog.from_bytes(sketch) if sketch else HyperLogLog()
+            return {"sketch": stored.update(ids[key["day"], key["kind"]]).to_bytes()}
+
+        self._merge_into_rows(UserPlaySketch, [{"user_id": user_id, "day": day, "kind": kind}
+                                               for day, kind in sorted(ids)],
+                              {"sketch": HyperLogLog().to_bytes()}, "sketch", merge_sketch)
+
+    async def sync(self, client, user_id: str, days_back: int = 30) -> int:
+        """Fetch plays newer than the high-water mark and append them
+
+        A user without a high-water mark starts days_back ago. Each page is
+        committed as it arrives, so an interrupted sync resumes where it stopped.
+        Reads and appends run in a worker thread, one at a time, so the
+        session is never used from two threads at once.
+        """
+        added = 0
+        after = await asyncio.to_thread(self.high_water_mark, user_id)
+        async for page in client.iter_recent_track_pages(days_back, after=after):
+            added += await asyncio.to_thread(self.append, user_id, page)
+        return added
+
+    def recent_plays(self, user_id: str, days_back: int = 30) -> List[Dict]:
+        """Stored plays of the last days_back days, newest first, shaped like recently-played items"""
+        cutoff = datetime.utcnow() - timedelta(days=days_back)
+        rows = (self.db.query(UserPlay.played_at, UserPlay.track)
+                .filter(UserPlay.user_id == user_id, UserPlay.played_at >= cutoff)
+                .order_by(UserPlay.played_at.desc())
+                .all())
+        return [{"played_at": format_played_at(played_at), PLAYED_AT_MS: to_ms(played_at), "track": track}
+                for played_at, track in rows]
+
+    def listening_aggregate(self, user_id: str, days_back: int = 30) -> ListeningAggregate:
+        """Counters for the last days_back days, merged from the daily partial sums
+
+        The window is aligned to whole UTC days, so it covers today and the
+        days_back days before it.
+        """
+        first_day = (datetime.utcnow() - timedelta(days=days_back)).date()
+        aggregate = ListeningAggregate()
+        for day, counters in self.db.query(UserPlayDaily.day, UserPlayDaily.counters).filter(
+                UserPlayDaily.user_id == user_id, UserPlayDaily.day >= first_day):
+            aggregate.merge(self._localize(day, counters))
+        return aggregate
+
+    def top_played(self, user_id: str, days_back: int = 30, kind: str = "artists", k: int = 10,
+                   mode: Optional[str] = None) -> List[Tuple[str, int]]:
+        """Most played artists (by name) or tracks (by ID) of the window, merged from the daily counters
+
+        Each day's counts are folded into one top-K accumulator (see topk.py),
+        so an approximate query holds a fixed-size sketch instead of a
+        counter of every item played in the window.
+        """
+        if kind not in TOP_PLAYED_KINDS:
+            raise ValueError(f"Unknown kind: {kind}")
+        first_day = (datetime.utcnow() - timedelta(days=days_back)).date()
+        accumulator = create_top_k(mode, k)
+        for counters, in self.db.query(UserPlayDaily.counters).filter(UserPlayDaily.user_id == user_id,
+                                                                      UserPlayDaily.day >= first_day):
+            accumulator.update(counters.get(TOP_PLAYED_KINDS[kind], {}))
+        return accumulator.top(k)
+
+    def unique_counts(self, user_id: str, days_back: int = 365) -> Dict[str, int]:
+        """Estimated distinct tracks and artists played in the window
+
+        Unions the daily HyperLogLog sketches (one small row per day and
+        kind) instead of reading plays, within the error bound documented
+        in cardinality.py. Days are whole UTC days, as in listening_aggregate.
+        """
+        first_day = (datetime.utcnow() - timedelta(days=days_back)).date()
+        sketches = {kind: [] for kind in UNIQUE_COUNT_KINDS}
+        for kind, sketch in self.db.query(UserPlaySketch.kind, UserPlaySketch.sketch).filter(
+                UserPlaySketch.user_id == user_id, UserPlaySketch.day >= first_day):
+            sketches[kind].append(HyperLogLog.from_bytes(sketch))
+        return {kind: HyperLogLog.union(sketches[kind]).estimate() for kind in UNIQUE_COUNT_KINDS}
+
+
+async def listening_summary(client, user_id: str, days_back: int = 30, timezone: Optional[str] = None,
+                            user_profile: Optional[Dict] = None,
+                            session_factory: Callable[[], Session] = SessionLocal
+                            ) -> Union[ListeningAggregate, List[Dict]]:
+    """Sync the play log and return the window's counters, for process_listening_history
+
+    The log gets a session of its own from session_factory, and every
+    database call runs in a worker thread, so the event loop only waits on
+    Spotify. A user_profile, when given, is stored first so a new user's
+    plays have a user row to belong to. If the database fails the plays are
+    fetched from Spotify directly, as before the log existed.
+    """
+    db = session_factory()
+    log = PlayLog(db, timezone)
+    try:
+        if user_profile is not None:
+            await asyncio.to_thread(DatabaseService(db).get_or_create_user, user_profile)
+        await log.sync(client, user_id, days_back)
+        return await asyncio.to_thread(log.listening_aggregate, user_id, days_back)
+    except SQLAlchemyError as e:
+        print(f"Play log unavailable for {user_id}, fetching recent tracks directly: {e}")
+        await asyncio.to_thread(db.rollback)
+        return await client.get_all_recent_tracks(days_back)
+    finally:
+        await asyncio.to_thread(db.close)
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# Priority lanes for outbound Spotify calls
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# Scheduler settings (shared by every client using the same Spotify app)
+RATE_LIMIT_PER_SECOND = float(os.getenv("SPOTIFY_RATE_LIMIT_PER_SECOND", "20"))
+RATE_LIMIT_BURST = int(os.getenv("SPOTIFY_RATE_LIMIT_BURST", "40"))
+MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", "3"))
+RETRY_JITTER = float(os.getenv("SPOTIFY_RETRY_JITTER", "0.5"))
+# Fraction of the bucket that background work may not dip into
+BACKGROUND_RESERVE = float(os.getenv("SPOTIFY_BACKGROUND_RESERVE", "0.25"))
+
+# How long a background caller waits before re-checking for interactive traffic
+_YIELD_DELAY = 0.05
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at a fixed rate"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at: Optional[float] = None
+
+    def _refill(self, now: float):
+        if self.updated_at is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, now: float, min_level: float = 0) -> float:
+        """Take a token if more than min_level remain
+
+        Returns 0 when a token was taken, otherwise the seconds until one
+        would be available.
+        """
+        self._refill(now)
+        if self.tokens - 1 >= min_level:
+            self.tokens -= 1
+            return 0.0
+        return (min_level + 1 - self.tokens) / self.rate
+
+
+class RequestScheduler:
+    """App-wide gate for outbound Spotify calls
+
+    Every request takes a token from a shared bucket before it is sent. A 429
+    sets a global backoff from Retry-After so every other in-flight request
+    waits too, instead of hammering the API. Interactive requests always go
+    ahead of background ones.
+    """
+
+    def __init__(self, rate: float = RATE_LIMIT_PER_SECOND, burst: int = RATE_LIMIT_BURST,
+                 max_retries: int = MAX_RETRIES, jitter: float = RETRY_JITTER,
+                 background_reserve: float = BACKGROUND_RESERVE,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep,
+                 async_sleep: Callable = asyncio.sleep):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.jitter = jitter
+        self.background_reserve = burst * background_reserve
+        self.backoff_until = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._async_sleep = async_sleep
+        self._lock = threading.Lock()
+        self._waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._stats = {"granted": 0, "rate_limited": 0, "retries": 0}
+
+    def _reserve(self, priority: str) -> float:
+        """Try to admit one request; returns 0 when admitted, else seconds to wait"""
+        with self._lock:
+            now = self._clock()
+            if now < self.backoff_until:
+                return self.backoff_until - now + random.uniform(0, self.jitter)
+            if priority == BACKGROUND and self._waiting[INTERACTIVE]:
+                return _YIELD_DELAY
+            min_level = self.background_reserve if priority == BACKGROUND else 0
+            delay = self.bucket.try_take(now, min_level)
+            if not delay:
+                self._stats["granted"] += 1
+            return delay
+
+    def _set_waiting(self, priority: str, delta: int):
+        with self._lock:
+            self._waiting[priority] += delta
+
+    def acquire(self, priority: str = INTERACTIVE):
+        """Block the calling thread until a request may be sent"""
+        self._set_waiting(priority, 1)
+        try:
+            while True:
+                delay = self._reserve(priority)
+                if not delay:
+                    return
+                self._sleep(delay)
+        finally:
+            self._set_waiting(priority, -1)
+
+    async def acquire_async(self, priority: str = INTERACTIVE):
+        """Wait without blocking the event loop until a request may be sent"""
+        self._set_waiting(priority, 1)
+        try:
+            while True:
+                delay = self._reserve(priority)
+                if not delay:
+                    return
+                await self._async_sleep(delay)
+        finally:
+            self._set_waiting(priority, -1)
+
+    def should_retry(self, attempt: int, retry_after: float) -> bool:
+        """Record a 429 and decide whether the request may be retried
+
+        The Retry-After delay becomes a global backoff that the next
+        acquire() waits out. attempt counts retries already made.
+        """
+        with self._lock:
+            self._stats["rate_limited"] += 1
+            self.backoff_until = max(self.backoff_until, self._clock() + retry_after)
+            if attempt >= self.max_retries:
+                return False
+            self._stats["retries"] += 1
+            return True
+
+    def stats(self) -> Dict:
+        """Current counters and backoff state"""
+        with self._lock:
+            return {
+                **self._stats,
+                "tokens": round(self.bucket.tokens, 2),
+                "backoff_remaining": max(self.backoff_until - self._clock(), 0.0),
+                "waiting": dict(self._waiting)
+            }
+
+
+_schedulers: Dict[str, RequestScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(client_id: Optional[str] = None) -> RequestScheduler:
+    """Get the shared scheduler for a Spotify app client id"""
+    client_id = client_id or os.getenv("SPOTIFY_CLIENT_ID", "default")
+    with _schedulers_lock:
+        if client_id not in _schedulers:
+            _schedulers[client_id] = RequestScheduler()
+        return _schedulers[client_id]
+
+
+def parse_retry_after(headers) -> float:
+    """Read Retry-After seconds from response headers, defaulting to 1"""
+    try:
+        return float(headers.get("Retry-After", 1))
+    except (TypeError, ValueError):
+        return 1.0
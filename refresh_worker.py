@@ -0,0 +1,193 @@
+"""Background worker that precomputes analyses for recently active users
+
+Runs inside the API process when ANALYSIS_REFRESH_WORKER is enabled, or on
+its own:
+
+    python refresh_worker.py          # loop forever
+    python refresh_worker.py --once   # one pass over active users
+"""
+import argparse
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from async_spotify_client import AsyncSpotifyClient, close_http_pool
+from analysis_pipeline import (fetch_analysis_inputs, build_analysis, split_genre_counts, remember_metadata,
+                               stream_listening_aggregate, STREAM_RECENT_TRACKS)
+from data_processor import create_processor
+from database import SessionLocal
+from db_service import DatabaseService
+from models import User, UserToken
+from play_log import PLAY_LOG_ENABLED, listening_summary
+from rate_limiter import BACKGROUND
+from single_flight import get_analysis_flight, analysis_run_key
+from spotify_auth import refresh_access_token
+
+# Worker settings
+REFRESH_WORKER_ENABLED = os.getenv("ANALYSIS_REFRESH_WORKER", "false").lower() in ("1", "true", "yes")
+# Keep below ANALYSIS_MAX_AGE_SECONDS so dashboards find a stored analysis
+REFRESH_INTERVAL = float(os.getenv("ANALYSIS_REFRESH_INTERVAL", str(3 * 3600)))
+REFRESH_ACTIVE_DAYS = int(os.getenv("ANALYSIS_REFRESH_ACTIVE_DAYS", "7"))
+REFRESH_CONCURRENCY = int(os.getenv("ANALYSIS_REFRESH_CONCURRENCY", "2"))
+REFRESH_JITTER = float(os.getenv("ANALYSIS_REFRESH_JITTER", "60"))
+REFRESH_DAYS_BACK = int(os.getenv("ANALYSIS_REFRESH_DAYS_BACK", "30"))
+# Refresh access tokens this long before they expire
+TOKEN_REFRESH_MARGIN = 300
+
+
+class RefreshWorker:
+    """Periodically recompute and store analyses for users who logged in recently
+
+    Each pass picks users with a stored token whose last login is within
+    active_days, refreshes access tokens that are about to expire and runs
+    the analysis pipeline for each of them, at most concurrency at a time,
+    under the same single-flight key as API requests for that analysis.
+    Every user is started after a random delay of up to jitter seconds so a
+    pass does not burst against the Spotify rate limit; the delay is waited
+    out before taking a concurrency slot, so slots never sit idle. Spotify calls use the
+    background priority, so interactive requests are served first.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal,
+                 interval: float = REFRESH_INTERVAL, active_days: int = REFRESH_ACTIVE_DAYS,
+                 concurrency: int = REFRESH_CONCURRENCY, jitter: float = REFRESH_JITTER,
+                 days_back: int = REFRESH_DAYS_BACK, sleep: Callable = asyncio.sleep):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.active_days = active_days
+        self.concurrency = max(1, concurrency)
+        self.jitter = jitter
+        self.days_back = days_back
+        self._sleep = sleep
+        self._task: Optional[asyncio.Task] = None
+
+    def active_users(self) -> List[str]:
+        """IDs of users with a stored token who logged in within active_days"""
+        cutoff = datetime.utcnow() - timedelta(days=self.active_days)
+        db = self.session_factory()
+        try:
+            rows = (db.query(User.spotify_user_id)
+                    .join(UserToken, UserToken.user_id == User.spotify_user_id)
+                    .filter(User.last_login_at >= cutoff)
+                    .order_by(User.last_login_at.desc())
+                    .all())
+            return [user_id for user_id, in rows]
+        finally:
+            db.close()
+
+    async def ensure_access_token(self, db_service: DatabaseService, user_id: str) -> Optional[str]:
+        """Return a usable access token, refreshing it if it is about to expire"""
+        token = db_service.get_user_tokens(user_id)
+        if not token:
+            return None
+        if token.expires_at - timedelta(seconds=TOKEN_REFRESH_MARGIN) > datetime.utcnow():
+            return db_service.decrypt_token(token.access_token)
+        if not token.refresh_token:
+            return None
+
+        token_data = await asyncio.to_thread(refresh_access_token, db_service.decrypt_token(token.refresh_token))
+        db_service.store_user_tokens(user_id, token_data["access_token"], token_data["refresh_token"],
+                                     token_data["expires_in"])
+        return token_data["access_token"]
+
+    async def analyze(self, access_token: str, user_id: Optional[str] = None,
+                      timezone: Optional[str] = None) -> Dict:
+        """Run the fetch-and-analyze pipeline for one user, reading history from the play log if enabled"""
+        client = AsyncSpotifyClient(access_token, priority=BACKGROUND)
+        processor = create_processor(timezone)
+        recent_tracks = None
+        if PLAY_LOG_ENABLED and user_id is not None:
+            recent_tracks = partial(listening_summary, client, user_id, timezone=timezone,
+                                    session_factory=self.session_factory)
+        elif STREAM_RECENT_TRACKS:
+            recent_tracks = partial(stream_listening_aggregate, client, buckets=processor.buckets)
+        inputs, _ = await fetch_analysis_inputs(client, self.days_back, recent_tracks=recent_tracks)
+        await asyncio.to_thread(remember_metadata, inputs)
+        return build_analysis(processor, inputs)
+
+    async def refresh_user(self, user_id: str) -> bool:
+        """Recompute and store one user's analysis; False if it was skipped or failed"""
+        db = self.session_factory()
+        try:
+            db_service = DatabaseService(db)
+            access_token = await self.ensure_access_token(db_service, user_id)
+            if access_token is None:
+                print(f"Skipping analysis refresh for {user_id}: no usable token")
+                return False
+            timezone = db_service.get_user_timezone(user_id)
+
+            async def analyze_and_store() -> Dict:
+                analysis = await self.analyze(access_token, user_id, timezone=timezone)
+                db_service.store_analysis(user_id, analysis, self.days_back, split_genre_counts(analysis))
+                return analysis
+
+            # Shares the run with an interactive request computing the same analysis
+            await get_analysis_flight().do(analysis_run_key(user_id, self.days_back), analyze_and_store)
+            return True
+        except Exception as e:
+            db.rollback()
+            print(f"Analysis refresh failed for {user_id}: {e}")
+            return False
+        finally:
+            db.close()
+
+    async def run_once(self) -> Dict[str, int]:
+        """Refresh every active user once"""
+        user_ids = await asyncio.to_thread(self.active_users)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(user_id: str) -> bool:
+            if self.jitter > 0:
+                await self._sleep(random.uniform(0, self.jitter))
+            async with semaphore:
+                return await self.refresh_user(user_id)
+
+        results = await asyncio.gather(*(bounded(user_id) for user_id in user_ids))
+        stats = {"users": len(user_ids), "refreshed": sum(results), "skipped_or_failed": results.count(False)}
+        print(f"Analysis refresh pass: {stats}")
+        return stats
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Analysis refresh pass failed: {e}")
+            await self._sleep(self.interval + random.uniform(0, self.jitter))
+
+    def start(self):
+        """Run the worker as a task on the current event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def _run(once: bool):
+    worker = RefreshWorker()
+    try:
+        if once:
+            await worker.run_once()
+        else:
+            await worker.run_forever()
+    finally:
+        await close_http_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute analyses for recently active users")
+    parser.add_argument("--once", action="store_true", help="Run a single pass and exit")
+    args = parser.parse_args()
+    asyncio.run(_run(args.once))
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# "local" deduplicates within this process only, "postgres" also serialises
+# identical work across workers with an advisory lock
+ANALYSIS_LOCK_BACKEND = os.getenv("ANALYSIS_LOCK_BACKEND", "local").lower()
+ADVISORY_LOCK_TIMEOUT = float(os.getenv("ANALYSIS_LOCK_TIMEOUT", "60"))
+ADVISORY_LOCK_POLL = 0.1
+
+
+def advisory_lock_id(key: Hashable) -> int:
+    """Stable signed 64-bit lock ID for a key"""
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class AdvisoryLockBackend:
+    """Hold a PostgreSQL session advisory lock while a key is being computed
+
+    The lock is polled with pg_try_advisory_lock so waiting never ties up a
+    worker thread. Each holder uses its own connection because advisory locks
+    belong to the session that took them.
+    """
+
+    def __init__(self, engine, timeout: float = ADVISORY_LOCK_TIMEOUT,
+                 poll_interval: float = ADVISORY_LOCK_POLL):
+        self.engine = engine
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def _try_lock(conn, lock_id: int) -> bool:
+        from sqlalchemy import text
+        return bool(conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": lock_id}).scalar())
+
+    @staticmethod
+    def _unlock(conn, lock_id: int):
+        from sqlalchemy import text
+        conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": lock_id})
+
+    @asynccontextmanager
+    async def lock(self, key: Hashable):
+        lock_id = advisory_lock_id(key)
+        conn = await asyncio.to_thread(self.engine.connect)
+        try:
+            deadline = time.monotonic() + self.timeout
+            while not await asyncio.to_thread(self._try_lock, conn, lock_id):
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Timed out waiting for advisory lock {lock_id}")
+                await asyncio.sleep(self.poll_interval)
+            try:
+                yield
+            finally:
+                await asyncio.to_thread(self._unlock, conn, lock_id)
+        finally:
+            await asyncio.to_thread(conn.close)
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one shared computation
+
+    The first caller for a key runs the work; callers that arrive while it is
+    in flight await the same result (or exception). With a lock backend the
+    leader also holds a cross-process lock for the key, so the work should
+    re-check for a result stored by another worker once it gets the lock.
+    """
+
+    def __init__(self, lock_backend: Optional[AdvisoryLockBackend] = None):
+        self.lock_backend = lock_backend
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run fn for key, or wait for the run already in flight"""
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.followers += 1
+            # Shielded so a disconnecting follower does not cancel the leader
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        self.leaders += 1
+        try:
+            result = await self._run(key, fn)
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    async def _run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if self.lock_backend is None:
+            return await fn()
+        async with self.lock_backend.lock(key):
+            return await fn()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "backend": type(self.lock_backend).__name__ if self.lock_backend else "local"
+        }
+
+
+_analysis_flight: Optional[SingleFlight] = None
+_analysis_flight_lock = threading.Lock()
+
+
+def get_analysis_flight() -> SingleFlight:
+    """Get the process-wide single-flight group for analysis computations"""
+    global _analysis_flight
+    if _analysis_flight is None:
+        with _analysis_flight_lock:
+            if _analysis_flight is None:
+                lock_backend = None
+                if ANALYSIS_LOCK_BACKEND == "postgres":
+                    from database import engine
+                    if engine.dialect.name == "postgresql":
+                        lock_backend = AdvisoryLockBackend(engine)
+                    else:
+                        print(f"Advisory locks need PostgreSQL, not {engine.dialect.name}; "
+                              "deduplicating within this process only")
+                _analysis_flight = SingleFlight(lock_backend)
+    return _analysis_flight
+
+
+def analysis_run_key(user_id: str, days_back: int) -> Tuple:
+    """Single-flight key for computing and storing a fresh analysis
+
+    Shared by API requests and the refresh worker, so a precompute that
+    overlaps an interactive request for the same user runs the pipeline once.
+    """
+    return ("analysis_run", user_id, days_back)
@@ -0,0 +1,48 @@
+import base64
+import os
+from typing import Dict
+
+from dotenv import load_dotenv
+
+from http_session import get_session, HTTP_TIMEOUT
+
+load_dotenv()
+
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+
+class TokenRefreshError(Exception):
+    """Spotify did not accept a refresh token"""
+
+
+def _token_headers() -> Dict[str, str]:
+    client_id = os.getenv("SPOTIFY_CLIENT_ID")
+    client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
+    auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    return {
+        "Authorization": f"Basic {auth_header}",
+        "Content-Type": "application/x-www-form-urlencoded"
+    }
+
+
+def refresh_access_token(refresh_token: str) -> Dict:
+    """Exchange a refresh token for a new access token
+
+    Returns access_token, expires_in and refresh_token. Spotify only sometimes
+    rotates the refresh token, so the old one is returned when it does not.
+    """
+    data = {
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token
+    }
+    response = get_session().post(TOKEN_URL, headers=_token_headers(), data=data, timeout=HTTP_TIMEOUT)
+
+    if response.status_code != 200:
+        raise TokenRefreshError(f"Token refresh failed with status {response.status_code}")
+
+    token_data = response.json()
+    return {
+        "access_token": token_data["access_token"],
+        "expires_in": token_data.get("expires_in", 3600),
+        "refresh_token": token_data.get("refresh_token", refresh_token)
+    }
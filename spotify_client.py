@@ -1,31 +1,131 @@
-import requests
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
 import time
+from http_session import get_session, HTTP_TIMEOUT
+from rate_limiter import RequestScheduler, get_scheduler, parse_retry_after, INTERACTIVE
+from metadata_cache import MetadataCache, get_metadata_cache
+from timeutils import normalize_plays, played_at_ms
+
+# Default safety cap on how many plays one history walk may return
+MAX_RECENT_TRACKS = 10000
+
+# Spotify API accepts max 50 artist IDs at once
+ARTIST_CHUNK_SIZE = 50
+# Chunk requests in flight at once, shared by every client in the process
+DETAILS_CONCURRENCY = int(os.getenv("SPOTIFY_DETAILS_CONCURRENCY", "4"))
+_details_slots = threading.BoundedSemaphore(DETAILS_CONCURRENCY)
+
+def chunk_unique_ids(ids: List[str], chunk_size: int = ARTIST_CHUNK_SIZE) -> List[List[str]]:
+    """Drop duplicate and empty IDs, keeping first-seen order, then chunk"""
+    unique_ids = list(dict.fromkeys(i for i in ids if i))
+    return [unique_ids[i:i + chunk_size] for i in range(0, len(unique_ids), chunk_size)]
+
+def align_to_input(ids: List[str], items: List[Optional[Dict]]) -> List[Optional[Dict]]:
+    """Order fetched objects like the requested IDs, with None for unknown IDs"""
+    by_id = {item["id"]: item for item in items if item}
+    return [by_id.get(i) for i in ids]
+
+class RecentTracksPager:
+    """Cursor bookkeeping for walking the recently-played endpoint
+    
+    Shared by the sync and async clients. Prefers Spotify's own cursors and
+    only falls back to played_at when the response has none. Plays already
+    seen at a cursor boundary are dropped, and the returned plays carry their
+    played_at as epoch ms (timeutils.PLAYED_AT_MS) so nothing downstream
+    parses it again.
+    """
+    
+    def __init__(self, days_back: int = 30, after: Optional[int] = None,
+                 max_items: int = MAX_RECENT_TRACKS, deadline: Optional[float] = None):
+        if after is None:
+            after = int((datetime.now() - timedelta(days=days_back)).timestamp() * 1000)
+        self.after = after
+        self.max_items = max_items
+        self.deadline_at = time.monotonic() + deadline if deadline is not None else None
+        self.count = 0
+        self.done = False
+        self._seen = set()
+    
+    def params(self) -> Dict:
+        """Query parameters for the next page"""
+        return {"limit": 50, "after": self.after}
+    
+    def should_fetch(self) -> bool:
+        """Whether another page may be requested within the budgets"""
+        if self.done or self.count >= self.max_items:
+            return False
+        return self.deadline_at is None or time.monotonic() < self.deadline_at
+    
+    def consume(self, data: Dict) -> List[Dict]:
+        """Record a response and return its new plays"""
+        items = data.get("items", [])
+        page = []
+        # Repeats only happen at page boundaries, so only the previous page's
+        # keys are kept and memory stays bounded on long walks
+        seen = set()
+        for item in items:
+            key = (item.get("played_at"), (item.get("track") or {}).get("id"))
+            if key not in self._seen and key not in seen:
+                seen.add(key)
+                page.append(item)
+        self._seen = seen
+        page = normalize_plays(page[:self.max_items - self.count])
+        self.count += len(page)
+        
+        next_after = self._next_cursor(data, items)
+        if not page or next_after is None or next_after <= self.after or data.get("next", "") is None:
+            self.done = True
+        else:
+            self.after = next_after
+        return page
+    
+    @staticmethod
+    def _next_cursor(data: Dict, items: List[Dict]) -> Optional[int]:
+        cursor = (data.get("cursors") or {}).get("after")
+        if cursor:
+            return int(cursor)
+        if data.get("next"):
+            after = parse_qs(urlparse(data["next"]).query).get("after")
+            if after:
+                return int(after[0])
+        if items:
+            return max(played_at_ms(item) for item in items)
+        return None
 
 class SpotifyClient:
     """Handle all Spotify API interactions"""
     
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, priority: str = INTERACTIVE,
+                 scheduler: Optional[RequestScheduler] = None,
+                 metadata_cache: Optional[MetadataCache] = None):
         self.access_token = access_token
         self.base_url = "https://api.spotify.com/v1"
         self.headers = {"Authorization": f"Bearer {access_token}"}
+        self.priority = priority
+        self.scheduler = scheduler or get_scheduler()
+        self.metadata_cache = metadata_cache or get_metadata_cache()
     
     def _make_request(self, endpoint: str, params: Dict = None) -> Dict:
-        """Make a request to Spotify API with error handling"""
+        """Make a request to Spotify API with error handling
+        
+        Requests wait for the shared scheduler before being sent. A 429 puts
+        the scheduler into backoff and is retried a bounded number of times.
+        """
         url = f"{self.base_url}/{endpoint}"
+        attempt = 0
         
-        try:
-            response = requests.get(url, headers=self.headers, params=params)
+        while True:
+            self.scheduler.acquire(self.priority)
+            response = get_session().get(url, headers=self.headers, params=params, timeout=HTTP_TIMEOUT)
+            if response.status_code == 429 and self.scheduler.should_retry(attempt, parse_retry_after(response.headers)):
+                attempt += 1
+                continue
             response.raise_for_status()
             return response.json()
-        except requests.exceptions.HTTPError as e:
-            if response.status_code == 429:
-                # Rate limited - wait and retry
-                retry_after = int(response.headers.get('Retry-After', 1))
-                time.sleep(retry_after)
-                return self._make_request(endpoint, params)
-            raise e
     
     def get_user_profile(self) -> Dict:
         """Get current user's profile"""
@@ -62,27 +162,31 @@ class SpotifyClient:
         data = self._make_request("me/player/recently-played", params)
         return data.get("items", [])
     
-    def get_all_recent_tracks(self, days_back: int = 30) -> List[Dict]:
-        """Get all recent tracks for the specified number of days"""
-        all_tracks = []
-        after = int((datetime.now() - timedelta(days=days_back)).timestamp() * 1000)
+    def iter_recent_track_pages(self, days_back: int = 30, after: Optional[int] = None,
+                                max_items: int = MAX_RECENT_TRACKS,
+                                deadline: Optional[float] = None) -> Iterator[List[Dict]]:
+        """Yield pages of recently played tracks as they arrive
         
-        while True:
-            tracks = self.get_recently_played(limit=50, after=after)
-            
-            if not tracks:
-                break
-                
-            all_tracks.extend(tracks)
-            
-            # Update after timestamp to the last track's timestamp
-            last_track_time = tracks[-1]["played_at"]
-            after = int(datetime.fromisoformat(last_track_time.replace('Z', '+00:00')).timestamp() * 1000)
-            
-            # Avoid infinite loops
-            if len(all_tracks) > 10000:
-                break
+        Args:
+            days_back: How far back to start when no cursor is given
+            after: Unix timestamp in ms to start after (overrides days_back)
+            max_items: Stop after this many plays
+            deadline: Wall-clock budget in seconds for the whole walk
+        """
+        pager = RecentTracksPager(days_back, after, max_items, deadline)
         
+        while pager.should_fetch():
+            data = self._make_request("me/player/recently-played", pager.params())
+            page = pager.consume(data)
+            if page:
+                yield page
+    
+    def get_all_recent_tracks(self, days_back: int = 30, max_items: int = MAX_RECENT_TRACKS,
+                              deadline: Optional[float] = None) -> List[Dict]:
+        """Get all recent tracks for the specified number of days"""
+        all_tracks = []
+        for page in self.iter_recent_track_pages(days_back, max_items=max_items, deadline=deadline):
+            all_tracks.extend(page)
         return all_tracks
     
     def get_audio_features(self, track_ids: List[str]) -> List[Dict]:
@@ -99,24 +203,33 @@ class SpotifyClient:
         print("Warning: Audio features endpoint has been deprecated by Spotify")
         return {}
     
-    def get_artist_details(self, artist_ids: List[str]) -> List[Dict]:
-        """Get details for multiple artists"""
+    def get_artist_details(self, artist_ids: List[str]) -> List[Optional[Dict]]:
+        """Get details for multiple artists
+        
+        Artists in the shared metadata cache are not requested again. The
+        remaining chunks are fetched concurrently. The result lines up with
+        artist_ids, with None for IDs Spotify does not know.
+        """
         if not artist_ids:
             return []
         
-        # Spotify API accepts max 50 artist IDs at once
-        chunk_size = 50
-        all_artists = []
+        cached = self.metadata_cache.get_many("artist", artist_ids)
+        chunks = chunk_unique_ids([i for i in artist_ids if i not in cached])
+        
+        def fetch(chunk: List[str]) -> List[Dict]:
+            with _details_slots:
+                data = self._make_request("artists", {"ids": ",".join(chunk)})
+            return data.get("artists", [])
         
-        for i in range(0, len(artist_ids), chunk_size):
-            chunk = artist_ids[i:i + chunk_size]
-            ids_param = ",".join(chunk)
-            
-            data = self._make_request("artists", {"ids": ids_param})
-            artists = data.get("artists", [])
-            all_artists.extend(artists)
+        if len(chunks) <= 1:
+            results = [fetch(chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(chunks), DETAILS_CONCURRENCY)) as pool:
+                results = list(pool.map(fetch, chunks))
         
-        return all_artists
+        fetched = [artist for chunk in results for artist in chunk]
+        self.metadata_cache.put_many("artist", fetched)
+        return align_to_input(artist_ids, list(cached.values()) + fetched)
     
     def search_artist(self, query: str, limit: int = 20) -> List[Dict]:
         """Search for artists"""
@@ -27,6 +27,20 @@ def run_tests():
         "tests/test_data_processor.py", 
         "tests/test_db_service.py",
         "tests/test_main_simple.py",
+        "tests/test_analysis_pipeline.py",
+        "tests/test_async_spotify_client.py",
+        "tests/test_http_session.py",
+        "tests/test_rate_limiter.py",
+        "tests/test_metadata_cache.py",
+        "tests/test_analysis_cache.py",
+        "tests/test_single_flight.py",
+        "tests/test_refresh_worker.py",
+        "tests/test_play_log.py",
+        "tests/test_columnar_processor.py",
+        "tests/test_timeutils.py",
+        "tests/test_topk.py",
+        "tests/test_cardinality.py",
+        "tests/test_trends.py",
         "-v",
         "--cov=.",
         "--cov-report=term-missing",
@@ -16,6 +16,31 @@ os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
 
 from database import get_db, Base
 from main import app
+from analysis_cache import get_analysis_cache
+
+
+class FakeClock:
+    """Monotonic clock whose sleeps advance time instantly"""
+
+    def __init__(self, start=1000.0):
+        self.now = start
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+
+
+@pytest.fixture
+def fake_clock():
+    """Clock for rate limiter tests that never really sleeps"""
+    return FakeClock()
 
 
 @pytest.fixture(scope="session")
@@ -50,6 +75,7 @@ def client(test_db):
             test_db.close()
     
     app.dependency_overrides[get_db] = override_get_db
+    get_analysis_cache().clear()
     with TestClient(app) as test_client:
         yield test_client
     app.dependency_overrides.clear()
@@ -0,0 +1,232 @@
+import pytest
+import asyncio
+from unittest.mock import Mock, AsyncMock, patch
+from analysis_cache import AnalysisResponseCache, compute_etag, etag_matches
+import main
+
+
+class TestAnalysisResponseCache:
+
+    def test_fresh_then_stale_then_gone(self, fake_clock):
+        """Test the fresh and stale windows of a cached analysis"""
+        cache = AnalysisResponseCache(fresh_seconds=60, stale_seconds=600, clock=fake_clock)
+        entry = cache.put("user123", 30, {"score": 1})
+
+        assert cache.get("user123", 30) is entry
+        assert cache.is_fresh(entry)
+        assert cache.max_age(entry) == 60
+        assert cache.get("user123", 7) is None
+
+        fake_clock.sleep(61)
+        assert cache.get("user123", 30) is entry
+        assert not cache.is_fresh(entry)
+        assert cache.max_age(entry) == 0
+
+        fake_clock.sleep(600)
+        assert cache.get("user123", 30) is None
+
+    def test_one_refresh_per_key(self):
+        """Test that only one background refresh can be claimed at a time"""
+        cache = AnalysisResponseCache()
+
+        assert cache.start_refresh("user123", 30)
+        assert not cache.start_refresh("user123", 30)
+        assert cache.start_refresh("user123", 7)
+        cache.finish_refresh("user123", 30)
+        assert cache.start_refresh("user123", 30)
+
+    def test_user_lookup_by_token(self):
+        """Test that profiles are remembered per access token"""
+        cache = AnalysisResponseCache()
+        cache.remember_user("token_a", {"id": "user123"})
+
+        assert cache.lookup_user("token_a") == {"id": "user123"}
+        assert cache.lookup_user("token_b") is None
+
+    def test_user_lookup_expires_before_the_analysis(self, fake_clock):
+        """Test that a token is trusted for token_seconds, not as long as the cached analysis"""
+        cache = AnalysisResponseCache(fresh_seconds=300, stale_seconds=3600, clock=fake_clock, token_seconds=120)
+        cache.remember_user("token_a", {"id": "user123"})
+        cache.put("user123", 30, {"uniqueness_score": 0.5})
+
+        fake_clock.sleep(121)
+
+        assert cache.lookup_user("token_a") is None
+        assert cache.get("user123", 30) is not None
+
+    def test_etag(self):
+        """Test that the ETag depends only on content"""
+        assert compute_etag({"a": 1, "b": [1, 2]}) == compute_etag({"b": [1, 2], "a": 1})
+        assert compute_etag({"a": 1}) != compute_etag({"a": 2})
+
+        etag = compute_etag({"a": 1})
+        assert etag_matches(etag, etag)
+        assert etag_matches(f'"other", W/{etag}', etag)
+        assert etag_matches("*", etag)
+        assert not etag_matches('"other"', etag)
+        assert not etag_matches(None, etag)
+
+
+class TestAnalysisEndpointCaching:
+
+    @pytest.fixture
+    def analysis_cache(self, fake_clock):
+        cache = AnalysisResponseCache(fresh_seconds=60, stale_seconds=600, clock=fake_clock)
+        with patch('main.get_analysis_cache', return_value=cache):
+            yield cache
+
+    @pytest.fixture
+    def spotify(self):
+        with patch('main.AsyncSpotifyClient') as mock_spotify_client:
+            instance = AsyncMock()
+            instance.get_user_profile.return_value = {"id": "user123", "display_name": "Test User"}
+            mock_spotify_client.return_value = instance
+            yield instance
+
+    @patch('main._run_analysis', new_callable=AsyncMock)
+    def test_second_request_is_served_from_cache(self, mock_run, client, analysis_cache, spotify):
+        """Test that a fresh entry skips both Spotify and the analysis"""
+        mock_run.return_value = {"uniqueness_score": {"score": 42}}
+
+        first = client.get("/user/analysis?access_token=valid_token")
+        second = client.get("/user/analysis?access_token=valid_token")
+
+        assert first.status_code == 200
+        assert first.headers["X-Cache"] == "MISS"
+        assert second.headers["X-Cache"] == "HIT"
+        assert second.json() == first.json()
+        assert second.headers["ETag"] == first.headers["ETag"]
+        assert mock_run.await_count == 1
+        assert spotify.get_user_profile.await_count == 1
+
+    @patch('main._run_analysis', new_callable=AsyncMock)
+    def test_cache_is_keyed_by_days_back(self, mock_run, client, analysis_cache, spotify):
+        """Test that a different window is computed separately"""
+        mock_run.return_value = {"uniqueness_score": {"score": 42}}
+
+        client.get("/user/analysis?access_token=valid_token&days_back=30")
+        response = client.get("/user/analysis?access_token=valid_token&days_back=7")
+
+        assert response.headers["X-Cache"] == "MISS"
+        assert mock_run.await_count == 2
+
+    @patch('main._run_analysis', new_callable=AsyncMock)
+    def test_if_none_match_returns_304(self, mock_run, client, analysis_cache, spotify):
+        """Test conditional revalidation with the ETag"""
+        mock_run.return_value = {"uniqueness_score": {"score": 42}}
+        etag = client.get("/user/analysis?access_token=valid_token").headers["ETag"]
+
+        response = client.get("/user/analysis?access_token=valid_token", headers={"If-None-Match": etag})
+
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+    @patch('main._revalidate_analysis', new_callable=AsyncMock)
+    @patch('main._run_analysis', new_callable=AsyncMock)
+    def test_stale_entry_served_while_revalidating(self, mock_run, mock_revalidate, client,
+                                                   analysis_cache, spotify, fake_clock):
+        """Test stale-while-revalidate schedules exactly one background refresh"""
+        mock_run.return_value = {"uniqueness_score": {"score": 42}}
+        client.get("/user/analysis?access_token=valid_token")
+        fake_clock.sleep(120)
+
+        first = client.get("/user/analysis?access_token=valid_token")
+        second = client.get("/user/analysis?access_token=valid_token")
+
+        assert first.status_code == 200
+        assert first.headers["X-Cache"] == "STALE"
+        assert first.json() == {"uniqueness_score": {"score": 42}}
+        assert second.headers["X-Cache"] == "STALE"
+        assert mock_run.await_count == 1
+        mock_revalidate.assert_called_once()
+
+    @patch('main._run_analysis', new_callable=AsyncMock)
+    def test_refresh_bypasses_cache(self, mock_run, client, analysis_cache, spotify):
+        """Test that refresh=true recomputes a fresh entry"""
+        mock_run.side_effect = [{"version": 1}, {"version": 2}]
+        client.get("/user/analysis?access_token=valid_token")
+
+        response = client.get("/user/analysis?access_token=valid_token&refresh=true")
+
+        assert response.json() == {"version": 2}
+        assert analysis_cache.get("user123", 30).analysis == {"version": 2}
+
+    @patch('main.DatabaseService')
+    @patch('main.SessionLocal')
+    @patch('main._run_analysis', new_callable=AsyncMock)
+    def test_revalidate_replaces_entry(self, mock_run, mock_session_local, mock_db_service,
+                                       analysis_cache, spotify):
+        """Test that a background refresh stores the new analysis and releases the key"""
+        mock_run.return_value = {"version": 2}
+        mock_db_service.return_value.get_stored_analysis_response.return_value = None
+        analysis_cache.put("user123", 30, {"version": 1})
+        analysis_cache.start_refresh("user123", 30)
+
+        asyncio.run(main._revalidate_analysis("valid_token", {"id": "user123"}, 30))
+
+        assert analysis_cache.get("user123", 30).analysis == {"version": 2}
+        assert analysis_cache.start_refresh("user123", 30)
+        mock_session_local.return_value.close.assert_called_once()
+
+    @patch('main.DatabaseService')
+    @patch('main.SessionLocal')
+    @patch('main._run_analysis', new_callable=AsyncMock)
+    def test_failed_revalidate_keeps_stale_entry(self, mock_run, mock_session_local, mock_db_service,
+                                                 analysis_cache, spotify):
+        """Test that a failing refresh leaves the cached entry in place"""
+        mock_run.side_effect = Exception("Spotify down")
+        mock_db_service.return_value.get_stored_analysis_response.return_value = None
+        analysis_cache.put("user123", 30, {"version": 1})
+        analysis_cache.start_refresh("user123", 30)
+
+        asyncio.run(main._revalidate_analysis("valid_token", {"id": "user123"}, 30))
+
+        assert analysis_cache.get("user123", 30).analysis == {"version": 1}
+        assert analysis_cache.start_refresh("user123", 30)
+
+    @patch('main.DatabaseService')
+    @patch('main.SessionLocal')
+    @patch('main._run_analysis', new_callable=AsyncMock)
+    def test_revalidate_ignores_stored_analysis(self, mock_run, mock_session_local, mock_db_service,
+                                                client, analysis_cache, spotify, fake_clock):
+        """Test that a background refresh caches the computed shape a miss serves, not a stored row"""
+        computed = {"listening_history": {"most_played_tracks": []}, "version": 2}
+        mock_run.return_value = computed
+        mock_db_service.return_value.get_stored_analysis_response.return_value = {"version": "stored"}
+
+        miss = client.get("/user/analysis?access_token=valid_token&refresh=true")
+        fake_clock.sleep(analysis_cache.fresh_seconds + 1)
+        asyncio.run(main._revalidate_analysis("valid_token", {"id": "user123"}, 30))
+        entry = analysis_cache.get("user123", 30)
+
+        assert mock_run.await_count == 2
+        mock_db_service.return_value.get_stored_analysis_response.assert_not_called()
+        assert entry.analysis == miss.json()
+        assert entry.etag == miss.headers["ETag"]
+
+    @patch('main.DatabaseService')
+    @patch('main._run_analysis', new_callable=AsyncMock)
+    def test_stored_analysis_served_on_miss(self, mock_run, mock_db_service, client, analysis_cache, spotify):
+        """Test that a recent stored analysis avoids recomputing from Spotify"""
+        mock_db_service.return_value.get_stored_analysis_response.return_value = {"version": "stored"}
+
+        response = client.get("/user/analysis?access_token=valid_token&days_back=7&max_age=60")
+
+        assert response.status_code == 200
+        assert response.headers["X-Cache"] == "STORED"
+        assert response.json() == {"version": "stored"}
+        mock_run.assert_not_called()
+        mock_db_service.return_value.get_stored_analysis_response.assert_called_once_with("user123", 7, 60)
+
+    @patch('main.DatabaseService')
+    @patch('main._run_analysis', new_callable=AsyncMock)
+    def test_refresh_skips_stored_analysis(self, mock_run, mock_db_service, client, analysis_cache, spotify):
+        """Test that refresh=true recomputes even when a stored analysis exists"""
+        mock_run.return_value = {"version": "fresh"}
+        mock_db_service.return_value.get_stored_analysis_response.return_value = {"version": "stored"}
+
+        response = client.get("/user/analysis?access_token=valid_token&refresh=true")
+
+        assert response.json() == {"version": "fresh"}
+        mock_db_service.return_value.get_stored_analysis_response.assert_not_called()
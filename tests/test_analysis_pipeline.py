@@ -0,0 +1,199 @@
+import pytest
+import asyncio
+import threading
+import time
+from unittest.mock import Mock
+from analysis_pipeline import (fetch_analysis_inputs, build_analysis, split_genre_counts, format_server_timing,
+                               remember_metadata, stream_listening_aggregate)
+from metadata_cache import MetadataCache
+from data_processor import SpotifyDataProcessor, ListeningAggregate
+
+
+class SlowClient:
+    """Blocking client stand-in where every call takes the same time"""
+
+    def __init__(self, delay=0.1):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def _call(self, result):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        return result
+
+    def get_user_profile(self):
+        return self._call({"id": "user123", "display_name": "Test User"})
+
+    def get_top_artists(self, time_range, limit):
+        return self._call([{"id": f"artist_{time_range}", "popularity": 50, "genres": ["rock"]}])
+
+    def get_top_tracks(self, time_range, limit):
+        return self._call([{"id": f"track_{time_range}", "popularity": 50}])
+
+    def get_all_recent_tracks(self, days_back):
+        return self._call([])
+
+
+class TestAnalysisPipeline:
+
+    def test_fetch_runs_calls_concurrently(self):
+        """Test that the seven calls overlap instead of running back to back"""
+        client = SlowClient(delay=0.1)
+
+        start = time.perf_counter()
+        inputs, timings = asyncio.run(fetch_analysis_inputs(client, 30))
+        elapsed = time.perf_counter() - start
+
+        assert elapsed < 0.35
+        assert client.max_in_flight > 1
+        assert inputs["user_profile"]["id"] == "user123"
+        assert inputs["top_artists_short"][0]["id"] == "artist_short_term"
+        assert inputs["top_tracks_long"][0]["id"] == "track_long_term"
+        assert inputs["recent_tracks"] == []
+
+    def test_fetch_respects_concurrency_limit(self):
+        """Test that the semaphore bounds the number of calls in flight"""
+        client = SlowClient(delay=0.02)
+
+        asyncio.run(fetch_analysis_inputs(client, 30, max_concurrency=2))
+
+        assert client.max_in_flight <= 2
+
+    def test_fetch_reports_per_call_timings(self):
+        """Test that a timing is recorded for each call plus the total"""
+        client = SlowClient(delay=0.01)
+
+        inputs, timings = asyncio.run(fetch_analysis_inputs(client, 30))
+
+        assert set(timings) == set(inputs) | {"total"}
+        assert all(duration >= 0 for duration in timings.values())
+
+    def test_fetch_awaits_async_clients(self):
+        """Test that coroutine methods are awaited rather than run in threads"""
+        async def profile():
+            return {"id": "async_user"}
+
+        async def items(*args):
+            return []
+
+        client = Mock()
+        client.get_user_profile = profile
+        client.get_top_artists = items
+        client.get_top_tracks = items
+        client.get_all_recent_tracks = items
+
+        inputs, _ = asyncio.run(fetch_analysis_inputs(client, 7))
+
+        assert inputs["user_profile"] == {"id": "async_user"}
+
+    def test_fetch_propagates_errors(self):
+        """Test that a failing call fails the whole fetch stage"""
+        client = SlowClient(delay=0)
+        client.get_top_tracks = Mock(side_effect=Exception("boom"))
+
+        with pytest.raises(Exception, match="boom"):
+            asyncio.run(fetch_analysis_inputs(client, 30))
+
+    def test_format_server_timing(self):
+        """Test Server-Timing header formatting"""
+        header = format_server_timing({"user_profile": 12.345, "total": 20})
+
+        assert header == "user_profile;dur=12.3, total;dur=20.0"
+
+    def test_build_analysis(self, sample_listening_data):
+        """Test that the fetched inputs produce the full analysis schema"""
+        client = SlowClient(delay=0)
+        inputs, _ = asyncio.run(fetch_analysis_inputs(client, 30))
+        inputs["recent_tracks"] = sample_listening_data
+
+        analysis = build_analysis(SpotifyDataProcessor(), inputs)
+
+        assert analysis["user_profile"] == {"id": "user123", "name": "Test User", "followers": 0}
+        assert analysis["listening_history"]["total_tracks_played"] == 3
+        assert analysis["top_artists"]["medium_term"][0]["id"] == "artist_medium_term"
+        assert analysis["track_characteristics"]["track_count"] == 3
+        assert analysis["genre_diversity"]["unique_genres"] == 1
+        assert "uniqueness_score" in analysis
+        assert "insights" in analysis
+
+    def test_split_genre_counts(self, sample_listening_data):
+        """Test that the full genre counts are taken out of the response for storage"""
+        client = SlowClient(delay=0)
+        inputs, _ = asyncio.run(fetch_analysis_inputs(client, 30))
+        inputs["recent_tracks"] = sample_listening_data
+        analysis = build_analysis(SpotifyDataProcessor(), inputs)
+
+        genre_counts = split_genre_counts(analysis)
+
+        assert genre_counts == analysis["genre_diversity"]["genre_distribution"]
+        assert "genre_counts" not in analysis["genre_diversity"]
+        assert split_genre_counts(analysis) is None
+
+    def test_remember_metadata(self, sample_listening_data):
+        """Test that top items and played tracks are shared through the metadata cache"""
+        client = SlowClient(delay=0)
+        inputs, _ = asyncio.run(fetch_analysis_inputs(client, 30))
+        inputs["recent_tracks"] = sample_listening_data
+        cache = MetadataCache(ttl=60, max_size=100)
+
+        remember_metadata(inputs, cache)
+
+        assert set(cache.get_many("artist", ["artist_short_term", "artist_long_term"])) == {
+            "artist_short_term", "artist_long_term"
+        }
+        assert set(cache.get_many("track", ["track_medium_term", "track_1", "track_2"])) == {
+            "track_medium_term", "track_1", "track_2"
+        }
+
+    def test_fetch_reuses_known_profile(self):
+        """Test that a profile the caller already has is not fetched again"""
+        client = SlowClient(delay=0)
+        client.get_user_profile = Mock()
+
+        inputs, timings = asyncio.run(fetch_analysis_inputs(client, 30, user_profile={"id": "known"}))
+
+        client.get_user_profile.assert_not_called()
+        assert inputs["user_profile"] == {"id": "known"}
+        assert "user_profile" not in timings
+
+    def test_fetch_uses_recent_tracks_source(self):
+        """Test that a recent_tracks source replaces the client's history walk"""
+        client = SlowClient(delay=0)
+        client.get_all_recent_tracks = Mock()
+        plays = [{"played_at": "2024-01-01T12:00:00.000Z", "track": {"id": "track1"}}]
+
+        async def recent_tracks(days_back):
+            return plays
+
+        inputs, timings = asyncio.run(fetch_analysis_inputs(client, 7, recent_tracks=recent_tracks))
+
+        client.get_all_recent_tracks.assert_not_called()
+        assert inputs["recent_tracks"] == plays
+        assert "recent_tracks" in timings
+
+    def test_stream_listening_aggregate(self, sample_listening_data):
+        """Test that streamed pages are counted into the same stats as the collected plays"""
+        class PagingClient:
+            def __init__(self):
+                self.max_items = None
+
+            async def iter_recent_track_pages(self, days_back, max_items):
+                self.max_items = max_items
+                for play in sample_listening_data:
+                    yield [dict(play)]
+
+        client = PagingClient()
+        processor = SpotifyDataProcessor("Europe/Berlin")
+
+        aggregate = asyncio.run(stream_listening_aggregate(client, 30, buckets=processor.buckets, max_items=500))
+
+        assert isinstance(aggregate, ListeningAggregate)
+        assert client.max_items == 500
+        assert processor.process_listening_history(aggregate) == \
+            processor.process_listening_history(sample_listening_data)
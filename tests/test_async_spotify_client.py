@@ -0,0 +1,321 @@
+import pytest
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import async_spotify_client
+from async_spotify_client import AsyncSpotifyClient, PoolTransport, get_http_pool_stats
+from rate_limiter import RequestScheduler
+from metadata_cache import MetadataCache
+
+
+def make_client(handler):
+    """Create an AsyncSpotifyClient whose transport is served by handler"""
+    http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return AsyncSpotifyClient("test_access_token", http_client=http, metadata_cache=MetadataCache())
+
+
+class TestAsyncSpotifyClient:
+
+    def test_init(self):
+        """Test AsyncSpotifyClient initialization"""
+        client = make_client(lambda request: httpx.Response(200, json={}))
+
+        assert client.access_token == "test_access_token"
+        assert client.base_url == "https://api.spotify.com/v1"
+        assert client.headers == {"Authorization": "Bearer test_access_token"}
+
+    def test_make_request_success(self):
+        """Test successful API request sends auth header and params"""
+        seen = []
+
+        def handler(request):
+            seen.append(request)
+            return httpx.Response(200, json={"items": []})
+
+        client = make_client(handler)
+        result = asyncio.run(client._make_request("me/top/artists", {"limit": 10}))
+
+        assert result == {"items": []}
+        assert seen[0].url.path == "/v1/me/top/artists"
+        assert seen[0].url.params["limit"] == "10"
+        assert seen[0].headers["Authorization"] == "Bearer test_access_token"
+
+    def test_make_request_rate_limit_retry(self, fake_clock):
+        """Test that a 429 is retried after a non-blocking backoff"""
+        responses = [
+            httpx.Response(429, headers={"Retry-After": "2"}),
+            httpx.Response(200, json={"success": True}),
+        ]
+        client = make_client(lambda request: responses.pop(0))
+        client.scheduler = RequestScheduler(jitter=0, clock=fake_clock, async_sleep=fake_clock.async_sleep)
+
+        result = asyncio.run(client._make_request("me"))
+
+        assert result == {"success": True}
+        assert fake_clock.sleeps == [2]
+
+    def test_make_request_rate_limit_gives_up(self, fake_clock):
+        """Test that persistent 429s raise after the retry budget is spent"""
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(429, headers={"Retry-After": "1"})
+
+        client = make_client(handler)
+        client.scheduler = RequestScheduler(max_retries=1, jitter=0, clock=fake_clock,
+                                            async_sleep=fake_clock.async_sleep)
+
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(client._make_request("me"))
+
+        assert len(calls) == 2
+
+    def test_make_request_http_error(self):
+        """Test handling of HTTP errors (non-429)"""
+        client = make_client(lambda request: httpx.Response(401))
+
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(client._make_request("me"))
+
+    def test_get_top_tracks(self):
+        """Test get_top_tracks unwraps the items list"""
+        def handler(request):
+            assert request.url.params["time_range"] == "long_term"
+            return httpx.Response(200, json={"items": [{"id": "track1"}]})
+
+        client = make_client(handler)
+
+        assert asyncio.run(client.get_top_tracks("long_term", 10)) == [{"id": "track1"}]
+
+    def test_get_all_recent_tracks_pages_until_empty(self):
+        """Test recent tracks are paged until Spotify returns no items"""
+        pages = [
+            {"items": [{"track": {"id": "t1"}, "played_at": "2024-01-01T12:00:00Z"}]},
+            {"items": []},
+        ]
+        client = make_client(lambda request: httpx.Response(200, json=pages.pop(0)))
+
+        tracks = asyncio.run(client.get_all_recent_tracks(7))
+
+        assert [t["track"]["id"] for t in tracks] == ["t1"]
+
+    def test_iter_recent_track_pages_streams_pages(self):
+        """Test that pages are yielded one at a time using Spotify's cursors"""
+        pages = [
+            {"items": [{"track": {"id": "t1"}, "played_at": "2024-01-01T12:00:00Z"}],
+             "cursors": {"after": "1704110400000"}},
+            {"items": [{"track": {"id": "t2"}, "played_at": "2024-01-01T13:00:00Z"}],
+             "cursors": {"after": "1704114000000"}, "next": None},
+        ]
+        afters = []
+
+        def handler(request):
+            afters.append(request.url.params["after"])
+            return httpx.Response(200, json=pages.pop(0))
+
+        client = make_client(handler)
+
+        async def collect():
+            return [page async for page in client.iter_recent_track_pages(after=1)]
+
+        result = asyncio.run(collect())
+
+        assert [[t["track"]["id"] for t in page] for page in result] == [["t1"], ["t2"]]
+        assert afters == ["1", "1704110400000"]
+
+    def test_get_artist_details_aligned_with_input(self):
+        """Test concurrent chunk fetching returns results in input order"""
+        requested = []
+
+        def handler(request):
+            ids = request.url.params["ids"].split(",")
+            requested.append(ids)
+            return httpx.Response(200, json={"artists": [{"id": i} for i in ids]})
+
+        client = make_client(handler)
+        ids = [f"a{i}" for i in range(120)] + ["a0"]
+
+        result = asyncio.run(client.get_artist_details(ids))
+
+        assert len(requested) == 3
+        assert sum(len(chunk) for chunk in requested) == 120
+        assert [a["id"] for a in result] == ids
+
+    def test_artist_details_cache_is_used_off_the_loop(self):
+        """Test that the metadata cache, which may query SQL, is never called on the event loop thread"""
+        threads = []
+
+        class RecordingCache(MetadataCache):
+            def get_many(self, entity_type, ids):
+                threads.append(threading.get_ident())
+                return super().get_many(entity_type, ids)
+
+            def put_many(self, entity_type, items):
+                threads.append(threading.get_ident())
+                super().put_many(entity_type, items)
+
+        client = make_client(lambda request: httpx.Response(200, json={"artists": [{"id": "a1"}]}))
+        client.metadata_cache = RecordingCache()
+
+        async def run():
+            return await client.get_artist_details(["a1"]), threading.get_ident()
+
+        result, loop_thread = asyncio.run(run())
+
+        assert result == [{"id": "a1"}]
+        assert len(threads) == 2
+        assert loop_thread not in threads
+
+    def test_artist_details_concurrency_is_shared(self, monkeypatch):
+        """Test that the details cap applies across clients, not per call"""
+        in_flight = 0
+        max_in_flight = 0
+
+        async def handler(request):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return httpx.Response(200, json={"artists": [{"id": i} for i in request.url.params["ids"].split(",")]})
+
+        clients = [make_client(handler) for _ in range(3)]
+        ids = [f"a{i}" for i in range(200)]
+
+        async def run():
+            return await asyncio.gather(*(client.get_artist_details(ids) for client in clients))
+
+        monkeypatch.setattr(async_spotify_client, "DETAILS_CONCURRENCY", 2)
+        monkeypatch.setattr(async_spotify_client, "_details_slots", None)
+        results = asyncio.run(run())
+
+        assert all(len(result) == 200 for result in results)
+        assert max_in_flight == 2
+
+    def test_concurrent_requests_share_pool(self):
+        """Test that many requests can be in flight on one event loop"""
+        in_flight = 0
+        max_in_flight = 0
+
+        async def handler(request):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return httpx.Response(200, json={"id": "user123"})
+
+        client = make_client(handler)
+
+        async def run():
+            return await asyncio.gather(*(client.get_user_profile() for _ in range(20)))
+
+        results = asyncio.run(run())
+
+        assert len(results) == 20
+        assert max_in_flight > 1
+
+    def test_http_pool_lifecycle(self):
+        """Test the shared pool is reused and recreated after close"""
+        async def run():
+            pool = await async_spotify_client.open_http_pool()
+            assert async_spotify_client.get_http_pool() is pool
+            await async_spotify_client.close_http_pool()
+            assert pool.is_closed
+            return pool
+
+        pool = asyncio.run(run())
+
+        new_pool = async_spotify_client.get_http_pool()
+        assert new_pool is not pool
+        asyncio.run(async_spotify_client.close_http_pool())
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"id": "user123"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestPoolTransport:
+
+    @pytest.fixture
+    def server_url(self):
+        """Run a local keep-alive HTTP server for the duration of a test"""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_port}"
+        server.shutdown()
+        server.server_close()
+
+    def test_connection_reuse_counters(self, server_url):
+        """Test that sequential requests through the pool reuse one kept-alive connection"""
+        transport = PoolTransport(httpx.AsyncHTTPTransport())
+
+        async def run():
+            async with httpx.AsyncClient(transport=transport) as http:
+                for _ in range(5):
+                    assert (await http.get(f"{server_url}/v1/me")).status_code == 200
+
+        asyncio.run(run())
+        stats = transport.stats()
+
+        assert stats["requests"] == 5
+        assert stats["new_connections"] == 1
+        assert stats["reused_connections"] == 4
+        assert stats["hosts"]["127.0.0.1"]["reused_connections"] == 4
+
+    @pytest.mark.parametrize("method, statuses, expected, attempts", [
+        ("GET", [503, 502, 200], 200, 3),
+        ("GET", [503, 503, 503, 503], 503, 3),
+        ("GET", [429, 200], 429, 1),
+        ("POST", [503, 200], 503, 1),
+    ])
+    def test_retries_transient_5xx_gets(self, method, statuses, expected, attempts):
+        """Test that only GETs are retried, only on 5xx, at most retries times with backoff"""
+        responses = iter(statuses)
+        delays = []
+
+        async def sleep(seconds):
+            delays.append(seconds)
+
+        transport = PoolTransport(httpx.MockTransport(lambda request: httpx.Response(next(responses))),
+                                  retries=2, backoff=0.3, sleep=sleep)
+
+        async def run():
+            async with httpx.AsyncClient(transport=transport) as http:
+                return await http.request(method, "https://api.spotify.com/v1/me")
+
+        response = asyncio.run(run())
+
+        assert response.status_code == expected
+        assert transport.stats()["requests"] == attempts
+        assert transport.stats()["retries"] == attempts - 1
+        assert delays == [0.3, 0.6][:attempts - 1]
+
+    def test_shared_pool_stats(self):
+        """Test that the shared pool reports its counters, and zeros before it exists"""
+        asyncio.run(async_spotify_client.close_http_pool())
+        async_spotify_client._pool_transport = None
+        assert get_http_pool_stats() == {"requests": 0, "new_connections": 0, "reused_connections": 0,
+                                         "retries": 0, "hosts": {}}
+
+        pool = async_spotify_client.get_http_pool()
+        try:
+            assert isinstance(pool._transport, PoolTransport)
+            assert pool._transport.retries == async_spotify_client.HTTP_RETRIES
+            assert get_http_pool_stats()["requests"] == 0
+        finally:
+            asyncio.run(async_spotify_client.close_http_pool())
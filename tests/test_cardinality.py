@@ -0,0 +1,63 @@
+import pytest
+import math
+
+from cardinality import HyperLogLog
+
+
+class TestHyperLogLog:
+
+    def test_small_counts_are_near_exact(self):
+        """Test that linear counting is within a count or two for small sets"""
+        for count in (10, 100, 300):
+            sketch = HyperLogLog().update(f"track_{i}" for i in range(count))
+
+            assert abs(sketch.estimate() - count) <= 2
+        assert HyperLogLog().estimate() == 0
+
+    def test_duplicates_do_not_count(self):
+        """Test that adding the same items again leaves the estimate unchanged"""
+        sketch = HyperLogLog().update(f"artist_{i % 50}" for i in range(10000))
+
+        assert sketch.estimate() == 50
+
+    @pytest.mark.parametrize("count", [5000, 50000, 200000])
+    def test_error_within_documented_bound(self, count):
+        """Test large estimates against three standard errors of 1.04 / sqrt(m)"""
+        sketch = HyperLogLog().update(f"item_{i}" for i in range(count))
+
+        assert abs(sketch.estimate() - count) <= 3 * 1.04 / math.sqrt(sketch.m) * count
+
+    def test_merge_is_union(self):
+        """Test that merged sketches equal one sketch of the union"""
+        days = [HyperLogLog().update(f"track_{i}" for i in range(day * 300, day * 300 + 1000)) for day in range(7)]
+        whole = HyperLogLog().update(f"track_{i}" for i in range(6 * 300 + 1000))
+
+        merged = HyperLogLog()
+        for day in days:
+            merged.merge(day)
+
+        assert merged.registers == whole.registers
+        assert HyperLogLog.union(days).registers == whole.registers
+
+    def test_union_without_numpy(self, monkeypatch):
+        """Test the pure-Python union path"""
+        days = [HyperLogLog(8).update(f"x{i}" for i in range(day, day + 200)) for day in range(3)]
+        expected = HyperLogLog(8).update(f"x{i}" for i in range(202))
+
+        monkeypatch.setattr("cardinality.np", None)
+
+        assert HyperLogLog.union(days, precision=8).registers == expected.registers
+        assert HyperLogLog.union([], precision=8).estimate() == 0
+
+    def test_round_trip_and_precision_checks(self):
+        """Test byte storage and that mismatched precisions are rejected"""
+        sketch = HyperLogLog(10).update(f"t{i}" for i in range(500))
+
+        restored = HyperLogLog.from_bytes(sketch.to_bytes())
+
+        assert len(sketch.to_bytes()) == 1 + 1024
+        assert restored.precision == 10 and restored.registers == sketch.registers
+        with pytest.raises(ValueError):
+            restored.merge(HyperLogLog(12))
+        with pytest.raises(ValueError):
+            HyperLogLog(3)
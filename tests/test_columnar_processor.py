@@ -0,0 +1,140 @@
+import pytest
+import random
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+np = pytest.importorskip("numpy")
+
+import data_processor
+from data_processor import SpotifyDataProcessor, ListeningAggregate, create_processor
+from columnar_processor import ColumnarDataProcessor, PlayColumns
+
+
+def make_plays(count, seed=7):
+    """Random plays with repeated tracks and artists across several days"""
+    rng = random.Random(seed)
+    start = datetime(2024, 3, 1, 0, 0, 0)
+    plays = []
+    for _ in range(count):
+        artist = rng.randrange(40)
+        track = rng.randrange(300)
+        played_at = start + timedelta(seconds=rng.randrange(30 * 86400), milliseconds=rng.randrange(1000))
+        plays.append({
+            "played_at": played_at.strftime("%Y-%m-%dT%H:%M:%S.") + f"{played_at.microsecond // 1000:03d}Z",
+            "track": {"id": f"track_{track}", "name": f"Track {track}",
+                      "artists": [{"id": f"artist_{artist}", "name": f"Artist {artist % 35}"}],
+                      "popularity": rng.randrange(101), "duration_ms": rng.randrange(60000, 400000),
+                      "explicit": rng.random() < 0.3,
+                      "album": {"release_date": f"{rng.randrange(1960, 2025)}-01-01"}}
+        })
+    return plays
+
+
+TOP_TRACKS = [
+    {"id": "t1", "popularity": 80, "duration_ms": 210000, "explicit": True, "album": {"release_date": "1999-05-01"}},
+    {"id": "t2", "popularity": 20, "duration_ms": 185000, "album": {"release_date": "2021"}},
+    {"id": "t3", "popularity": 55, "duration_ms": 240500, "album": {"release_date": "1975-10-31"}}
+]
+TOP_ARTISTS = [{"id": "a1", "popularity": 90}, {"id": "a2", "popularity": 15}, {"id": "a3", "popularity": 47}]
+
+
+def assert_same(columnar, reference):
+    """Exact match, floats included, down to the result types"""
+    assert columnar.keys() == reference.keys()
+    for key, value in reference.items():
+        assert columnar[key] == value, key
+        assert type(columnar[key]) is type(value), key
+
+
+class TestColumnarDataProcessor:
+
+    @pytest.fixture
+    def processors(self):
+        return ColumnarDataProcessor(), SpotifyDataProcessor()
+
+    @pytest.mark.parametrize("count", [1, 3, 500, 5000])
+    def test_listening_history_matches(self, processors, count):
+        """Test that listening history is identical, including dict and tie order"""
+        columnar, reference = processors
+        plays = make_plays(count)
+
+        result = columnar.process_listening_history(plays)
+        expected = reference.process_listening_history(plays)
+
+        assert_same(result, expected)
+        assert list(result["listening_by_hour"]) == list(expected["listening_by_hour"])
+        assert list(result["listening_by_day"]) == list(expected["listening_by_day"])
+
+    def test_listening_history_sample(self, processors, sample_listening_data):
+        """Test the shared fixture and the empty case"""
+        columnar, reference = processors
+
+        assert columnar.process_listening_history(sample_listening_data) == \
+            reference.process_listening_history(sample_listening_data)
+        assert columnar.process_listening_history([]) == {}
+
+    def test_listening_history_accepts_aggregate(self, processors):
+        """Test that stored aggregates are still handled"""
+        columnar, reference = processors
+        aggregate = ListeningAggregate.from_plays(make_plays(50))
+
+        assert columnar.process_listening_history(aggregate) == reference.process_listening_history(aggregate)
+
+    def test_track_characteristics_match(self, processors):
+        """Test track characteristics over plays, plain tracks and sparse data"""
+        columnar, reference = processors
+        sparse = [{"id": "a"}, {"id": "b", "popularity": 0, "duration_ms": 0},
+                  {"id": "c", "album": {"release_date": "19xx"}}, {"id": "d", "popularity": 42}]
+
+        for tracks in (make_plays(2000), TOP_TRACKS, sparse, [{"track": None}], []):
+            assert_same(columnar.analyze_track_characteristics(tracks),
+                        reference.analyze_track_characteristics(tracks))
+
+    def test_obscurity_score_matches(self, processors):
+        """Test obscurity over artists and tracks, including missing popularity"""
+        columnar, reference = processors
+        artists = TOP_ARTISTS + [{"id": "x"}, {"id": "y", "popularity": 3}]
+
+        for args in ((artists, TOP_TRACKS), (artists, []), ([], make_plays(100)), ([], [])):
+            assert_same(columnar.calculate_obscurity_score(*args), reference.calculate_obscurity_score(*args))
+
+    def test_analyze_all_matches(self, processors, sample_listening_data):
+        """Test that analyze_all runs the vectorized methods and matches the fused pass"""
+        columnar, reference = processors
+        top_artists = {"short_term": TOP_ARTISTS, "medium_term": [{"id": "a4", "popularity": 60, "genres": ["jazz"]}],
+                       "long_term": []}
+        top_tracks = {"short_term": TOP_TRACKS, "medium_term": make_plays(30), "long_term": []}
+        empty = {"short_term": [], "medium_term": [], "long_term": []}
+
+        with patch.object(ColumnarDataProcessor, "analyze_track_characteristics",
+                          wraps=columnar.analyze_track_characteristics) as characteristics, \
+                patch.object(ColumnarDataProcessor, "calculate_obscurity_score",
+                             wraps=columnar.calculate_obscurity_score) as obscurity:
+            result = columnar.analyze_all(sample_listening_data, top_artists, top_tracks)
+
+        characteristics.assert_called_once()
+        obscurity.assert_called_once()
+        expected = reference.analyze_all(sample_listening_data, top_artists, top_tracks)
+        assert result.keys() == expected.keys()
+        for key in ("track_characteristics", "obscurity_score"):
+            assert_same(result[key], expected[key])
+        assert result["listening_history"] == expected["listening_history"]
+        assert result["genre_diversity"] == expected["genre_diversity"]
+        assert columnar.analyze_all([], empty, empty) == reference.analyze_all([], empty, empty)
+
+    def test_ids_are_interned_in_first_seen_order(self):
+        """Test that codes index the ID lists in order of first appearance"""
+        plays = make_plays(20)
+
+        columns = PlayColumns(plays)
+
+        assert columns.track_ids == list(dict.fromkeys(play["track"]["id"] for play in plays))
+        assert [columns.track_ids[code] for code in columns.track] == [play["track"]["id"] for play in plays]
+        assert columns.played_at_ms.dtype == np.int64
+
+    def test_create_processor(self):
+        """Test that the engine setting picks the processor"""
+        with patch.object(data_processor, "PROCESSOR_ENGINE", "columnar"):
+            assert isinstance(create_processor(), ColumnarDataProcessor)
+        with patch.object(data_processor, "PROCESSOR_ENGINE", "python"):
+            assert type(create_processor()) is SpotifyDataProcessor
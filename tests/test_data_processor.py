@@ -1,7 +1,7 @@
 import pytest
 from unittest.mock import Mock, patch
 from datetime import datetime
-from data_processor import SpotifyDataProcessor
+from data_processor import SpotifyDataProcessor, ListeningAggregate, create_processor
 
 
 class TestSpotifyDataProcessor:
@@ -29,6 +29,33 @@ class TestSpotifyDataProcessor:
         assert result["unique_artists"] == 2  # artist_1 and artist_2
         assert result["repetition_rate"] == 1/3  # (3-2)/3
     
+    def test_process_listening_history_from_aggregate(self, processor, sample_listening_data):
+        """Test that merged, stored aggregates give the same stats as the plays"""
+        first = ListeningAggregate.from_plays(sample_listening_data[:1])
+        rest = ListeningAggregate.from_plays(sample_listening_data[1:])
+        aggregate = ListeningAggregate.from_dict(first.merge(rest).to_dict())
+        
+        assert processor.process_listening_history(aggregate) == \
+            processor.process_listening_history(sample_listening_data)
+        assert processor.process_listening_history(ListeningAggregate()) == {}
+    
+    def test_process_listening_history_top_k_modes(self, processor, sample_listening_data):
+        """Test that both top-k modes agree on a small history"""
+        exact = processor.process_listening_history(sample_listening_data, top_k_mode="exact")
+        approximate = processor.process_listening_history(sample_listening_data, top_k_mode="approximate")
+        
+        assert approximate["most_played_tracks"] == exact["most_played_tracks"]
+        assert sorted(approximate["top_artists"]) == sorted(exact["top_artists"])
+    
+    @pytest.mark.parametrize("engine", ["python", "columnar"])
+    def test_process_listening_history_from_stream(self, processor, sample_listening_data, engine):
+        """Test that plays can be streamed from a generator instead of a list, on either engine"""
+        expected = processor.process_listening_history(sample_listening_data)
+        with patch("data_processor.PROCESSOR_ENGINE", engine):
+            engine_processor = create_processor()
+        
+        assert engine_processor.process_listening_history(play for play in sample_listening_data) == expected
+    
     def test_analyze_listening_by_hour(self, processor):
         """Test listening pattern analysis by hour"""
         tracks = [
@@ -216,8 +243,7 @@ class TestSpotifyDataProcessor:
         assert result["avg_artist_popularity"] == 60
         assert result["avg_track_popularity"] == 50
     
-    @patch('data_processor.datetime')
-    def test_date_parsing_edge_cases(self, mock_datetime, processor):
+    def test_date_parsing_edge_cases(self, processor):
         """Test handling of various date formats"""
         # Test with tracks containing different date formats
         tracks = [
@@ -240,4 +266,39 @@ class TestSpotifyDataProcessor:
         # Should not raise exceptions
         result = processor.process_listening_history(malformed_tracks)
         assert isinstance(result, dict)
-        assert result["total_tracks_played"] == 2
\ No newline at end of file
+        assert result["total_tracks_played"] == 2
+    
+    def test_analyze_all_matches_individual_methods(self, processor, sample_listening_data):
+        """Test that the fused pass gives the same results as the separate methods"""
+        top_artists = {
+            time_range: [{"id": f"{time_range}_{i}", "popularity": (i * 17) % 101,
+                          "genres": ["rock", f"genre_{i % 4}"] if i % 5 else []} for i in range(20)]
+            for time_range in ("short_term", "medium_term", "long_term")
+        }
+        top_tracks = {
+            time_range: [{"id": f"{time_range}_{i}", "popularity": (i * 13) % 101, "duration_ms": 150000 + i * 997,
+                          "explicit": i % 3 == 0, "album": {"release_date": f"{1970 + i}-01-01"}} for i in range(20)]
+            for time_range in ("short_term", "medium_term", "long_term")
+        }
+        all_artists = top_artists["short_term"] + top_artists["medium_term"] + top_artists["long_term"]
+        all_tracks = top_tracks["short_term"] + top_tracks["medium_term"] + top_tracks["long_term"]
+        
+        result = processor.analyze_all(sample_listening_data, top_artists, top_tracks)
+        
+        assert result == {
+            "listening_history": processor.process_listening_history(sample_listening_data),
+            "track_characteristics": processor.analyze_track_characteristics(all_tracks),
+            "genre_diversity": processor.calculate_genre_diversity(all_artists),
+            "obscurity_score": processor.calculate_obscurity_score(all_artists, all_tracks)
+        }
+    
+    def test_analyze_all_empty_inputs(self, processor):
+        """Test that empty inputs give the same defaults as the separate methods"""
+        empty = {"short_term": [], "medium_term": [], "long_term": []}
+        
+        assert processor.analyze_all([], empty, empty) == {
+            "listening_history": {},
+            "track_characteristics": {},
+            "genre_diversity": {"diversity_score": 0, "genre_distribution": {}},
+            "obscurity_score": {"obscurity_score": 0}
+        }
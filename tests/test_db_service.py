@@ -1,9 +1,10 @@
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 from datetime import datetime, timedelta
+from sqlalchemy import event
 from sqlalchemy.orm import Session
-from db_service import DatabaseService
-from models import User, UserToken, UserAnalysis
+from db_service import DatabaseService, ANALYSIS_HISTORY_COLUMNS
+from models import User, UserToken, UserAnalysis, UserTopArtist, UserTopTrack, UserGenre, UserTrend
 
 
 class TestDatabaseService:
@@ -16,7 +17,9 @@ class TestDatabaseService:
     @pytest.fixture
     def db_service(self, mock_db):
         """Create a DatabaseService instance with mock database"""
-        return DatabaseService(mock_db)
+        # Trend rollups read the session; they are covered in test_trends.py
+        with patch('db_service.ROLL_UP_TRENDS', False):
+            yield DatabaseService(mock_db)
     
     @pytest.fixture
     def sample_spotify_user_data(self):
@@ -182,7 +185,7 @@ class TestDatabaseService:
         result = db_service.get_user_analysis_history(user_id, limit=10)
         
         assert result == mock_analyses
-        mock_db.query.assert_called_once_with(UserAnalysis)
+        mock_db.query.assert_called_once_with(*ANALYSIS_HISTORY_COLUMNS)
     
     def test_get_user_analysis_history_default_limit(self, mock_db, db_service):
         """Test retrieving analysis history with default limit"""
@@ -251,12 +254,82 @@ class TestDatabaseService:
             }
         }
         
-        db_service._store_top_items(analysis_id, user_id, analysis_data)
+        db_service._store_top_items(analysis_id, user_id, analysis_data, bulk=False)
         
         # Should add records for both artist and track
         assert mock_db.add.call_count >= 2
         mock_db.commit.assert_called_once()
     
+    def test_store_top_items_bulk(self, mock_db, db_service):
+        """Test that bulk mode issues one executemany INSERT per table"""
+        analysis_data = {
+            "top_artists": {
+                "short_term": [{"id": "artist1", "name": "Artist 1"}, {"id": "artist2", "name": "Artist 2"}]
+            },
+            "top_tracks": {
+                "short_term": [{"id": "track1", "name": "Track 1", "artists": [{"name": "Artist 1"}]}]
+            },
+            "genre_diversity": {"genre_distribution": {"rock": 3, "pop": 1}, "total_genre_mentions": 4}
+        }
+        
+        db_service._store_top_items(1, "test_user_123", analysis_data, bulk=True)
+        
+        mock_db.add.assert_not_called()
+        assert mock_db.execute.call_count == 3
+        tables = [c.args[0].table.name for c in mock_db.execute.call_args_list]
+        assert tables == ["user_top_artists", "user_top_tracks", "user_genres"]
+        artist_rows = mock_db.execute.call_args_list[0].args[1]
+        assert [row["rank_position"] for row in artist_rows] == [1, 2]
+        genre_rows = mock_db.execute.call_args_list[2].args[1]
+        assert genre_rows[0] == {"user_id": "test_user_123", "analysis_id": 1, "genre_name": "rock",
+                                 "occurrence_count": 3, "percentage": 75.0, "rank_position": 1}
+        mock_db.commit.assert_called_once()
+    
+    def test_store_analysis_single_commit(self, mock_db, db_service):
+        """Test that the analysis and its items are committed together"""
+        mock_db.refresh = Mock()
+        analysis_data = {"top_artists": {"short_term": [{"id": "artist1", "name": "Artist 1"}]}}
+        
+        db_service.store_analysis("test_user_123", analysis_data)
+        
+        mock_db.flush.assert_called_once()
+        mock_db.commit.assert_called_once()
+    
+    def test_store_user_analysis_one_commit(self, mock_db, db_service, sample_spotify_user_data):
+        """Test that the user, analysis and items are staged and committed once"""
+        mock_db.query.return_value.filter.return_value.first.return_value = None
+        analysis_data = {"top_artists": {"short_term": [{"id": "artist1", "name": "Artist 1"}]}}
+        
+        result = db_service.store_user_analysis(sample_spotify_user_data, analysis_data, 30)
+        
+        assert isinstance(result, UserAnalysis)
+        assert result.days_back == 30
+        mock_db.commit.assert_called_once()
+        mock_db.refresh.assert_not_called()
+        assert mock_db.add.call_count == 2
+    
+    def test_unit_of_work_rolls_back(self, mock_db, db_service):
+        """Test that a failure inside a unit of work commits nothing"""
+        with pytest.raises(ValueError):
+            with db_service.unit_of_work():
+                db_service.store_user_tokens("test_user_123", "access", None, 3600)
+                raise ValueError("boom")
+        
+        mock_db.flush.assert_called_once()
+        mock_db.commit.assert_not_called()
+        mock_db.rollback.assert_called_once()
+    
+    def test_store_analysis_rolls_back_on_failure(self, mock_db, db_service):
+        """Test that a failed item insert leaves no partial analysis"""
+        mock_db.execute.side_effect = Exception("insert failed")
+        analysis_data = {"top_artists": {"short_term": [{"id": "artist1", "name": "Artist 1"}]}}
+        
+        with pytest.raises(Exception, match="insert failed"):
+            db_service.store_analysis("test_user_123", analysis_data)
+        
+        mock_db.rollback.assert_called_once()
+        mock_db.commit.assert_not_called()
+    
     def test_encrypt_decrypt_token_integration(self, mock_db, db_service):
         """Test token encryption and decryption work together"""
         original_token = "test_access_token_123"
@@ -302,4 +375,345 @@ class TestDatabaseService:
         
         # Check that analysis_date is set correctly
         call_args = mock_db.add.call_args[0][0]
-        assert call_args.analysis_date == fixed_time
\ No newline at end of file
+        assert call_args.analysis_date == fixed_time
+
+class TestStoredAnalysisResponse:
+    """Round trip through a real SQLite session"""
+    
+    @pytest.fixture
+    def stored_db(self, test_db):
+        """Test session cleaned of the rows these tests create"""
+        yield test_db
+        test_db.rollback()
+        for model in (UserTopArtist, UserTopTrack, UserGenre, UserTrend, UserAnalysis):
+            test_db.query(model).filter(model.user_id == "stored_user").delete()
+        test_db.query(User).filter(User.spotify_user_id == "stored_user").delete()
+        test_db.commit()
+    
+    @pytest.fixture
+    def analysis_data(self):
+        return {
+            "user_profile": {"id": "stored_user", "name": "Stored User", "followers": 5},
+            "listening_history": {"total_tracks_played": 3, "unique_tracks": 2, "unique_artists": 1,
+                                  "repetition_rate": 1 / 3, "listening_by_hour": {14: 3},
+                                  "listening_by_day": {"Monday": 3}},
+            "top_artists": {"short_term": [
+                {"id": "a1", "name": "Artist 1", "popularity": 80, "genres": ["rock"],
+                 "followers": {"total": 10}, "images": [{"url": "http://img/a1"}]},
+                {"id": "a2", "name": "Artist 2", "popularity": 20, "genres": [], "followers": {"total": 1}}
+            ], "medium_term": [], "long_term": []},
+            "top_tracks": {"short_term": [
+                {"id": "t1", "name": "Track 1", "artists": [{"name": "Artist 1"}], "popularity": 70,
+                 "duration_ms": 200000, "explicit": False,
+                 "album": {"name": "Album", "release_date": "2020-01-01", "images": [{"url": "http://img/t1"}]}}
+            ], "medium_term": [], "long_term": []},
+            "track_characteristics": {"avg_popularity": 70, "avg_duration_minutes": 3.3,
+                                      "explicit_percentage": 0, "avg_release_year": 2020, "year_range": 0},
+            "genre_diversity": {"diversity_score": 0.4, "unique_genres": 1, "genre_distribution": {"rock": 1}},
+            "obscurity_score": {"obscurity_score": 0.5},
+            "uniqueness_score": {"uniqueness_score": 0.6, "rating": "Unique", "components": {"obscurity": 0.2}},
+            "insights": ["insight"]
+        }
+    
+    def _store(self, db, analysis_data, days_back=30):
+        service = DatabaseService(db)
+        service.get_or_create_user({"id": "stored_user", "display_name": "Stored User", "followers": {"total": 5}})
+        return service.store_analysis("stored_user", analysis_data, days_back)
+    
+    def test_response_round_trip(self, stored_db, analysis_data):
+        """Test that the stored analysis rebuilds the response the dashboard reads"""
+        self._store(stored_db, analysis_data)
+        stored_db.expire_all()
+        
+        response = DatabaseService(stored_db).get_stored_analysis_response("stored_user", 30, 3600)
+        
+        assert response["user_profile"] == analysis_data["user_profile"]
+        assert response["listening_history"]["listening_by_hour"] == {"14": 3}
+        assert [a["id"] for a in response["top_artists"]["short_term"]] == ["a1", "a2"]
+        assert response["top_artists"]["short_term"][0]["images"] == [{"url": "http://img/a1"}]
+        assert response["top_artists"]["short_term"][1]["images"] == []
+        assert response["top_tracks"]["short_term"][0]["album"]["images"] == [{"url": "http://img/t1"}]
+        assert response["top_tracks"]["short_term"][0]["artists"] == [{"name": "Artist 1"}]
+        assert response["top_tracks"]["long_term"] == []
+        assert response["genre_diversity"]["diversity_score"] == 0.4
+        assert response["uniqueness_score"]["rating"] == "Unique"
+        assert response["obscurity_score"] == {"obscurity_score": 0.5}
+        assert response["insights"] == ["insight"]
+    
+    @pytest.mark.parametrize("bulk", [True, False])
+    def test_bulk_and_orm_modes_write_the_same_rows(self, stored_db, analysis_data, bulk):
+        """Test that both persistence modes store every top item and genre"""
+        with patch('db_service.BULK_INSERTS', bulk):
+            service = DatabaseService(stored_db)
+            service.get_or_create_user({"id": "stored_user", "display_name": "Stored User"})
+            analysis = service.store_analysis("stored_user", analysis_data, 30)
+        
+        artists = stored_db.query(UserTopArtist).filter_by(analysis_id=analysis.id).order_by(UserTopArtist.rank_position).all()
+        tracks = stored_db.query(UserTopTrack).filter_by(analysis_id=analysis.id).all()
+        genres = stored_db.query(UserGenre).filter_by(analysis_id=analysis.id).all()
+        assert [(a.spotify_artist_id, a.time_range, a.rank_position) for a in artists] == [
+            ("a1", "short_term", 1), ("a2", "short_term", 2)
+        ]
+        assert all(a.created_at is not None for a in artists)
+        assert [t.spotify_track_id for t in tracks] == ["t1"]
+        assert [(g.genre_name, g.occurrence_count, g.percentage) for g in genres] == [("rock", 1, 100.0)]
+    
+    def test_filters_by_window_and_age(self, stored_db, analysis_data):
+        """Test that other windows and rows older than the max age are not served"""
+        analysis = self._store(stored_db, analysis_data, days_back=30)
+        service = DatabaseService(stored_db)
+        
+        assert service.get_stored_analysis_response("stored_user", 7, 3600) is None
+        analysis.analysis_date = datetime.utcnow() - timedelta(hours=2)
+        stored_db.commit()
+        assert service.get_stored_analysis_response("stored_user", 30, 3600) is None
+        assert service.get_stored_analysis_response("stored_user", 30, 3 * 3600) is not None
+    
+    def test_store_user_analysis_single_commit(self, stored_db, test_engine, analysis_data):
+        """Test that a new user and a full analysis are written with one commit and no reloads"""
+        statements = []
+        commits = []
+        
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        def count_commit(conn):
+            commits.append(1)
+        
+        event.listen(test_engine, "before_cursor_execute", record)
+        event.listen(test_engine, "commit", count_commit)
+        try:
+            analysis = DatabaseService(stored_db).store_user_analysis(
+                {"id": "stored_user", "display_name": "Stored User"}, analysis_data, 30)
+            analysis_id = analysis.id
+            user_id = analysis.user_id
+        finally:
+            event.remove(test_engine, "before_cursor_execute", record)
+            event.remove(test_engine, "commit", count_commit)
+        
+        assert len(commits) == 1
+        # The user is upserted, so nothing is read back; the only other
+        # statements read and update the trend buckets the analysis is folded into
+        others = [statement for statement in statements if not statement.startswith("INSERT")]
+        assert others and all(statement.startswith(("SELECT", "UPDATE user_trends")) and "user_trends" in statement
+                              for statement in others)
+        assert analysis_id is not None and user_id == "stored_user"
+        assert stored_db.query(UserTopArtist).filter_by(analysis_id=analysis_id).count() == 2
+    
+    def test_loads_in_three_queries(self, stored_db, test_engine, analysis_data):
+        """Test that the analysis, user and top items are eager loaded"""
+        self._store(stored_db, analysis_data)
+        stored_db.expire_all()
+        statements = []
+        
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(test_engine, "before_cursor_execute", count)
+        try:
+            DatabaseService(stored_db).get_stored_analysis_response("stored_user", 30, 3600)
+        finally:
+            event.remove(test_engine, "before_cursor_execute", count)
+        
+        assert len(statements) == 3
+
+
+class TestNativeUpserts:
+    """get_or_create_user and store_user_tokens on a real SQLite session"""
+    
+    @pytest.fixture
+    def upsert_db(self, test_db):
+        yield test_db
+        test_db.rollback()
+        test_db.query(UserToken).filter(UserToken.user_id == "upsert_user").delete()
+        test_db.query(User).filter(User.spotify_user_id == "upsert_user").delete()
+        test_db.commit()
+    
+    def test_user_upsert_is_one_statement(self, upsert_db, test_engine):
+        """Test that first and repeat logins each take a single INSERT ... ON CONFLICT"""
+        service = DatabaseService(upsert_db)
+        statements = []
+        
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(test_engine, "before_cursor_execute", record)
+        try:
+            first = service.get_or_create_user({"id": "upsert_user", "display_name": "Upsert User"})
+            created_at, first_login = first.created_at, first.last_login_at
+            second = service.get_or_create_user({"id": "upsert_user", "display_name": "Renamed"})
+        finally:
+            event.remove(test_engine, "before_cursor_execute", record)
+        
+        assert len(statements) == 2
+        assert all("ON CONFLICT" in statement for statement in statements)
+        assert second.created_at == created_at
+        assert second.last_login_at >= first_login
+        assert second.display_name == "Upsert User"
+        assert upsert_db.query(User).filter_by(spotify_user_id="upsert_user").count() == 1
+    
+    def test_token_upsert_replaces_tokens(self, upsert_db):
+        """Test that storing tokens again updates the single row"""
+        service = DatabaseService(upsert_db)
+        service.get_or_create_user({"id": "upsert_user"})
+        
+        service.store_user_tokens("upsert_user", "access_1", "refresh_1", 3600)
+        service.store_user_tokens("upsert_user", "access_2", None, 7200)
+        upsert_db.expire_all()
+        
+        tokens = upsert_db.query(UserToken).filter_by(user_id="upsert_user").all()
+        assert len(tokens) == 1
+        assert service.decrypt_token(tokens[0].access_token) == "access_2"
+        assert tokens[0].refresh_token is None
+        assert tokens[0].expires_at > datetime.utcnow() + timedelta(seconds=3600)
+    
+    def test_login_in_one_commit(self, upsert_db, test_engine):
+        """Test that the callback's user and token writes share one commit"""
+        service = DatabaseService(upsert_db)
+        commits = []
+        
+        def count_commit(conn):
+            commits.append(1)
+        
+        event.listen(test_engine, "commit", count_commit)
+        try:
+            with service.unit_of_work():
+                user = service.get_or_create_user({"id": "upsert_user"})
+                service.store_user_tokens(user.spotify_user_id, "access", "refresh", 3600)
+        finally:
+            event.remove(test_engine, "commit", count_commit)
+        
+        assert len(commits) == 1
+        assert service.is_token_valid("upsert_user")
+
+class TestGenreQueries:
+    """Genre rows and the queries over them, on a real SQLite session"""
+    
+    USERS = ("genre_user_1", "genre_user_2", "genre_user_3")
+    
+    @pytest.fixture
+    def genre_db(self, test_db):
+        yield test_db
+        test_db.rollback()
+        for model in (UserTopArtist, UserTopTrack, UserGenre, UserTrend, UserAnalysis):
+            test_db.query(model).filter(model.user_id.in_(self.USERS)).delete()
+        test_db.query(User).filter(User.spotify_user_id.in_(self.USERS)).delete()
+        test_db.commit()
+    
+    def _store(self, db, user_id, genre_counts, when):
+        service = DatabaseService(db)
+        service.get_or_create_user({"id": user_id, "display_name": user_id.replace("_", " ").title()})
+        counts = dict(sorted(genre_counts.items(), key=lambda item: -item[1]))
+        with patch('db_service.datetime') as mock_datetime:
+            mock_datetime.utcnow.return_value = when
+            return service.store_analysis(user_id, {"genre_diversity": {
+                "genre_distribution": dict(list(counts.items())[:10]),
+                "total_genre_mentions": sum(counts.values())}}, 30, counts)
+    
+    def test_every_genre_is_stored_with_its_rank(self, genre_db):
+        """Test that genres beyond the top 10 are written, ranked by mentions"""
+        counts = {f"genre {i:02d}": 20 - i for i in range(15)}
+        
+        analysis = self._store(genre_db, "genre_user_1", counts, datetime(2024, 1, 1))
+        
+        rows = genre_db.query(UserGenre).filter_by(analysis_id=analysis.id).order_by(UserGenre.rank_position).all()
+        assert len(rows) == 15
+        assert [(r.genre_name, r.rank_position) for r in rows[:2]] == [("genre 00", 1), ("genre 01", 2)]
+        assert sum(r.percentage for r in rows) == pytest.approx(100)
+    
+    def test_users_by_top_genre_uses_latest_analysis(self, genre_db):
+        """Test that only each user's latest analysis counts, largest share first"""
+        self._store(genre_db, "genre_user_1", {"indie rock": 6, "pop": 4}, datetime(2024, 1, 1))
+        self._store(genre_db, "genre_user_1", {"pop": 9, "indie rock": 1}, datetime(2024, 2, 1))
+        self._store(genre_db, "genre_user_2", {"indie rock": 9, "jazz": 1}, datetime(2024, 1, 15))
+        self._store(genre_db, "genre_user_3", {"modern rock": 5, "pop": 5}, datetime(2024, 1, 15))
+        service = DatabaseService(genre_db)
+        
+        exact = service.get_users_by_top_genre("indie rock")
+        contains = service.get_users_by_top_genre("ROCK", contains=True)
+        
+        assert [u["user_id"] for u in exact] == ["genre_user_2"]
+        assert exact[0]["percentage"] == 90.0
+        assert [u["user_id"] for u in contains] == ["genre_user_2", "genre_user_3"]
+        assert service.get_users_by_top_genre("100%", contains=True) == []
+    
+    def test_genre_share_history(self, genre_db):
+        """Test the share over time, with 0 for analyses without the genre"""
+        self._store(genre_db, "genre_user_1", {"pop": 1, "jazz": 3}, datetime(2024, 1, 1))
+        self._store(genre_db, "genre_user_1", {"rock": 2}, datetime(2024, 2, 1))
+        self._store(genre_db, "genre_user_1", {"pop": 3, "rock": 1}, datetime(2024, 3, 1))
+        
+        history = DatabaseService(genre_db).get_genre_share_history("genre_user_1", "pop")
+        
+        assert [(h["analysis_date"][:7], h["percentage"], h["rank_position"]) for h in history] == [
+            ("2024-01", 25.0, 2), ("2024-02", 0.0, None), ("2024-03", 75.0, 1)
+        ]
+
+
+class TestAnalysisQueryPlans:
+    """Analysis reads are served by the composite indexes, per SQLite's EXPLAIN QUERY PLAN"""
+    
+    USER = "plan_user"
+    
+    @pytest.fixture
+    def plan_db(self, test_db):
+        service = DatabaseService(test_db)
+        service.get_or_create_user({"id": self.USER, "display_name": "Plan User"})
+        for day in (1, 2, 3):
+            with patch('db_service.datetime') as mock_datetime:
+                mock_datetime.utcnow.return_value = datetime(2024, 1, day)
+                service.store_analysis(self.USER, {
+                    "uniqueness_score": {"uniqueness_score": 50.0 + day, "rating": "Unique", "components": {}},
+                    "insights": ["A long insight"] * 20
+                }, 30)
+        test_db.expire_all()
+        yield test_db
+        test_db.rollback()
+        for model in (UserTopArtist, UserTopTrack, UserGenre, UserTrend, UserAnalysis):
+            test_db.query(model).filter(model.user_id == self.USER).delete()
+        test_db.query(User).filter(User.spotify_user_id == self.USER).delete()
+        test_db.commit()
+    
+    def _plans(self, test_engine, call):
+        """(statement, query plan details) of every SELECT call makes"""
+        statements = []
+        
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+        
+        event.listen(test_engine, "before_cursor_execute", record)
+        try:
+            result = call()
+        finally:
+            event.remove(test_engine, "before_cursor_execute", record)
+        
+        with test_engine.connect() as conn:
+            plans = [(statement, " | ".join(row[-1] for row in conn.exec_driver_sql(
+                         "EXPLAIN QUERY PLAN " + statement, parameters)))
+                     for statement, parameters in statements if statement.startswith("SELECT")]
+        return result, plans
+    
+    def test_history_is_column_projected_and_indexed(self, plan_db, test_engine):
+        """Test that the history query reads no JSON columns and needs no sort"""
+        history, plans = self._plans(test_engine,
+                                     lambda: DatabaseService(plan_db).get_user_analysis_history(self.USER, 2))
+        
+        assert [row.analysis_date.day for row in history] == [3, 2]
+        assert history[0].uniqueness_score == 53.0
+        assert not hasattr(history[0], "insights")
+        (statement, plan), = plans
+        assert "insights" not in statement and "listening_by_hour" not in statement
+        assert "USING INDEX ix_user_analyses_user_date" in plan
+        assert "TEMP B-TREE" not in plan
+    
+    def test_latest_analysis_and_top_items_are_indexed(self, plan_db, test_engine):
+        """Test that the latest analysis and its top items come from index searches"""
+        response, plans = self._plans(test_engine,
+                                      lambda: DatabaseService(plan_db).get_stored_analysis_response(self.USER, 30))
+        
+        assert response["analysis_date"].startswith("2024-01-03")
+        by_table = {statement.split("FROM", 1)[1].split()[0]: plan for statement, plan in plans}
+        assert "USING INDEX ix_user_analyses_user_date" in by_table["user_analyses"]
+        assert "TEMP B-TREE" not in by_table["user_analyses"]
+        assert "USING INDEX ix_user_top_artists_analysis_range_rank" in by_table["user_top_artists"]
+        assert "USING INDEX ix_user_top_tracks_analysis_range_rank" in by_table["user_top_tracks"]
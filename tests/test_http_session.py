@@ -0,0 +1,72 @@
+import pytest
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import http_session
+from http_session import create_session, get_session, close_session, get_connection_stats
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpSession:
+
+    @pytest.fixture
+    def server_url(self):
+        """Run a local keep-alive HTTP server for the duration of a test"""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f"http://127.0.0.1:{server.server_port}"
+        server.shutdown()
+        server.server_close()
+
+    def test_get_session_is_shared(self):
+        """Test that the process-wide session is created once"""
+        close_session()
+        try:
+            assert get_session() is get_session()
+        finally:
+            close_session()
+        assert http_session._session is None
+
+    def test_create_session_configures_pool_and_retries(self):
+        """Test pool size and retry policy are applied to the adapter"""
+        session = create_session(pool_size=7, retries=4)
+        adapter = session.get_adapter("https://api.spotify.com")
+
+        assert adapter._pool_maxsize == 7
+        assert adapter.max_retries.total == 4
+        assert 429 not in adapter.max_retries.status_forcelist
+        assert "POST" not in adapter.max_retries.allowed_methods
+
+    def test_connection_reuse_counters(self, server_url):
+        """Test that sequential requests reuse one kept-alive connection"""
+        session = create_session()
+
+        for _ in range(5):
+            assert session.get(f"{server_url}/v1/me", timeout=5).status_code == 200
+
+        stats = get_connection_stats(session)
+
+        assert stats["requests"] == 5
+        assert stats["new_connections"] == 1
+        assert stats["reused_connections"] == 4
+        assert stats["hosts"]["127.0.0.1"]["reused_connections"] == 4
+
+    def test_connection_stats_empty_session(self):
+        """Test counters for a session that has not sent anything"""
+        stats = get_connection_stats(create_session())
+
+        assert stats == {"requests": 0, "new_connections": 0, "reused_connections": 0, "hosts": {}}
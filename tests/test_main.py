@@ -1,7 +1,8 @@
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, AsyncMock, patch, MagicMock
 from fastapi.testclient import TestClient
 from fastapi import status
+from analysis_cache import get_analysis_cache
 import json
 
 
@@ -38,10 +39,11 @@ class TestMainEndpoints:
         assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
         assert "error=no_code" in response.headers["location"]
     
-    @patch('main.requests.post')
+    @patch('main.get_session')
     @patch('main.DatabaseService')
-    def test_callback_success(self, mock_db_service, mock_post, client):
+    def test_callback_success(self, mock_db_service, mock_get_session, client):
         """Test successful callback with authorization code"""
+        mock_post = mock_get_session.return_value.post
         # Mock Spotify token response
         mock_token_response = Mock()
         mock_token_response.status_code = 200
@@ -53,8 +55,8 @@ class TestMainEndpoints:
         mock_post.return_value = mock_token_response
         
         # Mock user profile response
-        with patch('main.SpotifyClient') as mock_spotify_client:
-            mock_client_instance = Mock()
+        with patch('main.AsyncSpotifyClient') as mock_spotify_client:
+            mock_client_instance = AsyncMock()
             mock_client_instance.get_user_profile.return_value = {
                 "id": "test_user",
                 "display_name": "Test User"
@@ -72,9 +74,10 @@ class TestMainEndpoints:
         assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
         assert "access_token=test_access_token" in response.headers["location"]
     
-    @patch('main.requests.post')
-    def test_callback_token_exchange_failure(self, mock_post, client):
+    @patch('main.get_session')
+    def test_callback_token_exchange_failure(self, mock_get_session, client):
         """Test callback when token exchange fails"""
+        mock_post = mock_get_session.return_value.post
         # Mock failed token response
         mock_token_response = Mock()
         mock_token_response.status_code = 400
@@ -85,10 +88,10 @@ class TestMainEndpoints:
         assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
         assert "error=token_failed" in response.headers["location"]
     
-    @patch('main.SpotifyClient')
+    @patch('main.AsyncSpotifyClient')
     def test_validate_token_valid(self, mock_spotify_client, client):
         """Test token validation with valid token"""
-        mock_client_instance = Mock()
+        mock_client_instance = AsyncMock()
         mock_client_instance.get_user_profile.return_value = {"id": "user123"}
         mock_spotify_client.return_value = mock_client_instance
         
@@ -98,10 +101,10 @@ class TestMainEndpoints:
         # The actual implementation returns the user profile, not a "valid" field
         assert "id" in response.json()
     
-    @patch('main.SpotifyClient')
+    @patch('main.AsyncSpotifyClient')
     def test_validate_token_invalid(self, mock_spotify_client, client):
         """Test token validation with invalid token"""
-        mock_client_instance = Mock()
+        mock_client_instance = AsyncMock()
         mock_client_instance.get_user_profile.side_effect = Exception("Invalid token")
         mock_spotify_client.return_value = mock_client_instance
         
@@ -117,9 +120,10 @@ class TestMainEndpoints:
         assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
     
     @patch('main.DatabaseService')
-    @patch('main.requests.post')
-    def test_refresh_token_success(self, mock_post, mock_db_service, client):
+    @patch('spotify_auth.get_session')
+    def test_refresh_token_success(self, mock_get_session, mock_db_service, client):
         """Test successful token refresh"""
+        mock_post = mock_get_session.return_value.post
         # Mock database service
         mock_db_instance = Mock()
         mock_token = Mock()
@@ -155,13 +159,13 @@ class TestMainEndpoints:
         
         assert response.status_code == status.HTTP_404_NOT_FOUND
     
-    @patch('main.SpotifyClient')
-    @patch('main.SpotifyDataProcessor')
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.create_processor')
     @patch('main.DatabaseService')
     def test_user_analysis_success(self, mock_db_service, mock_data_processor, mock_spotify_client, client):
         """Test successful user analysis"""
         # Mock Spotify client
-        mock_client_instance = Mock()
+        mock_client_instance = AsyncMock()
         mock_client_instance.get_user_profile.return_value = {"id": "user123"}
         mock_client_instance.get_top_artists.return_value = [{"id": "artist1"}]
         mock_client_instance.get_top_tracks.return_value = [{"id": "track1"}]
@@ -199,10 +203,10 @@ class TestMainEndpoints:
         
         assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
     
-    @patch('main.SpotifyClient')
+    @patch('main.AsyncSpotifyClient')
     def test_user_analysis_invalid_token(self, mock_spotify_client, client):
         """Test user analysis with invalid token"""
-        mock_client_instance = Mock()
+        mock_client_instance = AsyncMock()
         mock_client_instance.get_user_profile.side_effect = Exception("Invalid token")
         mock_spotify_client.return_value = mock_client_instance
         
@@ -210,11 +214,11 @@ class TestMainEndpoints:
         
         assert response.status_code == status.HTTP_401_UNAUTHORIZED
     
-    @patch('main.SpotifyClient')
+    @patch('main.AsyncSpotifyClient')
     @patch('main.DatabaseService')
     def test_user_top_artists(self, mock_db_service, mock_spotify_client, client):
         """Test get user top artists endpoint"""
-        mock_client_instance = Mock()
+        mock_client_instance = AsyncMock()
         mock_client_instance.get_user_profile.return_value = {"id": "user123"}
         mock_client_instance.get_top_artists.return_value = [
             {"id": "artist1", "name": "Artist 1"}
@@ -233,11 +237,11 @@ class TestMainEndpoints:
         assert len(data) == 1
         assert data[0]["name"] == "Artist 1"
     
-    @patch('main.SpotifyClient')
+    @patch('main.AsyncSpotifyClient')
     @patch('main.DatabaseService')
     def test_user_top_tracks(self, mock_db_service, mock_spotify_client, client):
         """Test get user top tracks endpoint"""
-        mock_client_instance = Mock()
+        mock_client_instance = AsyncMock()
         mock_client_instance.get_user_profile.return_value = {"id": "user123"}
         mock_client_instance.get_top_tracks.return_value = [
             {"id": "track1", "name": "Track 1"}
@@ -256,11 +260,11 @@ class TestMainEndpoints:
         assert len(data) == 1
         assert data[0]["name"] == "Track 1"
     
-    @patch('main.SpotifyClient')
+    @patch('main.AsyncSpotifyClient')
     @patch('main.DatabaseService')
     def test_user_recent_tracks(self, mock_db_service, mock_spotify_client, client):
         """Test get user recent tracks endpoint"""
-        mock_client_instance = Mock()
+        mock_client_instance = AsyncMock()
         mock_client_instance.get_user_profile.return_value = {"id": "user123"}
         mock_client_instance.get_recently_played.return_value = [
             {"track": {"id": "track1", "name": "Track 1"}}
@@ -308,10 +312,10 @@ class TestMainEndpoints:
         
         assert response.status_code == status.HTTP_404_NOT_FOUND
     
-    @patch('main.SpotifyClient')
+    @patch('main.AsyncSpotifyClient')
     def test_rate_limit_handling(self, mock_spotify_client, client):
         """Test that rate limiting is handled properly"""
-        mock_client_instance = Mock()
+        mock_client_instance = AsyncMock()
         # Simulate rate limit error that gets retried internally
         mock_client_instance.get_user_profile.return_value = {"id": "user123"}
         mock_spotify_client.return_value = mock_client_instance
@@ -321,6 +325,19 @@ class TestMainEndpoints:
         # Should succeed even if rate limited (due to retry logic)
         assert response.status_code == status.HTTP_200_OK
     
+    @patch('main.get_http_pool_stats')
+    def test_http_metrics_include_async_pool(self, mock_pool_stats, client):
+        """Test that the HTTP metrics cover the async pool as well as the requests Session"""
+        mock_pool_stats.return_value = {"requests": 3, "new_connections": 1, "reused_connections": 2,
+                                        "retries": 1, "hosts": {}}
+        
+        response = client.get("/metrics/http")
+        
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["async_pool"] == mock_pool_stats.return_value
+        assert {"requests", "new_connections", "reused_connections", "rate_limiter"} <= data.keys()
+    
     def test_health_check_endpoint(self, client):
         """Test health check endpoint if it exists"""
         # This endpoint might not exist, but if it does, it should return 200
@@ -347,4 +364,323 @@ class TestMainEndpoints:
         # For now, we'll just test that create_tables can be called
         mock_create_tables.return_value = None
         mock_create_tables()
-        mock_create_tables.assert_called_once()
\ No newline at end of file
+        mock_create_tables.assert_called_once()
+
+def mock_spotify_user(mock_spotify_client, user_id="user123"):
+    """Make AsyncSpotifyClient resolve the access token to user_id, or reject it when user_id is None"""
+    mock_client_instance = AsyncMock()
+    if user_id is None:
+        mock_client_instance.get_user_profile.side_effect = Exception("401 Unauthorized")
+    else:
+        mock_client_instance.get_user_profile.return_value = {"id": user_id, "display_name": "Test User"}
+    mock_spotify_client.return_value = mock_client_instance
+    return mock_client_instance
+
+
+class TestPlayLogEndpoints:
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.PlayLog')
+    def test_top_played_artists(self, mock_play_log, mock_spotify_client, client):
+        """Test top played artists are ranked by name with their play counts"""
+        mock_spotify_user(mock_spotify_client)
+        mock_play_log.return_value.top_played.return_value = [("Artist A", 12), ("Artist B", 7)]
+        
+        response = client.get("/user/top-played?access_token=valid_token&days_back=90&limit=2&mode=approximate")
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"artists": [{"name": "Artist A", "plays": 12}, {"name": "Artist B", "plays": 7}]}
+        mock_play_log.return_value.top_played.assert_called_once_with("user123", 90, "artists", 2, "approximate")
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.PlayLog')
+    def test_top_played_tracks(self, mock_play_log, mock_spotify_client, client):
+        """Test top played tracks are returned by ID with the default window and mode"""
+        mock_spotify_user(mock_spotify_client)
+        mock_play_log.return_value.top_played.return_value = [("track_1", 4)]
+        
+        response = client.get("/user/top-played?access_token=valid_token&kind=tracks")
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"tracks": [{"id": "track_1", "plays": 4}]}
+        mock_play_log.return_value.top_played.assert_called_once_with("user123", 30, "tracks", 10, None)
+    
+    @pytest.mark.parametrize("query", ["kind=albums", "mode=fuzzy", "kind=tracks&mode=EXACT"])
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.PlayLog')
+    def test_top_played_rejects_unknown_kind_and_mode(self, mock_play_log, mock_spotify_client, client, query):
+        """Test that an unknown kind or mode is a 400 before Spotify or the database is touched"""
+        response = client.get(f"/user/top-played?access_token=valid_token&{query}")
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "kind must be artists or tracks" in response.json()["detail"]
+        mock_spotify_client.assert_not_called()
+        mock_play_log.assert_not_called()
+    
+    @patch('main.PLAY_LOG_ENABLED', False)
+    @patch('main.PlayLog')
+    def test_top_played_needs_play_log(self, mock_play_log, client):
+        """Test that the route is a 404 when the play log is disabled"""
+        response = client.get("/user/top-played?access_token=valid_token")
+        
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert response.json() == {"detail": "Play log is disabled"}
+        mock_play_log.assert_not_called()
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.PlayLog')
+    def test_top_played_rejected_token(self, mock_play_log, mock_spotify_client, client):
+        """Test that a token Spotify rejects fails without reading the play log"""
+        mock_spotify_user(mock_spotify_client, None)
+        
+        response = client.get("/user/top-played?access_token=invalid_token")
+        
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+        assert response.json()["detail"].startswith("Failed to get top played")
+        mock_play_log.return_value.top_played.assert_not_called()
+    
+    def test_top_played_missing_token(self, client):
+        """Test that the access token is required"""
+        response = client.get("/user/top-played")
+        
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.PlayLog')
+    def test_unique_counts(self, mock_play_log, mock_spotify_client, client):
+        """Test distinct track and artist estimates over the default one-year window"""
+        mock_spotify_user(mock_spotify_client)
+        mock_play_log.return_value.unique_counts.return_value = {"tracks": 812, "artists": 164}
+        
+        response = client.get("/user/unique-counts?access_token=valid_token")
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"days_back": 365, "unique_tracks": 812, "unique_artists": 164}
+        mock_play_log.return_value.unique_counts.assert_called_once_with("user123", 365)
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.PlayLog')
+    def test_unique_counts_window(self, mock_play_log, mock_spotify_client, client):
+        """Test that days_back is passed through and echoed"""
+        mock_spotify_user(mock_spotify_client)
+        mock_play_log.return_value.unique_counts.return_value = {"tracks": 0, "artists": 0}
+        
+        response = client.get("/user/unique-counts?access_token=valid_token&days_back=7")
+        
+        assert response.json() == {"days_back": 7, "unique_tracks": 0, "unique_artists": 0}
+        mock_play_log.return_value.unique_counts.assert_called_once_with("user123", 7)
+    
+    def test_unique_counts_validates_days_back(self, client):
+        """Test that a non-integer window is rejected"""
+        response = client.get("/user/unique-counts?access_token=valid_token&days_back=year")
+        
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    
+    @patch('main.PLAY_LOG_ENABLED', False)
+    @patch('main.PlayLog')
+    def test_unique_counts_needs_play_log(self, mock_play_log, client):
+        """Test that the route is a 404 when the play log is disabled"""
+        response = client.get("/user/unique-counts?access_token=valid_token")
+        
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        mock_play_log.assert_not_called()
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.PlayLog')
+    def test_unique_counts_rejected_token(self, mock_play_log, mock_spotify_client, client):
+        """Test that a token Spotify rejects fails without reading the sketches"""
+        mock_spotify_user(mock_spotify_client, None)
+        
+        response = client.get("/user/unique-counts?access_token=invalid_token")
+        
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+        assert response.json()["detail"].startswith("Failed to get unique counts")
+        mock_play_log.return_value.unique_counts.assert_not_called()
+
+
+class TestGenreEndpoints:
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.DatabaseService')
+    def test_genre_top_users(self, mock_db_service, mock_spotify_client, client):
+        """Test users whose top genre matches, with the match mode and limit passed through"""
+        mock_spotify_user(mock_spotify_client)
+        users = [{"user_id": "user456", "display_name": "Rock Fan", "genre": "indie rock", "percentage": 42.5}]
+        mock_db_service.return_value.get_users_by_top_genre.return_value = users
+        
+        response = client.get("/genres/top-users?access_token=valid_token&genre=rock&contains=true&limit=5")
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"genre": "rock", "users": users}
+        mock_db_service.return_value.get_users_by_top_genre.assert_called_once_with("rock", 5, True)
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.DatabaseService')
+    def test_genre_top_users_with_cached_token(self, mock_db_service, mock_spotify_client, client):
+        """Test that a token already resolved by an analysis is not checked with Spotify again"""
+        get_analysis_cache().remember_user("cached_token", {"id": "user123"})
+        mock_db_service.return_value.get_users_by_top_genre.return_value = []
+        
+        response = client.get("/genres/top-users?access_token=cached_token&genre=jazz")
+        
+        assert response.json() == {"genre": "jazz", "users": []}
+        mock_spotify_client.return_value.get_user_profile.assert_not_called()
+        mock_db_service.return_value.get_users_by_top_genre.assert_called_once_with("jazz", 20, False)
+    
+    def test_genre_top_users_needs_genre(self, client):
+        """Test that the genre is required"""
+        response = client.get("/genres/top-users?access_token=valid_token")
+        
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.DatabaseService')
+    def test_genre_top_users_rejected_token(self, mock_db_service, mock_spotify_client, client):
+        """Test that only signed-in users may query other users' genres"""
+        mock_spotify_user(mock_spotify_client, None)
+        
+        response = client.get("/genres/top-users?access_token=invalid_token&genre=rock")
+        
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+        assert response.json()["detail"].startswith("Failed to get genre users")
+        mock_db_service.return_value.get_users_by_top_genre.assert_not_called()
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.DatabaseService')
+    def test_genre_history(self, mock_db_service, mock_spotify_client, client):
+        """Test a genre's share across the user's analyses"""
+        mock_spotify_user(mock_spotify_client)
+        history = [{"analysis_date": "2024-01-01T00:00:00", "percentage": 12.5, "occurrence_count": 5,
+                    "rank_position": 2},
+                   {"analysis_date": "2024-02-01T00:00:00", "percentage": 0.0, "occurrence_count": 0,
+                    "rank_position": None}]
+        mock_db_service.return_value.get_genre_share_history.return_value = history
+        
+        response = client.get("/user/genre-history?access_token=valid_token&genre=indie%20rock&limit=2")
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"genre": "indie rock", "history": history}
+        mock_db_service.return_value.get_genre_share_history.assert_called_once_with("user123", "indie rock", 2)
+    
+    def test_genre_history_needs_genre(self, client):
+        """Test that the genre is required"""
+        response = client.get("/user/genre-history?access_token=valid_token")
+        
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.DatabaseService')
+    def test_genre_history_rejected_token(self, mock_db_service, mock_spotify_client, client):
+        """Test that a token Spotify rejects fails without reading the history"""
+        mock_spotify_user(mock_spotify_client, None)
+        
+        response = client.get("/user/genre-history?access_token=invalid_token&genre=rock")
+        
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+        mock_db_service.return_value.get_genre_share_history.assert_not_called()
+
+
+class TestTrendEndpoints:
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.TrendRollup')
+    def test_user_trends(self, mock_rollup, mock_spotify_client, client):
+        """Test weekly trends per metric for the default window"""
+        mock_spotify_user(mock_spotify_client)
+        trends = {"uniqueness_score": [{"period_start": "2024-01-01", "year": 2024, "month": None, "week": 1,
+                                        "value": 0.7, "analyses": 3, "change_from_previous": None,
+                                        "trend_direction": None}]}
+        mock_rollup.return_value.get_trends.return_value = trends
+        
+        response = client.get("/user/trends?access_token=valid_token")
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"period": "week", "days_back": 30, "trends": trends}
+        mock_rollup.return_value.get_trends.assert_called_once_with("user123", "week", 12, None, days_back=30)
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.TrendRollup')
+    def test_user_trends_for_one_metric(self, mock_rollup, mock_spotify_client, client):
+        """Test monthly trends of one metric over another window"""
+        mock_spotify_user(mock_spotify_client)
+        mock_rollup.return_value.get_trends.return_value = {}
+        
+        response = client.get("/user/trends?access_token=valid_token&period=month&metric=obscurity_score"
+                              "&limit=6&days_back=7")
+        
+        assert response.json() == {"period": "month", "days_back": 7, "trends": {}}
+        mock_rollup.return_value.get_trends.assert_called_once_with("user123", "month", 6, "obscurity_score",
+                                                                    days_back=7)
+    
+    @pytest.mark.parametrize("query", ["period=day", "metric=loudness", "period=month&metric=Uniqueness_Score"])
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.TrendRollup')
+    def test_user_trends_rejects_unknown_period_and_metric(self, mock_rollup, mock_spotify_client, client, query):
+        """Test that an unknown period or metric is a 400 naming the valid ones"""
+        response = client.get(f"/user/trends?access_token=valid_token&{query}")
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "week, month" in response.json()["detail"]
+        assert "uniqueness_score" in response.json()["detail"]
+        mock_spotify_client.assert_not_called()
+        mock_rollup.assert_not_called()
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.TrendRollup')
+    def test_user_trends_rejected_token(self, mock_rollup, mock_spotify_client, client):
+        """Test that a token Spotify rejects fails without reading the rollups"""
+        mock_spotify_user(mock_spotify_client, None)
+        
+        response = client.get("/user/trends?access_token=invalid_token")
+        
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+        assert response.json()["detail"].startswith("Failed to get trends")
+        mock_rollup.return_value.get_trends.assert_not_called()
+
+
+class TestTimezoneEndpoint:
+    
+    @pytest.mark.parametrize("timezone", ["Europe/Berlin", "America/St_Johns", "UTC"])
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.DatabaseService')
+    def test_set_timezone(self, mock_db_service, mock_spotify_client, client, timezone):
+        """Test that a valid IANA name is stored for the user, creating the user first"""
+        mock_spotify_user(mock_spotify_client)
+        
+        response = client.put(f"/user/timezone?access_token=valid_token&timezone={timezone}")
+        
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"user_id": "user123", "timezone": timezone}
+        mock_db_service.return_value.get_or_create_user.assert_called_once_with(
+            {"id": "user123", "display_name": "Test User"})
+        mock_db_service.return_value.set_user_timezone.assert_called_once_with("user123", timezone)
+    
+    @pytest.mark.parametrize("timezone", ["Mars/Olympus_Mons", "Europe/../etc/passwd", "+02:00"])
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.DatabaseService')
+    def test_set_timezone_rejects_unknown_zone(self, mock_db_service, mock_spotify_client, client, timezone):
+        """Test that an unknown zone is a 400 before Spotify or the database is touched"""
+        response = client.put("/user/timezone", params={"access_token": "valid_token", "timezone": timezone})
+        
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json() == {"detail": f"Unknown timezone: {timezone}"}
+        mock_spotify_client.assert_not_called()
+        mock_db_service.assert_not_called()
+    
+    def test_set_timezone_needs_timezone(self, client):
+        """Test that the timezone is required"""
+        response = client.put("/user/timezone?access_token=valid_token")
+        
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    
+    @patch('main.AsyncSpotifyClient')
+    @patch('main.DatabaseService')
+    def test_set_timezone_rejected_token(self, mock_db_service, mock_spotify_client, client):
+        """Test that a token Spotify rejects stores nothing"""
+        mock_spotify_user(mock_spotify_client, None)
+        
+        response = client.put("/user/timezone?access_token=invalid_token&timezone=Europe/Berlin")
+        
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+        assert response.json()["detail"].startswith("Failed to set timezone")
+        mock_db_service.return_value.set_user_timezone.assert_not_called()
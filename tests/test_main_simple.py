@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, AsyncMock, patch
 from fastapi import status
 
 
@@ -33,10 +33,10 @@ class TestMainSimpleEndpoints:
         assert response.status_code == status.HTTP_307_TEMPORARY_REDIRECT
         assert "error=no_code" in response.headers["location"]
     
-    @patch('main.SpotifyClient')
+    @patch('main.AsyncSpotifyClient')
     def test_validate_token_invalid(self, mock_spotify_client, client):
         """Test token validation with invalid token"""
-        mock_client_instance = Mock()
+        mock_client_instance = AsyncMock()
         mock_client_instance.get_user_profile.side_effect = Exception("Invalid token")
         mock_spotify_client.return_value = mock_client_instance
         
@@ -83,10 +83,10 @@ class TestMainSimpleEndpoints:
         # Either returns 200 (if implemented) or 404 (if not implemented)
         assert response.status_code in [200, 404]
     
-    @patch('main.SpotifyClient')
+    @patch('main.AsyncSpotifyClient')
     def test_rate_limit_handling_in_validation(self, mock_spotify_client, client):
         """Test that rate limiting doesn't break token validation"""
-        mock_client_instance = Mock()
+        mock_client_instance = AsyncMock()
         # Simulate successful validation (rate limiting handled internally)
         mock_client_instance.get_user_profile.return_value = {"id": "user123"}
         mock_spotify_client.return_value = mock_client_instance
@@ -0,0 +1,120 @@
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from metadata_cache import TTLCache, MetadataCache, get_metadata_cache
+from models import SpotifyMetadata
+
+
+class TestTTLCache:
+
+    def test_get_and_set(self, fake_clock):
+        """Test basic hit/miss accounting"""
+        cache = TTLCache(ttl=60, max_size=10, clock=fake_clock)
+
+        assert cache.get("a") is None
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+
+        assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "evictions": 0, "expirations": 0}
+
+    def test_entries_expire(self, fake_clock):
+        """Test that entries older than the TTL are dropped"""
+        cache = TTLCache(ttl=60, max_size=10, clock=fake_clock)
+        cache.set("a", 1)
+
+        fake_clock.sleep(61)
+
+        assert cache.get("a") is None
+        assert cache.stats()["expirations"] == 1
+        assert len(cache) == 0
+
+    def test_lru_eviction(self, fake_clock):
+        """Test that the least recently used entry is evicted when full"""
+        cache = TTLCache(ttl=60, max_size=2, clock=fake_clock)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.stats()["evictions"] == 1
+
+
+class TestMetadataCache:
+
+    @pytest.fixture
+    def session_factory(self, test_engine):
+        """Session factory on the test database, cleaned after each test"""
+        factory = sessionmaker(bind=test_engine)
+        yield factory
+        db = factory()
+        db.query(SpotifyMetadata).delete()
+        db.commit()
+        db.close()
+
+    def test_memory_tier(self):
+        """Test objects are cached by type and ID"""
+        cache = MetadataCache(ttl=60, max_size=10)
+        cache.put_many("artist", [{"id": "a1", "name": "One"}, None, {"name": "no id"}])
+
+        assert cache.get_many("artist", ["a1", "a2"]) == {"a1": {"id": "a1", "name": "One"}}
+        assert cache.get_many("track", ["a1"]) == {}
+
+    def test_sql_tier_shared_between_processes(self, session_factory):
+        """Test that a second cache instance finds objects written by the first"""
+        writer = MetadataCache(ttl=60, max_size=10, session_factory=session_factory)
+        writer.put_many("artist", [{"id": "a1", "genres": ["rock"]}])
+
+        reader = MetadataCache(ttl=60, max_size=10, session_factory=session_factory)
+        found = reader.get_many("artist", ["a1", "a2"])
+
+        assert found == {"a1": {"id": "a1", "genres": ["rock"]}}
+        assert reader.stats()["sql"] == {"enabled": True, "hits": 1, "misses": 1}
+        # Promoted into memory, so the SQL tier is not asked again
+        reader.get_many("artist", ["a1"])
+        assert reader.stats()["sql"]["hits"] == 1
+        assert reader.stats()["memory"]["hits"] == 1
+
+    def test_sql_tier_overwrites_and_expires(self, session_factory):
+        """Test that rewrites update the row and stale rows are ignored"""
+        cache = MetadataCache(ttl=60, max_size=10, session_factory=session_factory)
+        cache.put_many("artist", [{"id": "a1", "popularity": 1}])
+        cache.put_many("artist", [{"id": "a1", "popularity": 2}])
+
+        db = session_factory()
+        row = db.query(SpotifyMetadata).filter_by(entity_type="artist", spotify_id="a1").one()
+        assert row.payload["popularity"] == 2
+        row.fetched_at = datetime.utcnow() - timedelta(seconds=120)
+        db.commit()
+        db.close()
+
+        reader = MetadataCache(ttl=60, max_size=10, session_factory=session_factory)
+        assert reader.get_many("artist", ["a1"]) == {}
+
+    def test_sql_tier_writes_a_batch_in_one_statement(self, session_factory, test_engine):
+        """Test that a batch is upserted with one executemany, not a merge per object"""
+        cache = MetadataCache(ttl=60, max_size=100, session_factory=session_factory)
+        cache.put_many("track", [{"id": "t1", "popularity": 1}])
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(test_engine, "before_cursor_execute", record)
+        try:
+            cache.put_many("track", [{"id": f"t{i}", "popularity": 2} for i in range(1, 51)])
+        finally:
+            event.remove(test_engine, "before_cursor_execute", record)
+
+        assert len(statements) == 1 and statements[0].startswith("INSERT")
+        db = session_factory()
+        assert db.query(SpotifyMetadata).filter_by(entity_type="track").count() == 50
+        assert db.query(SpotifyMetadata).filter_by(spotify_id="t1").one().payload["popularity"] == 2
+        db.close()
+
+    def test_get_metadata_cache_is_shared(self):
+        """Test the process-wide cache accessor"""
+        assert get_metadata_cache() is get_metadata_cache()
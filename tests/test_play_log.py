@@ -0,0 +1,326 @@
+import pytest
+import asyncio
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, patch
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from data_processor import SpotifyDataProcessor, ListeningAggregate
+from models import User, UserPlay, UserPlaySync, UserPlayDaily, UserPlaySketch
+from play_log import PlayLog, listening_summary, parse_played_at, format_played_at, to_ms
+
+USER = "play_log_user"
+
+
+def make_plays(count, start, step_minutes=3):
+    """Spotify-shaped plays, oldest first, starting at start"""
+    return [
+        {
+            "played_at": format_played_at(start + timedelta(minutes=i * step_minutes)),
+            "track": {"id": f"track_{i % 7}", "name": f"Track {i % 7}",
+                      "artists": [{"id": f"artist_{i % 3}", "name": f"Artist {i % 3}"}],
+                      "popularity": 50, "duration_ms": 180000}
+        }
+        for i in range(count)
+    ]
+
+
+class FakeClient:
+    """Async client stand-in serving recently-played pages after a cursor"""
+
+    def __init__(self, plays):
+        self.plays = plays
+        self.afters = []
+        self.get_all_recent_tracks = AsyncMock(return_value=plays)
+
+    async def iter_recent_track_pages(self, days_back=30, after=None):
+        self.afters.append(after)
+        newer = [play for play in self.plays
+                 if after is None or to_ms(parse_played_at(play["played_at"])) > after]
+        for i in range(0, len(newer), 50):
+            yield newer[i:i + 50]
+
+
+@pytest.fixture
+def play_db(test_engine):
+    """Session with a user whose play log is removed afterwards"""
+    db = sessionmaker(bind=test_engine)()
+    db.merge(User(spotify_user_id=USER, display_name="Play Log User"))
+    db.commit()
+
+    yield db
+
+    db.rollback()
+    for model in (UserPlay, UserPlaySync, UserPlayDaily, UserPlaySketch):
+        db.query(model).filter(model.user_id == USER).delete()
+    db.query(User).filter(User.spotify_user_id == USER).delete()
+    db.commit()
+    db.close()
+
+
+class TestPlayLog:
+
+    def test_played_at_round_trip(self):
+        """Test that stored timestamps are returned in Spotify's format with ms precision"""
+        value = "2024-01-15T10:30:00.123Z"
+
+        played_at = parse_played_at(value)
+
+        assert played_at == datetime(2024, 1, 15, 10, 30, 0, 123000)
+        assert format_played_at(played_at) == value
+        assert to_ms(played_at) == 1705314600123
+
+    def test_first_sync_stores_plays_and_high_water_mark(self, play_db):
+        """Test that a first sync walks the window and records the newest play"""
+        plays = make_plays(20, datetime.utcnow() - timedelta(hours=2))
+        client = FakeClient(plays)
+        log = PlayLog(play_db)
+
+        added = asyncio.run(log.sync(client, USER))
+
+        assert added == 20
+        assert client.afters == [None]
+        assert log.high_water_mark(USER) == to_ms(parse_played_at(plays[-1]["played_at"]))
+        assert play_db.query(UserPlay).filter_by(user_id=USER).count() == 20
+
+    def test_sync_fetches_only_newer_plays(self, play_db):
+        """Test that later syncs start after the high-water mark"""
+        start = datetime.utcnow() - timedelta(hours=5)
+        client = FakeClient(make_plays(10, start))
+        log = PlayLog(play_db)
+        asyncio.run(log.sync(client, USER))
+        high_water_mark = log.high_water_mark(USER)
+
+        client.plays = make_plays(15, start)
+        added = asyncio.run(log.sync(client, USER))
+
+        assert client.afters == [None, high_water_mark]
+        assert added == 5
+        assert asyncio.run(log.sync(client, USER)) == 0
+
+    def test_append_is_idempotent(self, play_db):
+        """Test that replaying the same plays does not duplicate rows"""
+        plays = make_plays(10, datetime.utcnow() - timedelta(hours=1))
+        log = PlayLog(play_db)
+
+        log.append(USER, plays)
+        play_db.query(UserPlaySync).filter_by(user_id=USER).delete()
+        play_db.commit()
+        log.append(USER, plays + plays)
+
+        assert play_db.query(UserPlay).filter_by(user_id=USER).count() == 10
+
+    def test_append_without_native_insert_ignore(self, play_db):
+        """Test the portable path for dialects without ON CONFLICT"""
+        plays = make_plays(10, datetime.utcnow() - timedelta(hours=1))
+        log = PlayLog(play_db)
+
+        with patch('play_log.insert_ignore_statement', return_value=None), \
+                patch('play_log.upsert_statement', return_value=None):
+            log.append(USER, plays[:6])
+            play_db.query(UserPlaySync).filter_by(user_id=USER).delete()
+            play_db.commit()
+            log.append(USER, plays)
+
+        assert play_db.query(UserPlay).filter_by(user_id=USER).count() == 10
+        assert log.high_water_mark(USER) == to_ms(parse_played_at(plays[-1]["played_at"]))
+        assert log.listening_aggregate(USER).total == 10
+        assert log.unique_counts(USER) == {"tracks": 7, "artists": 3}
+
+    def test_concurrent_appends_count_every_play_once(self, play_db, test_engine):
+        """Test that overlapping appends for one user, each in its own session, neither lose nor repeat counts"""
+        plays = make_plays(40, datetime.utcnow() - timedelta(hours=2))
+        factory = sessionmaker(bind=test_engine)
+        barrier = threading.Barrier(2)
+        errors = []
+
+        def append(batch):
+            db = factory()
+            try:
+                barrier.wait()
+                PlayLog(db).append(USER, batch)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.close()
+
+        threads = [threading.Thread(target=append, args=(batch,)) for batch in (plays[:25], plays)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        log = PlayLog(play_db)
+        assert errors == []
+        assert play_db.query(UserPlay).filter_by(user_id=USER).count() == 40
+        assert sum(count for count, in play_db.query(UserPlayDaily.play_count).filter_by(user_id=USER)) == 40
+        assert log.listening_aggregate(USER).tracks == Counter(play["track"]["id"] for play in plays)
+        assert log.unique_counts(USER) == {"tracks": 7, "artists": 3}
+
+    def test_history_grows_past_one_page(self, play_db):
+        """Test that successive syncs keep more than Spotify's last 50 plays"""
+        start = datetime.utcnow() - timedelta(days=3)
+        log = PlayLog(play_db)
+        for batch in range(3):
+            # Spotify only ever serves the latest 50 plays
+            plays = make_plays(50 * (batch + 1), start)[-50:]
+            asyncio.run(log.sync(FakeClient(plays), USER))
+
+        history = log.recent_plays(USER, days_back=30)
+
+        assert len(history) == 150
+        assert history[0]["played_at"] > history[-1]["played_at"]
+        assert SpotifyDataProcessor().process_listening_history(history)["total_tracks_played"] == 150
+
+    def test_recent_plays_respects_window(self, play_db):
+        """Test that stored plays older than days_back are left out"""
+        log = PlayLog(play_db)
+        log.append(USER, make_plays(5, datetime.utcnow() - timedelta(days=10)))
+        log.append(USER, make_plays(5, datetime.utcnow() - timedelta(days=1)))
+
+        assert len(log.recent_plays(USER, days_back=7)) == 5
+        assert len(log.recent_plays(USER, days_back=30)) == 10
+
+    def test_daily_counters_match_plays(self, play_db):
+        """Test that the window summary equals processing the plays themselves"""
+        log = PlayLog(play_db)
+        start = datetime.utcnow() - timedelta(days=2)
+        log.append(USER, make_plays(60, start, step_minutes=45))
+        processor = SpotifyDataProcessor()
+
+        summary = log.listening_aggregate(USER, days_back=30)
+        from_plays = processor.process_listening_history(log.recent_plays(USER, days_back=30))
+        from_summary = processor.process_listening_history(summary)
+
+        assert summary.total == 60
+        assert play_db.query(UserPlayDaily).filter_by(user_id=USER).count() >= 2
+        assert {k: v for k, v in from_summary.items() if k not in ("most_played_tracks", "top_artists")} == \
+            {k: v for k, v in from_plays.items() if k not in ("most_played_tracks", "top_artists")}
+        assert sorted(from_summary["most_played_tracks"]) == sorted(from_plays["most_played_tracks"])
+        assert sorted(from_summary["top_artists"]) == sorted(from_plays["top_artists"])
+
+    @pytest.mark.parametrize("timezone", ["Asia/Tokyo", "Asia/Kolkata", "America/New_York"])
+    def test_daily_counters_are_read_in_the_current_timezone(self, play_db, timezone):
+        """Test that plays logged under one timezone are bucketed in the reader's timezone"""
+        plays = make_plays(40, datetime.utcnow() - timedelta(days=1), step_minutes=31)
+        PlayLog(play_db).append(USER, plays)
+        processor = SpotifyDataProcessor(timezone)
+
+        from_summary = processor.process_listening_history(PlayLog(play_db, timezone).listening_aggregate(USER))
+        from_plays = processor.process_listening_history(plays)
+        in_utc = SpotifyDataProcessor().process_listening_history(PlayLog(play_db).listening_aggregate(USER))
+
+        assert from_summary["listening_by_hour"] == from_plays["listening_by_hour"]
+        assert from_summary["listening_by_day"] == from_plays["listening_by_day"]
+        assert in_utc["listening_by_hour"] == SpotifyDataProcessor().process_listening_history(plays)["listening_by_hour"]
+
+    @pytest.mark.parametrize("mode", ["exact", "approximate"])
+    def test_top_played_merges_days(self, play_db, mode):
+        """Test that top artists and tracks over several days match counting the plays"""
+        log = PlayLog(play_db)
+        plays = make_plays(90, datetime.utcnow() - timedelta(days=3), step_minutes=47)
+        log.append(USER, plays)
+
+        top_tracks = log.top_played(USER, 30, "tracks", k=3, mode=mode)
+        top_artists = log.top_played(USER, 30, "artists", k=3, mode=mode)
+
+        tracks = Counter(play["track"]["id"] for play in plays)
+        assert play_db.query(UserPlayDaily).filter_by(user_id=USER).count() >= 3
+        assert sorted(top_tracks) == sorted(tracks.most_common(3))
+        assert sorted(top_artists) == sorted(Counter(play["track"]["artists"][0]["name"] for play in plays).items())
+        with pytest.raises(ValueError):
+            log.top_played(USER, 30, "albums")
+
+    def test_unique_counts_from_daily_sketches(self, play_db):
+        """Test that distinct counts over a window union the per-day sketches"""
+        log = PlayLog(play_db)
+        plays = make_plays(120, datetime.utcnow() - timedelta(days=5), step_minutes=59)
+        for i, play in enumerate(plays):
+            play["track"] = dict(play["track"], id=f"track_{i % 40}")
+        log.append(USER, plays)
+
+        counts = log.unique_counts(USER, days_back=30)
+
+        assert play_db.query(UserPlaySketch).filter_by(user_id=USER, kind="tracks").count() >= 5
+        assert counts == {"tracks": 40, "artists": 3}
+        assert log.unique_counts("nobody", days_back=30) == {"tracks": 0, "artists": 0}
+
+    def test_daily_counters_skip_duplicates(self, play_db):
+        """Test that plays already stored are not counted twice"""
+        plays = make_plays(12, datetime.utcnow() - timedelta(hours=1))
+        log = PlayLog(play_db)
+
+        log.append(USER, plays[:10])
+        play_db.query(UserPlaySync).filter_by(user_id=USER).delete()
+        play_db.commit()
+        log.append(USER, plays)
+
+        assert log.listening_aggregate(USER).total == 12
+
+    def test_listening_aggregate_windows(self, play_db):
+        """Test that 7/30/90 day windows are answered from the daily sums"""
+        log = PlayLog(play_db)
+        now = datetime.utcnow()
+        for days_ago, count in ((60, 5), (20, 4), (1, 3)):
+            log.append(USER, make_plays(count, now - timedelta(days=days_ago)))
+
+        assert [log.listening_aggregate(USER, days).total for days in (7, 30, 90)] == [3, 7, 12]
+
+    def test_listening_summary_stores_new_user_first(self, play_db, test_engine):
+        """Test that a first-time user's profile is stored before their plays"""
+        client = FakeClient(make_plays(3, datetime.utcnow() - timedelta(hours=1)))
+        profile = {"id": "new_play_log_user", "display_name": "New"}
+
+        try:
+            summary = asyncio.run(listening_summary(client, profile["id"], 30, user_profile=profile,
+                                                    session_factory=sessionmaker(bind=test_engine)))
+
+            assert isinstance(summary, ListeningAggregate)
+            assert summary.total == 3
+            assert play_db.get(User, profile["id"]) is not None
+        finally:
+            for model in (UserPlay, UserPlaySync, UserPlayDaily, UserPlaySketch):
+                play_db.query(model).filter(model.user_id == profile["id"]).delete()
+            play_db.query(User).filter(User.spotify_user_id == profile["id"]).delete()
+            play_db.commit()
+
+    def test_listening_summary_falls_back_to_spotify(self, play_db, test_engine):
+        """Test that a database failure still returns the plays from Spotify"""
+        plays = make_plays(3, datetime.utcnow() - timedelta(hours=1))
+        client = FakeClient(plays)
+
+        with patch.object(PlayLog, "sync", side_effect=OperationalError("INSERT", {}, Exception("db down"))):
+            history = asyncio.run(listening_summary(client, USER, 30, session_factory=sessionmaker(bind=test_engine)))
+
+        assert history == plays
+        client.get_all_recent_tracks.assert_awaited_once_with(30)
+
+    def test_listening_summary_keeps_sql_off_the_loop(self, play_db, test_engine):
+        """Test that the summary uses its own session and never runs SQL on the event loop thread"""
+        client = FakeClient(make_plays(60, datetime.utcnow() - timedelta(hours=4)))
+        factory = sessionmaker(bind=test_engine)
+        sessions = []
+        sql_threads = set()
+
+        def session_factory():
+            db = factory()
+            sessions.append(db)
+            return db
+
+        def record_thread(*args):
+            sql_threads.add(threading.get_ident())
+
+        async def run():
+            return await listening_summary(client, USER, 30, session_factory=session_factory), threading.get_ident()
+
+        event.listen(test_engine, "before_cursor_execute", record_thread)
+        try:
+            summary, loop_thread = asyncio.run(run())
+        finally:
+            event.remove(test_engine, "before_cursor_execute", record_thread)
+
+        assert summary.total == 60
+        assert len(sessions) == 1 and sessions[0] is not play_db
+        assert sql_threads and loop_thread not in sql_threads
@@ -0,0 +1,136 @@
+import pytest
+import asyncio
+import threading
+from rate_limiter import (
+    TokenBucket, RequestScheduler, get_scheduler, parse_retry_after, INTERACTIVE, BACKGROUND
+)
+
+
+class TestTokenBucket:
+
+    def test_take_until_empty(self):
+        """Test that a full bucket allows a burst and then asks to wait"""
+        bucket = TokenBucket(rate=2, capacity=3)
+
+        assert [bucket.try_take(0) for _ in range(3)] == [0, 0, 0]
+        assert bucket.try_take(0) == pytest.approx(0.5)
+
+    def test_refill_over_time(self):
+        """Test that tokens refill at the configured rate up to capacity"""
+        bucket = TokenBucket(rate=2, capacity=3)
+        for _ in range(3):
+            bucket.try_take(0)
+
+        assert bucket.try_take(0.5) == 0
+        bucket.try_take(100)
+        assert bucket.tokens == 2
+
+    def test_min_level_reserve(self):
+        """Test that a reserve level keeps tokens back"""
+        bucket = TokenBucket(rate=1, capacity=4)
+
+        assert bucket.try_take(0, min_level=2) == 0
+        assert bucket.try_take(0, min_level=2) == 0
+        assert bucket.try_take(0, min_level=2) > 0
+        assert bucket.try_take(0) == 0
+
+
+class TestRequestScheduler:
+
+    def test_acquire_waits_for_tokens(self, fake_clock):
+        """Test that callers beyond the burst wait for refill"""
+        scheduler = RequestScheduler(rate=10, burst=2, clock=fake_clock, sleep=fake_clock.sleep)
+
+        for _ in range(3):
+            scheduler.acquire()
+
+        assert sum(fake_clock.sleeps) == pytest.approx(0.1)
+        assert scheduler.stats()["granted"] == 3
+
+    def test_rate_limit_sets_global_backoff(self, fake_clock):
+        """Test that a 429 on one request delays every other request"""
+        scheduler = RequestScheduler(jitter=0, clock=fake_clock, sleep=fake_clock.sleep)
+
+        assert scheduler.should_retry(0, 5) is True
+        scheduler.acquire(BACKGROUND)
+        scheduler.acquire(INTERACTIVE)
+
+        assert fake_clock.sleeps == [5]
+        assert scheduler.stats()["rate_limited"] == 1
+        assert scheduler.stats()["retries"] == 1
+
+    def test_backoff_is_jittered(self, fake_clock):
+        """Test that waiters spread out after a backoff instead of stampeding"""
+        scheduler = RequestScheduler(jitter=1, clock=fake_clock, sleep=fake_clock.sleep)
+        scheduler.should_retry(0, 2)
+
+        scheduler.acquire()
+
+        assert 2 <= fake_clock.sleeps[0] <= 3
+
+    def test_retry_budget_is_bounded(self, fake_clock):
+        """Test that should_retry refuses once max_retries is reached"""
+        scheduler = RequestScheduler(max_retries=2, clock=fake_clock)
+
+        assert scheduler.should_retry(0, 1) is True
+        assert scheduler.should_retry(1, 1) is True
+        assert scheduler.should_retry(2, 1) is False
+
+    def test_background_keeps_reserve_for_interactive(self, fake_clock):
+        """Test that background work cannot drain the bucket"""
+        scheduler = RequestScheduler(rate=1, burst=4, background_reserve=0.5,
+                                     clock=fake_clock, sleep=fake_clock.sleep)
+
+        scheduler.acquire(BACKGROUND)
+        scheduler.acquire(BACKGROUND)
+        assert fake_clock.sleeps == []
+        scheduler.acquire(BACKGROUND)
+        assert fake_clock.sleeps != []
+
+        fake_clock.sleeps.clear()
+        scheduler.acquire(INTERACTIVE)
+        assert fake_clock.sleeps == []
+
+    def test_background_yields_to_waiting_interactive(self, fake_clock):
+        """Test that background callers wait while interactive callers are queued"""
+        scheduler = RequestScheduler(clock=fake_clock, sleep=fake_clock.sleep)
+        scheduler._set_waiting(INTERACTIVE, 1)
+
+        assert scheduler._reserve(BACKGROUND) > 0
+        assert scheduler._reserve(INTERACTIVE) == 0
+
+    def test_acquire_async(self, fake_clock):
+        """Test the event-loop friendly acquire path"""
+        scheduler = RequestScheduler(jitter=0, clock=fake_clock, async_sleep=fake_clock.async_sleep)
+        scheduler.should_retry(0, 3)
+
+        asyncio.run(scheduler.acquire_async())
+
+        assert fake_clock.sleeps == [3]
+        assert scheduler.stats()["waiting"] == {INTERACTIVE: 0, BACKGROUND: 0}
+
+    def test_thread_safety(self):
+        """Test that concurrent acquires never over-grant tokens"""
+        scheduler = RequestScheduler(rate=1000, burst=50)
+
+        threads = [threading.Thread(target=scheduler.acquire) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert scheduler.stats()["granted"] == 20
+
+
+class TestSchedulerRegistry:
+
+    def test_get_scheduler_shared_per_client_id(self):
+        """Test that schedulers are shared per Spotify client id"""
+        assert get_scheduler("app_a") is get_scheduler("app_a")
+        assert get_scheduler("app_a") is not get_scheduler("app_b")
+
+    def test_parse_retry_after(self):
+        """Test Retry-After parsing with fallbacks"""
+        assert parse_retry_after({"Retry-After": "4"}) == 4
+        assert parse_retry_after({}) == 1
+        assert parse_retry_after({"Retry-After": "soon"}) == 1
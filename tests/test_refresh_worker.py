@@ -0,0 +1,220 @@
+import pytest
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import Mock, AsyncMock, patch
+from sqlalchemy.orm import sessionmaker
+from db_service import DatabaseService
+from models import User, UserToken, UserAnalysis, UserTopArtist, UserTopTrack, UserGenre, UserPlay, UserPlaySync, UserPlayDaily, UserPlaySketch, UserTrend
+from refresh_worker import RefreshWorker
+from single_flight import SingleFlight
+from spotify_auth import refresh_access_token, TokenRefreshError
+
+USERS = ("active_user", "inactive_user", "tokenless_user")
+
+
+@pytest.fixture
+def session_factory(test_engine):
+    """Session factory with an active, an inactive and a token-less user"""
+    factory = sessionmaker(bind=test_engine)
+    db = factory()
+    service = DatabaseService(db)
+    now = datetime.utcnow()
+    for user_id, last_login in (("active_user", now), ("inactive_user", now - timedelta(days=30)),
+                                ("tokenless_user", now)):
+        db.add(User(spotify_user_id=user_id, display_name=user_id, last_login_at=last_login))
+    db.add(UserToken(user_id="active_user", access_token=service.encrypt_token("access"),
+                     refresh_token=service.encrypt_token("refresh"), expires_at=now + timedelta(hours=1)))
+    db.add(UserToken(user_id="inactive_user", access_token=service.encrypt_token("access"),
+                     refresh_token=service.encrypt_token("refresh"), expires_at=now + timedelta(hours=1)))
+    db.commit()
+    db.close()
+
+    yield factory
+
+    db = factory()
+    for model in (UserTopArtist, UserTopTrack, UserGenre, UserTrend, UserAnalysis, UserToken, UserPlay, UserPlaySync,
+                  UserPlayDaily, UserPlaySketch):
+        db.query(model).filter(model.user_id.in_(USERS)).delete()
+    db.query(User).filter(User.spotify_user_id.in_(USERS)).delete()
+    db.commit()
+    db.close()
+
+
+class TestRefreshWorker:
+
+    def test_active_users(self, session_factory):
+        """Test that only recently active users with tokens are picked"""
+        worker = RefreshWorker(session_factory, active_days=7)
+
+        assert worker.active_users() == ["active_user"]
+
+    def test_valid_token_is_not_refreshed(self, session_factory):
+        """Test that a token far from expiry is used as-is"""
+        worker = RefreshWorker(session_factory)
+        db = session_factory()
+
+        with patch('refresh_worker.refresh_access_token') as mock_refresh:
+            token = asyncio.run(worker.ensure_access_token(DatabaseService(db), "active_user"))
+        db.close()
+
+        assert token == "access"
+        mock_refresh.assert_not_called()
+
+    def test_expiring_token_is_refreshed_and_stored(self, session_factory):
+        """Test that a token about to expire is refreshed ahead of time"""
+        worker = RefreshWorker(session_factory)
+        db = session_factory()
+        db.query(UserToken).filter_by(user_id="active_user").update(
+            {"expires_at": datetime.utcnow() + timedelta(seconds=60)})
+        db.commit()
+        service = DatabaseService(db)
+
+        with patch('refresh_worker.refresh_access_token', return_value={
+            "access_token": "new_access", "refresh_token": "refresh", "expires_in": 3600
+        }) as mock_refresh:
+            token = asyncio.run(worker.ensure_access_token(service, "active_user"))
+
+        assert token == "new_access"
+        mock_refresh.assert_called_once_with("refresh")
+        db.expire_all()
+        stored = service.get_user_tokens("active_user")
+        assert service.decrypt_token(stored.access_token) == "new_access"
+        assert stored.expires_at > datetime.utcnow() + timedelta(minutes=30)
+        db.close()
+
+    def test_run_once_stores_analyses(self, session_factory):
+        """Test that a pass analyses active users and stores the result"""
+        worker = RefreshWorker(session_factory, jitter=0, days_back=30)
+
+        with patch.object(RefreshWorker, "analyze", new_callable=AsyncMock) as mock_analyze:
+            mock_analyze.return_value = {"uniqueness_score": {"uniqueness_score": 0.5, "rating": "Unique"}}
+            stats = asyncio.run(worker.run_once())
+
+        assert stats == {"users": 1, "refreshed": 1, "skipped_or_failed": 0}
+        mock_analyze.assert_awaited_once()
+        access_token, user_id = mock_analyze.await_args.args
+        assert (access_token, user_id) == ("access", "active_user")
+        db = session_factory()
+        analysis = db.query(UserAnalysis).filter_by(user_id="active_user").one()
+        assert analysis.days_back == 30
+        db.close()
+
+    def test_run_once_bounds_concurrency(self):
+        """Test that at most concurrency users are refreshed at once"""
+        worker = RefreshWorker(Mock(), concurrency=2, jitter=0)
+        in_flight = []
+        peak = []
+
+        async def refresh(user_id):
+            in_flight.append(user_id)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(user_id)
+            return user_id != "u2"
+
+        with patch.object(worker, "active_users", return_value=["u1", "u2", "u3", "u4"]), \
+                patch.object(worker, "refresh_user", side_effect=refresh):
+            stats = asyncio.run(worker.run_once())
+
+        assert max(peak) == 2
+        assert stats == {"users": 4, "refreshed": 3, "skipped_or_failed": 1}
+
+    def test_run_once_jitters_before_taking_a_slot(self):
+        """Test that every user's random delay is waited out outside the concurrency limit"""
+        events = []
+
+        async def fake_sleep(seconds):
+            events.append(("sleep", seconds))
+            await asyncio.sleep(0)
+
+        async def refresh(user_id):
+            events.append(("refresh", user_id))
+            await asyncio.sleep(0)
+            return True
+
+        worker = RefreshWorker(Mock(), concurrency=1, jitter=10, sleep=fake_sleep)
+
+        with patch.object(worker, "active_users", return_value=["u1", "u2", "u3"]), \
+                patch.object(worker, "refresh_user", side_effect=refresh):
+            asyncio.run(worker.run_once())
+
+        assert [kind for kind, _ in events[:3]] == ["sleep"] * 3
+        assert all(0 <= seconds <= 10 for kind, seconds in events if kind == "sleep")
+        assert [value for kind, value in events if kind == "refresh"] == ["u1", "u2", "u3"]
+
+    def test_refresh_shares_run_with_interactive_request(self, session_factory):
+        """Test that a precompute overlapping an API request for the same analysis runs it once"""
+        import main
+        worker = RefreshWorker(session_factory, jitter=0, days_back=30)
+        flight = SingleFlight()
+        computed = {"uniqueness_score": {"uniqueness_score": 0.5, "rating": "Unique"}}
+
+        async def analyze(*args, **kwargs):
+            await asyncio.sleep(0.01)
+            return computed
+
+        async def scenario():
+            refreshed = asyncio.create_task(worker.refresh_user("active_user"))
+            await asyncio.sleep(0)
+            served = await main._load_or_run_analysis(None, None, {"id": "active_user"}, 30, 0)
+            return await refreshed, served
+
+        with patch.object(RefreshWorker, "analyze", side_effect=analyze) as mock_analyze, \
+                patch('main._run_analysis', new_callable=AsyncMock) as mock_run, \
+                patch('main.get_analysis_flight', return_value=flight), \
+                patch('refresh_worker.get_analysis_flight', return_value=flight):
+            refreshed, served = asyncio.run(scenario())
+
+        assert refreshed is True
+        assert served == (computed, "MISS")
+        assert mock_analyze.call_count == 1
+        mock_run.assert_not_called()
+        db = session_factory()
+        assert db.query(UserAnalysis).filter_by(user_id="active_user").count() == 1
+        db.close()
+
+    def test_refresh_user_survives_errors(self, session_factory):
+        """Test that failures and missing tokens are contained"""
+        worker = RefreshWorker(session_factory, jitter=0)
+
+        with patch.object(RefreshWorker, "analyze", new_callable=AsyncMock, side_effect=Exception("Spotify down")):
+            assert asyncio.run(worker.refresh_user("active_user")) is False
+        assert asyncio.run(worker.refresh_user("tokenless_user")) is False
+
+    def test_start_and_stop(self):
+        """Test that the in-process task can be started and cancelled"""
+        worker = RefreshWorker(Mock(), interval=3600, jitter=0)
+
+        async def scenario():
+            with patch.object(worker, "run_once", new_callable=AsyncMock) as mock_run_once:
+                worker.start()
+                await asyncio.sleep(0)
+                await asyncio.sleep(0)
+                await worker.stop()
+                return mock_run_once.await_count
+
+        assert asyncio.run(scenario()) == 1
+
+
+class TestRefreshAccessToken:
+
+    @patch('spotify_auth.get_session')
+    def test_refresh(self, mock_get_session):
+        """Test that the old refresh token is kept when Spotify does not rotate it"""
+        mock_get_session.return_value.post.return_value = Mock(
+            status_code=200, json=Mock(return_value={"access_token": "new", "expires_in": 1800}))
+
+        result = refresh_access_token("old_refresh")
+
+        assert result == {"access_token": "new", "expires_in": 1800, "refresh_token": "old_refresh"}
+        _, kwargs = mock_get_session.return_value.post.call_args
+        assert kwargs["data"] == {"grant_type": "refresh_token", "refresh_token": "old_refresh"}
+        assert kwargs["headers"]["Authorization"].startswith("Basic ")
+
+    @patch('spotify_auth.get_session')
+    def test_refresh_rejected(self, mock_get_session):
+        """Test that a rejected refresh token raises"""
+        mock_get_session.return_value.post.return_value = Mock(status_code=400)
+
+        with pytest.raises(TokenRefreshError):
+            refresh_access_token("revoked")
@@ -0,0 +1,167 @@
+import pytest
+import asyncio
+from contextlib import asynccontextmanager
+from unittest.mock import Mock, AsyncMock, patch
+from single_flight import SingleFlight, AdvisoryLockBackend, advisory_lock_id
+import main
+
+
+class SharedLockBackend:
+    """Lock backend shared by several SingleFlight groups, like workers sharing a database"""
+
+    def __init__(self):
+        self.locks = {}
+        self.acquired = []
+
+    @asynccontextmanager
+    async def lock(self, key):
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            self.acquired.append(key)
+            yield
+
+
+class TestSingleFlight:
+
+    def test_concurrent_calls_share_one_run(self):
+        """Test that identical concurrent calls await a single computation"""
+        flight = SingleFlight()
+        runs = []
+
+        async def work():
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            return {"analysis": 1}
+
+        async def scenario():
+            return await asyncio.gather(*(flight.do(("user123", 30), work) for _ in range(5)))
+
+        results = asyncio.run(scenario())
+
+        assert runs == [1]
+        assert all(result == {"analysis": 1} for result in results)
+        assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 4, "backend": "local"}
+
+    def test_different_keys_run_separately(self):
+        """Test that other users or parameters are not deduplicated"""
+        flight = SingleFlight()
+        runs = []
+
+        async def work(key):
+            runs.append(key)
+            await asyncio.sleep(0.01)
+            return key
+
+        async def scenario():
+            keys = [("user123", 30), ("user123", 7), ("other", 30)]
+            return await asyncio.gather(*(flight.do(key, lambda key=key: work(key)) for key in keys))
+
+        results = asyncio.run(scenario())
+
+        assert sorted(runs) == sorted(results)
+        assert len(runs) == 3
+
+    def test_errors_reach_every_caller_and_release_the_key(self):
+        """Test that a failure is shared and the next call runs again"""
+        flight = SingleFlight()
+        work = AsyncMock(side_effect=[Exception("Spotify down"), "ok"])
+
+        async def slow_failure():
+            await asyncio.sleep(0.01)
+            return await work()
+
+        async def scenario():
+            results = await asyncio.gather(flight.do("key", slow_failure), flight.do("key", slow_failure),
+                                           return_exceptions=True)
+            return results, await flight.do("key", slow_failure)
+
+        (first, second), retry = asyncio.run(scenario())
+
+        assert str(first) == str(second) == "Spotify down"
+        assert retry == "ok"
+        assert work.await_count == 2
+
+    def test_sequential_calls_are_not_cached(self):
+        """Test that only overlapping calls are collapsed"""
+        flight = SingleFlight()
+        work = AsyncMock(side_effect=[1, 2])
+
+        async def scenario():
+            return await flight.do("key", work), await flight.do("key", work)
+
+        assert asyncio.run(scenario()) == (1, 2)
+
+    def test_lock_backend_serialises_workers(self):
+        """Test that two workers sharing a lock backend let the second reuse the first result"""
+        backend = SharedLockBackend()
+        workers = [SingleFlight(backend), SingleFlight(backend)]
+        stored = {}
+        computed = []
+
+        async def load_or_compute():
+            if "analysis" in stored:
+                return stored["analysis"]
+            await asyncio.sleep(0.01)
+            computed.append(1)
+            stored["analysis"] = "fresh"
+            return "fresh"
+
+        async def scenario():
+            return await asyncio.gather(*(worker.do("key", load_or_compute) for worker in workers))
+
+        assert asyncio.run(scenario()) == ["fresh", "fresh"]
+        assert computed == [1]
+        assert backend.acquired == ["key", "key"]
+
+    def test_advisory_lock_id(self):
+        """Test that lock IDs are stable and fit a PostgreSQL bigint"""
+        lock_id = advisory_lock_id(("analysis", "user123", 30, 3600))
+
+        assert lock_id == advisory_lock_id(("analysis", "user123", 30, 3600))
+        assert lock_id != advisory_lock_id(("analysis", "user123", 7, 3600))
+        assert -2 ** 63 <= lock_id < 2 ** 63
+
+    def test_advisory_lock_times_out(self):
+        """Test that a lock held elsewhere eventually raises"""
+        engine = Mock()
+        backend = AdvisoryLockBackend(engine, timeout=0.05, poll_interval=0.01)
+
+        async def scenario():
+            async with backend.lock("key"):
+                pass
+
+        with patch.object(AdvisoryLockBackend, "_try_lock", return_value=False):
+            with pytest.raises(TimeoutError):
+                asyncio.run(scenario())
+
+        engine.connect.return_value.close.assert_called_once()
+
+
+class TestAnalysisDeduplication:
+
+    @patch('main.DatabaseService')
+    @patch('main._run_analysis')
+    def test_concurrent_analyses_run_once(self, mock_run, mock_db_service):
+        """Test that overlapping analysis requests for a user share one pipeline run"""
+        mock_db_service.return_value.get_stored_analysis_response.return_value = None
+        calls = []
+
+        async def run_analysis(*args):
+            calls.append(args)
+            await asyncio.sleep(0.01)
+            return {"version": 1}
+
+        mock_run.side_effect = run_analysis
+
+        async def scenario():
+            profile = {"id": "user123"}
+            return await asyncio.gather(
+                main._load_or_run_analysis(None, None, profile, 30, 3600),
+                main._load_or_run_analysis(None, None, profile, 30, 3600)
+            )
+
+        with patch('main.get_analysis_flight', return_value=SingleFlight()):
+            results = asyncio.run(scenario())
+
+        assert results == [({"version": 1}, "MISS"), ({"version": 1}, "MISS")]
+        assert len(calls) == 1
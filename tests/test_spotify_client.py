@@ -2,7 +2,10 @@ import pytest
 from unittest.mock import Mock, patch, MagicMock
 import requests
 import time
-from spotify_client import SpotifyClient
+from spotify_client import SpotifyClient, RecentTracksPager
+from rate_limiter import RequestScheduler
+from metadata_cache import MetadataCache
+from http_session import HTTP_TIMEOUT
 
 
 class TestSpotifyClient:
@@ -18,9 +21,10 @@ class TestSpotifyClient:
         assert client.base_url == "https://api.spotify.com/v1"
         assert client.headers == {"Authorization": "Bearer test_access_token"}
     
-    @patch('spotify_client.requests.get')
-    def test_make_request_success(self, mock_get, client):
+    @patch('spotify_client.get_session')
+    def test_make_request_success(self, mock_get_session, client):
         """Test successful API request"""
+        mock_get = mock_get_session.return_value.get
         # Mock successful response
         mock_response = Mock()
         mock_response.status_code = 200
@@ -33,12 +37,14 @@ class TestSpotifyClient:
         mock_get.assert_called_once_with(
             "https://api.spotify.com/v1/me",
             headers={"Authorization": "Bearer test_access_token"},
-            params=None
+            params=None,
+            timeout=HTTP_TIMEOUT
         )
     
-    @patch('spotify_client.requests.get')
-    def test_make_request_with_params(self, mock_get, client):
+    @patch('spotify_client.get_session')
+    def test_make_request_with_params(self, mock_get_session, client):
         """Test API request with parameters"""
+        mock_get = mock_get_session.return_value.get
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.json.return_value = {"items": []}
@@ -51,13 +57,16 @@ class TestSpotifyClient:
         mock_get.assert_called_once_with(
             "https://api.spotify.com/v1/me/top/artists",
             headers={"Authorization": "Bearer test_access_token"},
-            params=params
+            params=params,
+            timeout=HTTP_TIMEOUT
         )
     
-    @patch('spotify_client.time.sleep')
-    @patch('spotify_client.requests.get')
-    def test_make_request_rate_limit_retry(self, mock_get, mock_sleep, client):
-        """Test rate limit handling with retry"""
+    @patch('spotify_client.get_session')
+    def test_make_request_rate_limit_retry(self, mock_get_session, fake_clock):
+        """Test rate limit handling waits out Retry-After through the scheduler"""
+        scheduler = RequestScheduler(jitter=0, clock=fake_clock, sleep=fake_clock.sleep)
+        client = SpotifyClient("test_access_token", scheduler=scheduler)
+        mock_get = mock_get_session.return_value.get
         # First call returns 429, second call succeeds
         rate_limit_response = Mock()
         rate_limit_response.status_code = 429
@@ -74,11 +83,34 @@ class TestSpotifyClient:
         
         assert result == {"success": True}
         assert mock_get.call_count == 2
-        mock_sleep.assert_called_once_with(2)
+        assert fake_clock.sleeps == [2]
     
-    @patch('spotify_client.requests.get')
-    def test_make_request_http_error(self, mock_get, client):
+    @patch('spotify_client.get_session')
+    def test_make_request_rate_limit_gives_up(self, mock_get_session, fake_clock):
+        """Test that persistent 429s raise after the retry budget is spent"""
+        scheduler = RequestScheduler(max_retries=2, jitter=0, clock=fake_clock, sleep=fake_clock.sleep)
+        client = SpotifyClient("test_access_token", scheduler=scheduler)
+        rate_limit_response = Mock()
+        rate_limit_response.status_code = 429
+        rate_limit_response.headers = {"Retry-After": "1"}
+        rate_limit_response.raise_for_status.side_effect = requests.exceptions.HTTPError()
+        mock_get_session.return_value.get.return_value = rate_limit_response
+        
+        with pytest.raises(requests.exceptions.HTTPError):
+            client._make_request("me")
+        
+        assert mock_get_session.return_value.get.call_count == 3
+    
+    def test_background_priority(self):
+        """Test that clients can be placed in the background lane"""
+        client = SpotifyClient("test_access_token", priority="background")
+        
+        assert client.priority == "background"
+    
+    @patch('spotify_client.get_session')
+    def test_make_request_http_error(self, mock_get_session, client):
         """Test handling of HTTP errors (non-429)"""
+        mock_get = mock_get_session.return_value.get
         mock_response = Mock()
         mock_response.status_code = 401
         mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError()
@@ -195,4 +227,197 @@ class TestSpotifyClient:
     def test_headers_format(self, client):
         """Test that authorization headers are properly formatted"""
         expected_headers = {"Authorization": "Bearer test_access_token"}
-        assert client.headers == expected_headers
\ No newline at end of file
+        assert client.headers == expected_headers
+
+class TestRecentTracksPaging:
+    
+    @pytest.fixture
+    def client(self):
+        """Create a SpotifyClient instance for testing"""
+        return SpotifyClient("test_access_token")
+    
+    @staticmethod
+    def play(track_id, played_at):
+        return {"track": {"id": track_id}, "played_at": played_at}
+    
+    @patch.object(SpotifyClient, '_make_request')
+    def test_pages_follow_spotify_cursors(self, mock_make_request, client):
+        """Test that the after cursor from the response is used for the next page"""
+        mock_make_request.side_effect = [
+            {"items": [self.play("t1", "2024-01-01T12:00:00Z")], "cursors": {"after": "1704110400000"}},
+            {"items": [self.play("t2", "2024-01-01T13:00:00Z")], "cursors": {"after": "1704114000000"}},
+            {"items": [], "cursors": None},
+        ]
+        
+        pages = list(client.iter_recent_track_pages(after=1))
+        
+        assert [[p["track"]["id"] for p in page] for page in pages] == [["t1"], ["t2"]]
+        assert mock_make_request.call_args_list[1][0][1] == {"limit": 50, "after": 1704110400000}
+        assert mock_make_request.call_args_list[2][0][1] == {"limit": 50, "after": 1704114000000}
+    
+    @patch.object(SpotifyClient, '_make_request')
+    def test_pages_fall_back_to_newest_played_at(self, mock_make_request, client):
+        """Test the cursor is derived from the newest play when Spotify sends none"""
+        mock_make_request.side_effect = [
+            {"items": [self.play("t2", "2024-01-01T13:00:00Z"), self.play("t1", "2024-01-01T12:00:00Z")]},
+            {"items": []},
+        ]
+        
+        pages = list(client.iter_recent_track_pages(after=1))
+        
+        assert len(pages[0]) == 2
+        assert [p["played_at_ms"] for p in pages[0]] == [1704114000000, 1704110400000]
+        assert mock_make_request.call_args_list[1][0][1]["after"] == 1704114000000
+    
+    @patch.object(SpotifyClient, '_make_request')
+    def test_overlapping_items_are_deduplicated(self, mock_make_request, client):
+        """Test that a play repeated at a page boundary is yielded once"""
+        mock_make_request.side_effect = [
+            {"items": [self.play("t1", "2024-01-01T12:00:00Z")], "cursors": {"after": "1704110400000"}},
+            {"items": [self.play("t1", "2024-01-01T12:00:00Z"), self.play("t2", "2024-01-01T13:00:00Z")],
+             "cursors": {"after": "1704114000000"}},
+            {"items": [self.play("t2", "2024-01-01T13:00:00Z")], "cursors": {"after": "1704114000000"}},
+        ]
+        
+        tracks = [play for page in client.iter_recent_track_pages(after=1) for play in page]
+        
+        assert [t["track"]["id"] for t in tracks] == ["t1", "t2"]
+        assert mock_make_request.call_count == 3
+    
+    @patch.object(SpotifyClient, '_make_request')
+    def test_deduplication_keeps_only_last_page(self, mock_make_request, client):
+        """Test that boundary deduplication does not remember every play of a long walk"""
+        mock_make_request.side_effect = [
+            {"items": [self.play(f"t{page}{i}", f"2024-01-0{page}T12:00:0{i}Z") for i in range(5)],
+             "cursors": {"after": str(1704110400000 + page)}}
+            for page in range(1, 8)
+        ] + [{"items": []}]
+        pager = RecentTracksPager(after=1)
+        
+        for _ in range(7):
+            pager.consume(client._make_request("me/player/recently-played", pager.params()))
+        
+        assert pager.count == 35
+        assert len(pager._seen) == 5
+    
+    @patch.object(SpotifyClient, '_make_request')
+    def test_max_items_budget(self, mock_make_request, client):
+        """Test that paging stops once the item budget is reached"""
+        mock_make_request.side_effect = [
+            {"items": [self.play(f"t{page}{i}", f"2024-01-01T1{page}:00:0{i}Z") for i in range(3)],
+             "cursors": {"after": str(1704110400000 + page)}}
+            for page in range(1, 4)
+        ]
+        
+        pages = list(client.iter_recent_track_pages(after=1, max_items=4))
+        
+        assert [len(page) for page in pages] == [3, 1]
+        assert mock_make_request.call_count == 2
+    
+    @patch('spotify_client.time.monotonic')
+    @patch.object(SpotifyClient, '_make_request')
+    def test_deadline_budget(self, mock_make_request, mock_monotonic, client):
+        """Test that no page is requested after the deadline has passed"""
+        mock_monotonic.side_effect = [0, 1, 10]
+        mock_make_request.side_effect = [
+            {"items": [self.play("t1", "2024-01-01T12:00:00Z")], "cursors": {"after": "1704110400000"}},
+            {"items": [self.play("t2", "2024-01-01T13:00:00Z")], "cursors": {"after": "1704114000000"}},
+        ]
+        
+        pages = list(client.iter_recent_track_pages(after=1, deadline=5))
+        
+        assert [[t["track"]["id"] for t in page] for page in pages] == [["t1"]]
+        assert mock_make_request.call_count == 1
+    
+    @patch.object(SpotifyClient, '_make_request')
+    def test_null_next_ends_paging(self, mock_make_request, client):
+        """Test that an explicit null next link stops the walk"""
+        mock_make_request.return_value = {
+            "items": [self.play("t1", "2024-01-01T12:00:00Z")],
+            "cursors": {"after": "1704110400000"},
+            "next": None
+        }
+        
+        pages = list(client.iter_recent_track_pages(7))
+        
+        assert len(pages) == 1
+        assert mock_make_request.call_count == 1
+
+
+class TestArtistDetails:
+    
+    @pytest.fixture
+    def client(self):
+        """Create a SpotifyClient instance for testing"""
+        return SpotifyClient("test_access_token", metadata_cache=MetadataCache())
+    
+    @staticmethod
+    def artists_response(endpoint, params):
+        """Echo back an artist object per requested ID, None for unknown ones"""
+        ids = params["ids"].split(",")
+        return {"artists": [None if i.startswith("unknown") else {"id": i, "name": i.upper()} for i in ids]}
+    
+    def test_empty_ids(self, client):
+        """Test that no request is made for an empty ID list"""
+        assert client.get_artist_details([]) == []
+    
+    @patch.object(SpotifyClient, '_make_request')
+    def test_results_follow_input_order_with_placeholders(self, mock_make_request, client):
+        """Test results line up with the input, including duplicates and unknown IDs"""
+        mock_make_request.side_effect = self.artists_response
+        
+        result = client.get_artist_details(["a2", "unknown1", "a1", "a2"])
+        
+        assert [a and a["id"] for a in result] == ["a2", None, "a1", "a2"]
+        mock_make_request.assert_called_once_with("artists", {"ids": "a2,unknown1,a1"})
+    
+    @patch.object(SpotifyClient, '_make_request')
+    def test_duplicates_removed_before_chunking(self, mock_make_request, client):
+        """Test that duplicate IDs do not cost extra chunks"""
+        mock_make_request.side_effect = self.artists_response
+        ids = [f"a{i}" for i in range(50)] * 3
+        
+        result = client.get_artist_details(ids)
+        
+        assert mock_make_request.call_count == 1
+        assert len(result) == 150
+    
+    @patch.object(SpotifyClient, '_make_request')
+    def test_chunks_fetched_concurrently(self, mock_make_request, client):
+        """Test that chunks overlap instead of running back to back"""
+        import threading
+        lock = threading.Lock()
+        state = {"in_flight": 0, "max_in_flight": 0}
+        
+        def slow_response(endpoint, params):
+            with lock:
+                state["in_flight"] += 1
+                state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+            time.sleep(0.05)
+            with lock:
+                state["in_flight"] -= 1
+            return self.artists_response(endpoint, params)
+        
+        mock_make_request.side_effect = slow_response
+        ids = [f"a{i}" for i in range(200)]
+        
+        result = client.get_artist_details(ids)
+        
+        assert mock_make_request.call_count == 4
+        assert state["max_in_flight"] > 1
+        assert [a["id"] for a in result] == ids
+    
+    @patch.object(SpotifyClient, '_make_request')
+    def test_cached_artists_not_refetched(self, mock_make_request, client):
+        """Test that artists in the metadata cache skip the API call"""
+        mock_make_request.side_effect = self.artists_response
+        client.metadata_cache.put_many("artist", [{"id": "a1", "name": "Cached"}])
+        
+        result = client.get_artist_details(["a1", "a2"])
+        
+        assert [a["name"] for a in result] == ["Cached", "A2"]
+        mock_make_request.assert_called_once_with("artists", {"ids": "a2"})
+        
+        mock_make_request.reset_mock()
+        client.get_artist_details(["a2", "a1"])
+        mock_make_request.assert_not_called()
@@ -0,0 +1,139 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+
+from data_processor import SpotifyDataProcessor, ListeningAggregate
+from timeutils import (PLAYED_AT_MS, WEEKDAY_NAMES, TimeBuckets, normalize_plays, parse_played_at_ms,
+                       played_at_ms, resolve_timezone)
+
+
+def play(played_at, track_id="t1"):
+    return {"played_at": played_at, "track": {"id": track_id, "artists": [{"id": "a1", "name": "Artist"}]}}
+
+
+class TestParsing:
+
+    def test_parse_is_exact_to_the_millisecond(self):
+        """Test that ms values are exact, including ones float timestamps round wrongly"""
+        assert parse_played_at_ms("2024-01-15T10:30:00.123Z") == 1705314600123
+        assert parse_played_at_ms("2024-01-15T10:30:00.123") == 1705314600123
+        assert parse_played_at_ms("2024-01-15T12:30:00.123+02:00") == 1705314600123
+        for ms in range(1705314600000, 1705314601000):
+            value = datetime.fromtimestamp(ms // 1000, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+            assert parse_played_at_ms(f"{value}.{ms % 1000:03d}Z") == ms
+
+    def test_played_at_ms_is_parsed_once(self):
+        """Test that the parsed value is kept on the play and reused"""
+        item = play("2024-01-15T10:30:00.000Z")
+
+        assert played_at_ms(item) == 1705314600000
+        item["played_at"] = "not a timestamp"
+        assert played_at_ms(item) == 1705314600000
+
+    def test_normalize_plays(self):
+        """Test that plays without a played_at are left alone"""
+        plays = normalize_plays([play("2024-01-15T10:30:00Z"), {"track": None}])
+
+        assert plays[0][PLAYED_AT_MS] == 1705314600000
+        assert PLAYED_AT_MS not in plays[1]
+
+
+class TestTimeBuckets:
+
+    def test_utc(self):
+        """Test that no timezone buckets in UTC, matching datetime"""
+        buckets = TimeBuckets()
+        ms = parse_played_at_ms("2024-01-15T23:30:00Z")
+
+        assert buckets.hour(ms) == 23
+        assert buckets.weekday_name(ms) == "Monday"
+        assert WEEKDAY_NAMES[datetime(2024, 1, 15).weekday()] == "Monday"
+
+    def test_local_hour_crosses_midnight(self):
+        """Test that a late UTC play lands on the next local day east of UTC"""
+        buckets = TimeBuckets("Europe/Berlin")
+        ms = parse_played_at_ms("2024-01-15T23:30:00Z")
+
+        assert buckets.hour_and_weekday(ms) == (0, 1)
+
+    @pytest.mark.parametrize("tz", ["Europe/Berlin", "America/Los_Angeles", "Asia/Kolkata", "Australia/Lord_Howe"])
+    def test_matches_zoneinfo_across_dst(self, tz):
+        """Test every half hour around both DST changes against datetime.astimezone"""
+        buckets = TimeBuckets(tz)
+        zone = resolve_timezone(tz)
+        for start in ("2024-03-09T00:00:00Z", "2024-10-26T00:00:00Z", "2024-04-06T00:00:00Z"):
+            first = parse_played_at_ms(start)
+            for step in range(0, 4 * 48):
+                ms = first + step * 30 * 60 * 1000
+                local = datetime.fromtimestamp(ms / 1000, tz=timezone.utc).astimezone(zone)
+                assert buckets.hour_and_weekday(ms) == (local.hour, local.weekday()), (tz, ms)
+
+    @pytest.mark.parametrize("tz, start", [
+        ("America/St_Johns", "2024-03-10T05:00:00Z"),
+        ("America/St_Johns", "2024-11-03T04:00:00Z"),
+        ("Australia/Lord_Howe", "2024-04-06T15:00:00Z"),
+        ("Australia/Lord_Howe", "2024-10-05T15:00:00Z"),
+        ("Africa/Monrovia", "1972-01-07T00:30:00Z"),
+    ])
+    def test_offset_changes_off_the_hour(self, tz, start):
+        """Test every minute around offset changes that are not on a whole UTC hour"""
+        buckets = TimeBuckets(tz)
+        zone = resolve_timezone(tz)
+        first = parse_played_at_ms(start)
+        for step in range(0, 60 * 60 + 1, 30):
+            ms = first + step * 1000
+            local = datetime.fromtimestamp(ms / 1000, tz=timezone.utc).astimezone(zone)
+            assert buckets.offset_ms(ms) == local.utcoffset() // timedelta(milliseconds=1), (tz, ms)
+            assert buckets.hour_and_weekday(ms) == (local.hour, local.weekday()), (tz, ms)
+
+    def test_unknown_timezone(self):
+        """Test that unknown names are rejected and UTC needs no zone"""
+        with pytest.raises(ValueError):
+            TimeBuckets("Mars/Olympus_Mons")
+        assert resolve_timezone("UTC") is None
+        assert resolve_timezone(None) is None
+
+
+class TestProcessorTimezone:
+
+    def test_listening_history_in_user_timezone(self):
+        """Test that hour and weekday stats follow the processor's timezone"""
+        plays = [play("2024-01-15T23:30:00Z"), play("2024-01-16T07:00:00Z")]
+
+        utc = SpotifyDataProcessor().process_listening_history(plays)
+        berlin = SpotifyDataProcessor("Europe/Berlin").process_listening_history(plays)
+
+        assert utc["listening_by_hour"] == {23: 1, 7: 1}
+        assert utc["listening_by_day"] == {"Monday": 1, "Tuesday": 1}
+        assert berlin["listening_by_hour"] == {0: 1, 8: 1}
+        assert berlin["listening_by_day"] == {"Tuesday": 2}
+
+    def test_aggregate_from_plays_uses_buckets(self):
+        """Test that aggregates built with buckets match the processor"""
+        plays = [play("2024-07-01T03:15:00Z"), play("2024-07-01T22:45:00Z", "t2")]
+        processor = SpotifyDataProcessor("America/Los_Angeles")
+
+        aggregate = ListeningAggregate.from_plays(plays, processor.buckets)
+
+        assert processor.process_listening_history(aggregate) == processor.process_listening_history(plays)
+
+    def test_columnar_matches_in_timezone(self):
+        """Test that the columnar engine buckets in the same timezone"""
+        pytest.importorskip("numpy")
+        from columnar_processor import ColumnarDataProcessor
+        plays = normalize_plays(play(f"2024-03-{day:02d}T{hour:02d}:20:00Z", f"t{hour}")
+                                for day in range(8, 12) for hour in range(24))
+
+        for tz in ("America/Los_Angeles", "Europe/Berlin"):
+            assert ColumnarDataProcessor(tz).process_listening_history(plays) == \
+                SpotifyDataProcessor(tz).process_listening_history(plays)
+
+    def test_columnar_matches_inside_a_changing_quarter(self):
+        """Test the columnar per-play fallback when the offset changes mid-quarter"""
+        pytest.importorskip("numpy")
+        from columnar_processor import ColumnarDataProcessor
+        # Africa/Monrovia moved from -00:44:30 to UTC at 00:44:30 UTC
+        plays = normalize_plays(play(f"1972-01-07T00:{minute:02d}:{second:02d}Z", f"t{minute}")
+                                for minute in range(30, 60) for second in (0, 30))
+
+        assert ColumnarDataProcessor("Africa/Monrovia").process_listening_history(plays) == \
+            SpotifyDataProcessor("Africa/Monrovia").process_listening_history(plays)
@@ -0,0 +1,96 @@
+import pytest
+import json
+import random
+from collections import Counter
+
+from topk import ApproximateTopK, ExactTopK, create_top_k, load_top_k, top_items
+
+
+def zipf_items(count, distinct=5000, seed=3):
+    """Skewed item stream, like plays of a long history"""
+    rng = random.Random(seed)
+    return [f"item_{int(rng.paretovariate(1.1)) % distinct}" for _ in range(count)]
+
+
+class TestExactTopK:
+
+    def test_matches_most_common(self):
+        """Test that the heap gives Counter.most_common, tie order included"""
+        items = zipf_items(5000) + ["tie_a", "tie_b"] * 3
+
+        assert ExactTopK(10).update(items).top() == Counter(items).most_common(10)
+        assert top_items(Counter(items), 25, "exact") == Counter(items).most_common(25)
+
+    def test_merge_and_round_trip(self):
+        """Test that shards merge to the whole and survive JSON storage"""
+        items = zipf_items(3000)
+        shards = [ExactTopK(10).update(items[i:i + 1000]) for i in range(0, 3000, 1000)]
+
+        merged = load_top_k(json.loads(json.dumps(shards[0].to_dict())))
+        for shard in shards[1:]:
+            merged.merge(shard)
+
+        assert merged.top() == ExactTopK(10).update(items).top()
+
+
+class TestApproximateTopK:
+
+    def test_finds_heavy_hitters(self):
+        """Test that the sketch ranks the true top items and never undercounts"""
+        items = zipf_items(50000)
+        exact = Counter(items)
+
+        sketch = ApproximateTopK(10).update(items)
+
+        assert [item for item, _ in sketch.top(5)] == [item for item, _ in exact.most_common(5)]
+        for item, estimate in sketch.top():
+            assert exact[item] <= estimate <= exact[item] + 0.01 * len(items)
+
+    def test_accepts_counts(self):
+        """Test that a mapping of counts is added like the items themselves"""
+        items = zipf_items(2000)
+
+        from_counts = ApproximateTopK(5).update(Counter(items))
+        from_items = ApproximateTopK(5).update(items)
+
+        assert from_counts.table == from_items.table
+        assert from_counts.top() == from_items.top()
+
+    def test_merge_equals_single_sketch(self):
+        """Test that merging per-day sketches gives the same table as one sketch"""
+        items = zipf_items(20000)
+        days = [ApproximateTopK(10).update(items[i:i + 2000]) for i in range(0, 20000, 2000)]
+
+        merged = days[0]
+        for day in days[1:]:
+            merged.merge(day)
+        whole = ApproximateTopK(10).update(items)
+
+        assert merged.table == whole.table
+        assert merged.total == whole.total == 20000
+        assert merged.top(5) == whole.top(5)
+
+    def test_round_trip(self):
+        """Test that a stored sketch keeps counting where it left off"""
+        sketch = ApproximateTopK(3, width=64, depth=3).update(zipf_items(500))
+
+        restored = load_top_k(json.loads(json.dumps(sketch.to_dict())))
+        restored.add("item_1", 5)
+        sketch.add("item_1", 5)
+
+        assert isinstance(restored, ApproximateTopK)
+        assert restored.table == sketch.table
+        assert restored.top() == sketch.top()
+
+    def test_merge_rejects_different_shapes(self):
+        """Test that sketches of different widths cannot be merged"""
+        with pytest.raises(ValueError):
+            ApproximateTopK(width=64).merge(ApproximateTopK(width=128))
+
+
+def test_create_top_k():
+    """Test mode selection and the error for unknown modes"""
+    assert isinstance(create_top_k("exact"), ExactTopK)
+    assert isinstance(create_top_k("approximate", 5), ApproximateTopK)
+    with pytest.raises(ValueError):
+        create_top_k("fuzzy")
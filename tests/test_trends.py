@@ -0,0 +1,151 @@
+import pytest
+from datetime import date, datetime
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from database import upsert_statement
+from db_service import DatabaseService
+from models import User, UserAnalysis, UserGenre, UserTopArtist, UserTopTrack, UserTrend
+from trends import TREND_METRICS, TrendRollup, period_start, trend_change
+
+USER = "trend_user"
+
+
+@pytest.fixture
+def trend_db(test_db):
+    """Session with a user whose analyses and trends are removed afterwards"""
+    DatabaseService(test_db).get_or_create_user({"id": USER, "display_name": "Trend User"})
+    test_db.commit()
+
+    yield test_db
+
+    test_db.rollback()
+    for model in (UserTopArtist, UserTopTrack, UserGenre, UserTrend, UserAnalysis):
+        test_db.query(model).filter(model.user_id == USER).delete()
+    test_db.query(User).filter(User.spotify_user_id == USER).delete()
+    test_db.commit()
+
+
+def store(db, when, uniqueness, unique_artists=10, days_back=30):
+    with patch("db_service.datetime") as mock_datetime:
+        mock_datetime.utcnow.return_value = when
+        return DatabaseService(db).store_analysis(USER, {
+            "uniqueness_score": {"uniqueness_score": uniqueness},
+            "listening_history": {"unique_artists": unique_artists}
+        }, days_back)
+
+
+def trend(db, period, start, metric="uniqueness_score", days_back=30):
+    return db.query(UserTrend).filter_by(user_id=USER, days_back=days_back, period=period, period_start=start,
+                                         metric_name=metric).one()
+
+
+class TestTrendRollup:
+
+    def test_period_start(self):
+        """Test week (ISO, Monday) and month bucketing"""
+        when = datetime(2024, 3, 14, 23, 59)
+
+        assert period_start("week", when) == date(2024, 3, 11)
+        assert period_start("month", when) == date(2024, 3, 1)
+        with pytest.raises(ValueError):
+            period_start("day", when)
+
+    def test_trend_change(self):
+        """Test percentage change and direction, with a stable band"""
+        assert trend_change(None, 5) == (None, "stable")
+        assert trend_change(0.5, 0.6) == (pytest.approx(20), "up")
+        assert trend_change(0.5, 0.4) == (pytest.approx(-20), "down")
+        assert trend_change(100, 100.5)[1] == "stable"
+
+    def test_analyses_in_one_week_average(self, trend_db):
+        """Test that a bucket keeps the running mean of its analyses"""
+        store(trend_db, datetime(2024, 3, 11, 9), 0.4)
+        store(trend_db, datetime(2024, 3, 14, 9), 0.6)
+
+        row = trend(trend_db, "week", date(2024, 3, 11))
+
+        assert row.sample_count == 2
+        assert row.metric_value == pytest.approx(0.5)
+        assert (row.year, row.week, row.month) == (2024, 11, None)
+        assert trend(trend_db, "month", date(2024, 3, 1)).metric_value == pytest.approx(0.5)
+
+    def test_windows_have_separate_buckets(self, trend_db):
+        """Test that 7-day and 30-day analyses are not averaged together"""
+        store(trend_db, datetime(2024, 3, 11, 9), 0.4, unique_artists=5, days_back=7)
+        store(trend_db, datetime(2024, 3, 12, 9), 0.6, unique_artists=40)
+        store(trend_db, datetime(2024, 3, 13, 9), None, unique_artists=50, days_back=None)
+
+        assert trend(trend_db, "week", date(2024, 3, 11), "unique_artists", days_back=7).metric_value == 5
+        assert trend(trend_db, "week", date(2024, 3, 11), "unique_artists").metric_value == 40
+        assert trend_db.query(UserTrend).filter_by(user_id=USER, days_back=None).count() == 0
+        weekly = TrendRollup(trend_db).get_trends(USER, "week", metric="unique_artists", days_back=7,
+                                                  now=datetime(2024, 3, 15))
+        assert [t["value"] for t in weekly["unique_artists"]] == [5]
+
+    @pytest.mark.parametrize("native_upsert", [True, False])
+    def test_counters_are_incremented_in_the_database(self, trend_db, test_engine, native_upsert):
+        """Test that buckets are upserted with increments, and the ORM fallback gives the same rows"""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(test_engine, "before_cursor_execute", record)
+        try:
+            with patch("trends.upsert_statement", **({"wraps": upsert_statement} if native_upsert
+                                                     else {"return_value": None})):
+                store(trend_db, datetime(2024, 3, 11, 9), 0.4)
+                store(trend_db, datetime(2024, 3, 12, 9), 0.8)
+        finally:
+            event.remove(test_engine, "before_cursor_execute", record)
+
+        row = trend(trend_db, "week", date(2024, 3, 11))
+        assert (row.sample_count, row.metric_sum) == (2, pytest.approx(1.2))
+        assert row.metric_value == pytest.approx(0.6)
+        upserts = [s for s in statements if s.startswith("INSERT INTO user_trends") and "ON CONFLICT" in s]
+        assert bool(upserts) == native_upsert
+
+    def test_change_from_previous_bucket(self, trend_db):
+        """Test that each bucket compares with the latest earlier one, skipping empty weeks"""
+        store(trend_db, datetime(2024, 3, 4, 9), 0.5, unique_artists=20)
+        store(trend_db, datetime(2024, 3, 20, 9), 0.75, unique_artists=20)
+
+        row = trend(trend_db, "week", date(2024, 3, 18))
+        artists = trend(trend_db, "week", date(2024, 3, 18), "unique_artists")
+
+        assert row.change_from_previous == pytest.approx(50)
+        assert row.trend_direction == "up"
+        assert artists.trend_direction == "stable"
+        assert trend(trend_db, "week", date(2024, 3, 4)).change_from_previous is None
+
+    def test_only_the_new_buckets_are_written(self, trend_db):
+        """Test that storing an analysis leaves earlier buckets untouched"""
+        store(trend_db, datetime(2024, 1, 8, 9), 0.3)
+        first = trend(trend_db, "week", date(2024, 1, 8))
+        updated_at = first.updated_at
+
+        store(trend_db, datetime(2024, 2, 5, 9), 0.9)
+
+        trend_db.refresh(first)
+        assert first.updated_at == updated_at and first.sample_count == 1
+        assert trend_db.query(UserTrend).filter_by(user_id=USER, metric_name="uniqueness_score").count() == 4
+
+    def test_get_trends(self, trend_db):
+        """Test that trends come back per metric, oldest first, within the limit"""
+        store(trend_db, datetime(2024, 1, 10, 9), 0.2)
+        store(trend_db, datetime(2024, 2, 10, 9), 0.4)
+        store(trend_db, datetime(2024, 3, 10, 9), 0.8)
+
+        monthly = TrendRollup(trend_db).get_trends(USER, "month", limit=2, metric="uniqueness_score",
+                                                   now=datetime(2024, 3, 15))
+        weekly = TrendRollup(trend_db).get_trends(USER, "week", limit=10, now=datetime(2024, 3, 15))
+
+        assert list(monthly) == ["uniqueness_score"]
+        assert [(t["period_start"], t["value"], t["trend_direction"]) for t in monthly["uniqueness_score"]] == [
+            ("2024-02-01", pytest.approx(0.4), "up"), ("2024-03-01", pytest.approx(0.8), "up")
+        ]
+        assert monthly["uniqueness_score"][1]["change_from_previous"] == pytest.approx(100)
+        assert set(weekly) == set(TREND_METRICS)
+        assert [t["period_start"] for t in weekly["uniqueness_score"]] == ["2024-01-08", "2024-02-05", "2024-03-04"]
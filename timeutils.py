@@ -0,0 +1,110 @@
+"""played_at timestamps as integer epoch milliseconds
+
+Spotify returns played_at as ISO-8601 UTC strings. They are parsed once, when
+a page of plays is ingested, and kept on each play under PLAYED_AT_MS, so the
+history cursor and hour/weekday bucketing work on integers instead of
+reparsing the string. TimeBuckets maps those integers to local hours and
+weekdays in a user's timezone, caching the UTC offset per quarter hour.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+PLAYED_AT_MS = "played_at_ms"
+
+MS_PER_QUARTER = 15 * 60 * 1000
+MS_PER_HOUR = 3600 * 1000
+MS_PER_DAY = 24 * MS_PER_HOUR
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_ONE_MS = timedelta(milliseconds=1)
+
+# datetime.strftime("%A") names indexed by weekday (Monday is 0)
+WEEKDAY_NAMES = [datetime(1970, 1, 5 + i).strftime("%A") for i in range(7)]
+
+
+def parse_played_at_ms(value: str) -> int:
+    """Epoch milliseconds of an ISO-8601 timestamp; naive values are taken as UTC
+
+    Integer arithmetic on the timedelta keeps the result exact, unlike
+    timestamp() * 1000.
+    """
+    played_at = datetime.fromisoformat(value)
+    if played_at.tzinfo is None:
+        played_at = played_at.replace(tzinfo=timezone.utc)
+    return (played_at - _EPOCH) // _ONE_MS
+
+
+def played_at_ms(play: Dict) -> int:
+    """A play's played_at in epoch ms, parsed on first use and kept on the play"""
+    value = play.get(PLAYED_AT_MS)
+    if value is None:
+        value = play[PLAYED_AT_MS] = parse_played_at_ms(play["played_at"])
+    return value
+
+
+def normalize_plays(plays: Iterable[Dict]) -> List[Dict]:
+    """Add PLAYED_AT_MS to every play that has a played_at; returns the plays"""
+    plays = list(plays)
+    for play in plays:
+        if PLAYED_AT_MS not in play and play.get("played_at"):
+            play[PLAYED_AT_MS] = parse_played_at_ms(play["played_at"])
+    return plays
+
+
+def resolve_timezone(name: Optional[str]) -> Optional[ZoneInfo]:
+    """ZoneInfo for an IANA name, None for UTC or no name; ValueError if unknown"""
+    if not name or name.upper() == "UTC":
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {name}")
+
+
+class TimeBuckets:
+    """Local hour of day and weekday for epoch milliseconds in one timezone
+
+    Offset changes do not all fall on whole UTC hours (America/St_Johns
+    moves at 05:30 UTC, Australia/Lord_Howe at 15:30 UTC), but current ones
+    fall on quarter hours, so the offset is looked up once per UTC quarter
+    hour and reused for every play in it. A quarter hour whose start and end
+    offsets differ is not cached, and its plays are looked up one by one.
+    """
+
+    def __init__(self, tz: Optional[str] = None):
+        self.name = tz or "UTC"
+        self.zone = resolve_timezone(tz)
+        self._offsets: Dict[int, Optional[int]] = {}
+
+    def _lookup(self, ms: int) -> int:
+        local = (_EPOCH + ms * _ONE_MS).astimezone(self.zone)
+        return local.utcoffset() // _ONE_MS
+
+    def quarter_offset_ms(self, quarter: int) -> Optional[int]:
+        """UTC offset in ms throughout a UTC quarter hour (ms // MS_PER_QUARTER),
+        or None when the offset changes inside it"""
+        if self.zone is None:
+            return 0
+        if quarter not in self._offsets:
+            start = self._lookup(quarter * MS_PER_QUARTER)
+            end = self._lookup((quarter + 1) * MS_PER_QUARTER - 1)
+            self._offsets[quarter] = start if start == end else None
+        return self._offsets[quarter]
+
+    def offset_ms(self, ms: int) -> int:
+        """UTC offset in ms at the given instant"""
+        offset = self.quarter_offset_ms(ms // MS_PER_QUARTER)
+        return self._lookup(ms) if offset is None else offset
+
+    def hour_and_weekday(self, ms: int) -> Tuple[int, int]:
+        """Local hour (0-23) and weekday (Monday is 0) of an instant"""
+        local = ms + self.offset_ms(ms)
+        # 1970-01-01 was a Thursday (weekday 3)
+        return (local // MS_PER_HOUR) % 24, (local // MS_PER_DAY + 3) % 7
+
+    def hour(self, ms: int) -> int:
+        return self.hour_and_weekday(ms)[0]
+
+    def weekday_name(self, ms: int) -> str:
+        return WEEKDAY_NAMES[self.hour_and_weekday(ms)[1]]
@@ -0,0 +1,190 @@
+"""Mergeable top-K accumulators for most-played tracks and artists
+
+Two interchangeable modes, picked per call with create_top_k:
+
+- "exact": full counts with the top K taken by a bounded heap
+  (heapq.nlargest), so nothing sorts the whole counter. Results equal
+  Counter.most_common, ties included.
+- "approximate": a count-min sketch plus a small set of heavy-hitter
+  candidates. Memory is fixed by width, depth and capacity whatever the
+  number of distinct items. Estimates never undercount, and overcount by at
+  most e / width * total with probability at least 1 - exp(-depth). The
+  defaults (2048 x 4) give 0.13% of all plays with 98% confidence.
+
+Both merge with another accumulator of the same mode and shape, for
+partial results per shard, day or time window. Both round-trip through
+to_dict / load_top_k for JSON storage.
+"""
+import hashlib
+import heapq
+import os
+from collections import Counter
+from operator import itemgetter
+from typing import Dict, Iterable, List, Mapping, Tuple, Union
+
+# "exact" (default) or "approximate"
+TOP_K_MODE = os.getenv("TOP_K_MODE", "exact").lower()
+
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+
+
+class ExactTopK:
+    """Exact counts; the top K comes from a heap over them"""
+
+    mode = "exact"
+
+    def __init__(self, k: int = 10):
+        self.k = k
+        self.counts = Counter()
+
+    def add(self, item: str, count: int = 1):
+        self.counts[item] += count
+
+    def update(self, items: Union[Iterable[str], Mapping[str, int]]) -> "ExactTopK":
+        """Count each item of an iterable, or add a mapping of item counts"""
+        self.counts.update(items)
+        return self
+
+    def merge(self, other: "ExactTopK") -> "ExactTopK":
+        """Add other's counts into this accumulator and return it"""
+        self.counts.update(other.counts)
+        return self
+
+    def estimate(self, item: str) -> int:
+        return self.counts[item]
+
+    def top(self, n: int = None) -> List[Tuple[str, int]]:
+        """The n (default k) most counted items, ties in first-counted order"""
+        return heapq.nlargest(n or self.k, self.counts.items(), key=itemgetter(1))
+
+    def to_dict(self) -> Dict:
+        return {"mode": self.mode, "k": self.k, "counts": dict(self.counts)}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ExactTopK":
+        accumulator = cls(data.get("k", 10))
+        accumulator.counts = Counter(data.get("counts", {}))
+        return accumulator
+
+
+class ApproximateTopK:
+    """Count-min sketch with heavy-hitter candidates, in fixed memory
+
+    The sketch counts every item; the candidates are the capacity items
+    (4 * k by default) with the highest estimates seen so far, and top()
+    ranks them. Hash positions come from BLAKE2b, so sketches built in
+    different processes line up and can be merged.
+    """
+
+    mode = "approximate"
+
+    def __init__(self, k: int = 10, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH, capacity: int = None):
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity or 4 * k
+        self.total = 0
+        self.table = [[0] * width for _ in range(depth)]
+        self.candidates: Dict[str, int] = {}
+        # Lower bound on the smallest candidate estimate (estimates only grow)
+        self._floor = 0
+
+    def _positions(self, item: str) -> List[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, item: str, count: int = 1):
+        self.total += count
+        estimate = None
+        for row, position in zip(self.table, self._positions(item)):
+            row[position] += count
+            if estimate is None or row[position] < estimate:
+                estimate = row[position]
+        self._offer(item, estimate)
+
+    def _offer(self, item: str, estimate: int):
+        """Keep item as a candidate if it beats the weakest one"""
+        if item in self.candidates or len(self.candidates) < self.capacity:
+            self.candidates[item] = estimate
+            return
+        if estimate <= self._floor:
+            return
+        weakest = min(self.candidates, key=self.candidates.get)
+        self._floor = self.candidates[weakest]
+        if estimate > self._floor:
+            del self.candidates[weakest]
+            self.candidates[item] = estimate
+
+    def update(self, items: Union[Iterable[str], Mapping[str, int]]) -> "ApproximateTopK":
+        """Count each item of an iterable, or add a mapping of item counts"""
+        if isinstance(items, Mapping):
+            for item, count in items.items():
+                self.add(item, count)
+        else:
+            for item in items:
+                self.add(item)
+        return self
+
+    def merge(self, other: "ApproximateTopK") -> "ApproximateTopK":
+        """Add other's sketch into this one and re-rank the union of candidates"""
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge sketches of different sizes")
+        self.total += other.total
+        for row, other_row in zip(self.table, other.table):
+            for position, count in enumerate(other_row):
+                if count:
+                    row[position] += count
+        merged = {item: self.estimate(item) for item in {**self.candidates, **other.candidates}}
+        self.candidates = dict(heapq.nlargest(self.capacity, merged.items(), key=itemgetter(1)))
+        self._floor = 0
+        return self
+
+    def estimate(self, item: str) -> int:
+        """Upper bound on item's count, within the sketch's error bound"""
+        return min(row[position] for row, position in zip(self.table, self._positions(item)))
+
+    def top(self, n: int = None) -> List[Tuple[str, int]]:
+        """The n (default k) candidates with the highest estimated counts"""
+        estimates = ((item, self.estimate(item)) for item in self.candidates)
+        return heapq.nlargest(n or self.k, estimates, key=itemgetter(1))
+
+    def to_dict(self) -> Dict:
+        return {"mode": self.mode, "k": self.k, "width": self.width, "depth": self.depth,
+                "capacity": self.capacity, "total": self.total, "table": self.table,
+                "candidates": dict(self.candidates)}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ApproximateTopK":
+        accumulator = cls(data.get("k", 10), data["width"], data["depth"], data.get("capacity"))
+        accumulator.total = data.get("total", 0)
+        accumulator.table = [list(row) for row in data["table"]]
+        accumulator.candidates = dict(data.get("candidates", {}))
+        return accumulator
+
+
+TOP_K_MODES = {ExactTopK.mode: ExactTopK, ApproximateTopK.mode: ApproximateTopK}
+
+
+def create_top_k(mode: str = None, k: int = 10) -> Union[ExactTopK, ApproximateTopK]:
+    """A top-K accumulator for mode (default TOP_K_MODE); ValueError if unknown"""
+    mode = mode or TOP_K_MODE
+    if mode not in TOP_K_MODES:
+        raise ValueError(f"Unknown top-k mode: {mode}")
+    return TOP_K_MODES[mode](k)
+
+
+def top_items(counts: Mapping[str, int], n: int = 10, mode: str = None) -> List[Tuple[str, int]]:
+    """The n largest entries of a mapping of counts, exactly or from a sketch"""
+    mode = mode or TOP_K_MODE
+    if mode == ExactTopK.mode:
+        # Same as Counter.most_common(n), without copying the counts
+        return heapq.nlargest(n, counts.items(), key=itemgetter(1))
+    return create_top_k(mode, n).update(counts).top(n)
+
+
+def load_top_k(data: Dict) -> Union[ExactTopK, ApproximateTopK]:
+    """Rebuild an accumulator stored with to_dict"""
+    return TOP_K_MODES[data["mode"]].from_dict(data)
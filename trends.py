@@ -0,0 +1,182 @@
+"""Weekly and monthly trend rollups of stored analyses
+
+Each stored analysis is folded into one UserTrend row per metric for its
+week (ISO, starting Monday) and its month, separately for each analysis
+window (days_back), so 7-day and 90-day analyses do not share a trend. The
+row keeps the running sum and sample count, so its mean is updated in
+place, and its change from the previous bucket of the same period. Storing
+an analysis only touches its own two buckets, and /user/trends reads the
+pre-aggregated rows with one indexed query however many analyses a user
+has.
+"""
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from database import upsert_statement
+from models import UserAnalysis, UserTrend
+
+# Trend metric name -> UserAnalysis column
+TREND_METRICS = {
+    "uniqueness_score": "uniqueness_score",
+    "genre_diversity": "genre_diversity_score",
+    "obscurity_score": "obscurity_score",
+    "unique_tracks": "unique_tracks",
+    "unique_artists": "unique_artists",
+    "unique_genres": "unique_genres",
+    "repetition_rate": "repetition_rate",
+    "avg_popularity": "avg_popularity",
+    "explicit_percentage": "explicit_percentage"
+}
+
+TREND_PERIODS = ("week", "month")
+
+# Columns of ix_user_trends_bucket, which identify a bucket's row for a metric
+BUCKET_COLUMNS = ["user_id", "days_back", "period", "metric_name", "period_start"]
+
+# Changes smaller than this many percent count as stable
+STABLE_THRESHOLD = 1.0
+
+
+def period_start(period: str, when: datetime) -> date:
+    """First day of the week (Monday) or month containing when"""
+    day = when.date()
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown trend period: {period}")
+
+
+def trend_change(previous: Optional[float], current: float) -> Tuple[Optional[float], str]:
+    """Percentage change from previous and its direction (up, down or stable)"""
+    if not previous:
+        return None, "stable"
+    change = (current - previous) / abs(previous) * 100
+    if change > STABLE_THRESHOLD:
+        return change, "up"
+    if change < -STABLE_THRESHOLD:
+        return change, "down"
+    return change, "stable"
+
+
+class TrendRollup:
+    """Maintain and read one database session's trend rows"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def add_analysis(self, analysis: UserAnalysis):
+        """Fold a new analysis into its week and month buckets (flushed, not committed)
+        
+        With a native upsert the sample count and sum are incremented in the
+        database, so analyses of one user stored concurrently neither lose an
+        update nor collide on the bucket's unique index. Analyses are stored
+        as they are computed, so their buckets are the latest ones and no
+        later bucket's change needs recomputing. Analyses without a window
+        are not rolled up.
+        """
+        if analysis.days_back is None:
+            return
+        values = {metric: getattr(analysis, column) for metric, column in TREND_METRICS.items()
+                  if getattr(analysis, column) is not None}
+        if not values:
+            return
+        stmt = upsert_statement(UserTrend, None, BUCKET_COLUMNS, ["updated_at"], self.db.get_bind(),
+                                increment_columns=["sample_count", "metric_sum"])
+        for period in TREND_PERIODS:
+            bucket = self._bucket(analysis, period)
+            previous = self._previous_values(bucket)
+            if stmt is None:
+                self._add_to_rows(bucket, values, previous)
+                continue
+            
+            now = datetime.utcnow()
+            self.db.execute(stmt, [{**bucket, "metric_name": metric, "sample_count": 1, "metric_sum": value,
+                                    "metric_value": value, "updated_at": now}
+                                   for metric, value in values.items()])
+            # The upsert holds the rows' locks, so these totals include every analysis before this one
+            totals = self.db.execute(
+                select(UserTrend.id, UserTrend.metric_name, UserTrend.sample_count, UserTrend.metric_sum)
+                .where(*self._bucket_filter(bucket), UserTrend.period_start == bucket["period_start"],
+                       UserTrend.metric_name.in_(values)))
+            changes = []
+            for row_id, metric, count, total in totals:
+                mean = total / count
+                change, direction = trend_change(previous.get(metric), mean)
+                changes.append({"id": row_id, "metric_value": mean, "change_from_previous": change,
+                                "trend_direction": direction})
+            self.db.execute(update(UserTrend), changes)
+        self.db.flush()
+    
+    @staticmethod
+    def _bucket(analysis: UserAnalysis, period: str) -> Dict[str, Any]:
+        """Key and calendar fields of the analysis's bucket for period"""
+        start = period_start(period, analysis.analysis_date)
+        iso_year, iso_week, _ = start.isocalendar()
+        return {"user_id": analysis.user_id, "days_back": analysis.days_back, "period": period,
+                "period_start": start, "year": iso_year if period == "week" else start.year,
+                "month": start.month if period == "month" else None,
+                "week": iso_week if period == "week" else None}
+    
+    @staticmethod
+    def _bucket_filter(bucket: Dict[str, Any]) -> List:
+        """Conditions selecting every bucket of the same user, window and period"""
+        return [UserTrend.user_id == bucket["user_id"], UserTrend.days_back == bucket["days_back"],
+                UserTrend.period == bucket["period"]]
+    
+    def _add_to_rows(self, bucket: Dict[str, Any], values: Dict[str, float], previous: Dict[str, float]):
+        """Update the bucket through the ORM, for dialects without a native upsert"""
+        rows = {row.metric_name: row for row in self.db.query(UserTrend).filter(
+            *self._bucket_filter(bucket), UserTrend.period_start == bucket["period_start"])}
+        for metric, value in values.items():
+            row = rows.get(metric)
+            if row is None:
+                row = UserTrend(**bucket, metric_name=metric, sample_count=0, metric_sum=0.0)
+                self.db.add(row)
+            row.sample_count += 1
+            row.metric_sum += value
+            row.metric_value = row.metric_sum / row.sample_count
+            row.change_from_previous, row.trend_direction = trend_change(previous.get(metric), row.metric_value)
+    
+    def _previous_values(self, bucket: Dict[str, Any]) -> Dict[str, float]:
+        """Metric values of the latest bucket before this one"""
+        conditions = self._bucket_filter(bucket)
+        previous_start = (self.db.query(func.max(UserTrend.period_start))
+                          .filter(*conditions, UserTrend.period_start < bucket["period_start"])
+                          .scalar())
+        if previous_start is None:
+            return {}
+        return dict(self.db.query(UserTrend.metric_name, UserTrend.metric_value)
+                    .filter(*conditions, UserTrend.period_start == previous_start))
+    
+    def get_trends(self, user_id: str, period: str = "week", limit: int = 12, metric: Optional[str] = None,
+                   days_back: int = 30, now: Optional[datetime] = None) -> Dict[str, List[Dict]]:
+        """The last limit weeks or months up to now of each metric (or just metric), oldest first
+        
+        Only analyses over a days_back window are included.
+        """
+        since = period_start(period, now or datetime.utcnow())
+        for _ in range(max(limit, 1) - 1):
+            since = period_start(period, datetime.combine(since - timedelta(days=1), datetime.min.time()))
+
+        query = self.db.query(UserTrend).filter(UserTrend.user_id == user_id, UserTrend.days_back == days_back,
+                                                UserTrend.period == period, UserTrend.period_start >= since)
+        if metric is not None:
+            query = query.filter(UserTrend.metric_name == metric)
+
+        trends: Dict[str, List[Dict]] = {}
+        for row in query.order_by(UserTrend.metric_name, UserTrend.period_start):
+            trends.setdefault(row.metric_name, []).append({
+                "period_start": row.period_start.isoformat(),
+                "year": row.year,
+                "month": row.month,
+                "week": row.week,
+                "value": row.metric_value,
+                "analyses": row.sample_count,
+                "change_from_previous": row.change_from_previous,
+                "trend_direction": row.trend_direction
+            })
+        return trends